@@ -214,15 +214,20 @@
 # if __name__ == "__main__":
 #     poll_and_download("takeout")
 
-import os, json, time, zipfile, requests
+import os, io, json, time, zipfile, requests
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
 from googleapiclient.errors import HttpError
 from google.oauth2.credentials import Credentials
+from getTransactions import extract_completed_transactions
+from run_manifest import RunManifest
 
 SCOPES = ['https://www.googleapis.com/auth/drive']
 TOKENS_DIR = "tokens"
 ENDPOINT_URL = "http://api:8000/classify"
+RECORDS_ENDPOINT_URL = "http://api:8000/classify-records"
+TRANSACTIONS_FILE = "new_transactions.json"
+IMPORT_MANIFEST_FILE = "takeout_import_manifest.jsonl"
 
 def load_tokens(user_id: str):
     path = os.path.join(TOKENS_DIR, f"{user_id}.json")
@@ -302,39 +307,60 @@ def keep_only_one_takeout_file():
     return os.path.abspath(to_keep)
 
 def extract_my_activity(zip_path, target_filename="My Activity.html"):
-    """Extracts 'My Activity.html' from the given zip file, replaces existing one, and deletes the zip."""
+    """
+    Streams 'My Activity.html' from the given zip file straight into the Takeout
+    parser, posts the new transactions to the API batch by batch, and deletes the zip.
+    Nothing is extracted to disk; the zip is kept if any batch could not be posted,
+    and the import manifest lets the next attempt skip the batches that were.
+    """
     try:
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
             for member in zip_ref.namelist():
                 if member.endswith(target_filename):
-                    extracted_path = os.path.join(os.getcwd(), target_filename)
-
-                    # Overwrite existing My Activity.html
-                    with zip_ref.open(member) as source, open(extracted_path, "wb") as target:
-                        target.write(source.read())
-
-                    print(f"Extracted {target_filename} to {extracted_path}")
-
-                    # 🔥 Call backend classify endpoint
-                    try:
-                        response = requests.post(ENDPOINT_URL)
-                        print(f"Called endpoint {ENDPOINT_URL}, status: {response.status_code}")
-                    except Exception as e:
-                        print(f"Failed to call endpoint: {e}")
-
-                    # ✅ Delete the zip after extraction
+                    print(f"Parsing {member} from {zip_path}")
+                    sent = 0
+                    failed = False
+                    manifest = RunManifest.open(IMPORT_MANIFEST_FILE, member, TRANSACTIONS_FILE)
+
+                    with zip_ref.open(member) as source:
+                        html = io.TextIOWrapper(source, encoding="utf-8")
+                        for batch in extract_completed_transactions(
+                            html, json_file=None, latest_date=manifest.latest_date, incremental=True
+                        ):
+                            batch = manifest.pending(batch)
+                            if not batch:
+                                continue
+                            # 🔥 Hand the parsed records to the backend for classification
+                            try:
+                                response = requests.post(RECORDS_ENDPOINT_URL, json=batch)
+                                print(f"Called endpoint {RECORDS_ENDPOINT_URL} with {len(batch)} records, status: {response.status_code}")
+                                if response.status_code == 200:
+                                    manifest.mark_done(batch)
+                                    sent += len(batch)
+                                else:
+                                    failed = True
+                            except Exception as e:
+                                print(f"Failed to call endpoint: {e}")
+                                failed = True
+
+                    if failed:
+                        print(f"Keeping zip file {zip_path} since some records were not classified")
+                        return sent
+                    manifest.finish()
+
+                    # ✅ Delete the zip after parsing
                     try:
                         os.remove(zip_path)
                         print(f"Deleted zip file: {zip_path}")
                     except Exception as e:
                         print(f"Could not delete zip {zip_path}: {e}")
 
-                    return extracted_path
+                    return sent
 
         print(f"{target_filename} not found in {zip_path}")
         return None
     except Exception as e:
-        print(f"Error extracting {target_filename}: {e}")
+        print(f"Error reading {target_filename}: {e}")
         return None
 
 def poll_and_download(user_id: str, folder_name="takeout"):
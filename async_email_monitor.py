@@ -0,0 +1,233 @@
+"""
+Asyncio email monitor: IMAP IDLE sessions for every user on one event loop.
+
+email_monitor.main holds a blocking IMAPClient and an OS thread per token
+file, which stops scaling after a few dozen mailboxes. Here each mailbox is a
+MailboxMonitor coroutine on a shared event loop. Each one refreshes its own
+token and reconnects with its own backoff. Fetched alerts go to the same
+classification workers (email_monitor.EmailPipeline) as in the threaded
+monitor. With EMAIL_MONITOR_SHARDS > 1, users are split across that many
+processes by a stable hash of their address.
+
+Run with ``python async_email_monitor.py``, or set EMAIL_MONITOR_ASYNC=1 for
+``python email_monitor.py``.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import random
+import zlib
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from async_imap import AsyncIMAPClient, IMAPError
+from email_monitor import (
+    ALERT_FETCH_ITEMS,
+    EMAIL_FETCH_BATCH,
+    EMAIL_FLAG_INTERVAL,
+    IMAP_HOST,
+    IMAP_PORT,
+    IMAP_SSL,
+    TOKENS_DIR,
+    MailboxState,
+    body_sections,
+    close_email_pipeline,
+    fetched_item,
+    get_email_pipeline,
+    get_valid_credentials,
+    partial_emails,
+    sender_criteria,
+)
+
+EMAIL_MONITOR_SHARDS = int(os.getenv("EMAIL_MONITOR_SHARDS", "1"))  # processes the users are split across
+IDLE_TIMEOUT = 29 * 60  # servers drop IDLE after 30 minutes
+TOKEN_REFRESH_MARGIN = 5 * 60  # reconnect with a fresh token this many seconds before it expires
+RECONNECT_BACKOFF_BASE = 1.0
+RECONNECT_BACKOFF_MAX = 300.0
+NO_CREDENTIALS_WAIT = 60
+STARTUP_SPREAD = float(os.getenv("EMAIL_MONITOR_STARTUP_SPREAD", "10"))  # seconds the first logins are spread over
+
+
+def token_seconds_left(creds) -> Optional[float]:
+    """Seconds until the access token expires, or None if the expiry is unknown."""
+    expiry = getattr(creds, "expiry", None)
+    if expiry is None:
+        return None
+    # google-auth keeps expiry as naive UTC
+    return (expiry - datetime.now(timezone.utc).replace(tzinfo=None)).total_seconds()
+
+
+class MailboxMonitor:
+    def __init__(self, user_id: str, pipeline=None, host: str = IMAP_HOST, port: int = IMAP_PORT, ssl: bool = IMAP_SSL):
+        self.user_id = user_id
+        self.pipeline = pipeline or get_email_pipeline()
+        self.host = host
+        self.port = port
+        self.ssl = ssl
+        self.failures = 0
+        self.connected = False
+        self.state = MailboxState(user_id)
+
+    def backoff(self) -> float:
+        """Exponential backoff with full jitter, so a server outage doesn't bring every user back at once."""
+        delay = min(RECONNECT_BACKOFF_MAX, RECONNECT_BACKOFF_BASE * 2 ** self.failures)
+        return random.uniform(delay / 2, delay)
+
+    async def run(self):
+        """Monitor the INBOX until cancelled."""
+        while True:
+            # Always get fresh credentials before connecting (force refresh)
+            creds = await asyncio.to_thread(get_valid_credentials, self.user_id, True)
+            if not creds:
+                print(f"No valid credentials for {self.user_id}. Waiting before retry...")
+                await asyncio.sleep(NO_CREDENTIALS_WAIT)
+                continue
+            try:
+                await self.session(creds)
+                # The token is about to expire; log in again with a fresh one
+                self.failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                delay = self.backoff()
+                if isinstance(e, IMAPError) and "AUTHENTICATIONFAILED" in str(e).upper():
+                    print(f"Authentication failed for {self.user_id} ({self.failures}): {e}")
+                else:
+                    print(f"Connection error for {self.user_id} ({self.failures}): {e!r}")
+                print(f"Reconnecting {self.user_id} in {delay:.0f} seconds...")
+                await asyncio.sleep(delay)
+            finally:
+                self.connected = False
+
+    async def session(self, creds):
+        """One IMAP connection, in IDLE until the token is close to expiring."""
+        async with AsyncIMAPClient(self.host, self.port, ssl=self.ssl) as client:
+            await client.oauth2_login(self.user_id, creds.token)
+            select_info = await client.select_folder("INBOX")
+            self.failures = 0
+            self.connected = True
+            # Alerts that arrived while disconnected are fetched before IDLE starts
+            criteria = self.state.begin(select_info)
+            if criteria:
+                uids = self.state.new_uids(await self.search_senders(client, criteria), catch_up=True)
+                print(f"Catch-up for {self.user_id}: {len(uids)} HDFC emails to process")
+                await self.fetch_and_submit(client, uids)
+
+            while True:
+                seen_uids = self.state.finished()
+                if seen_uids:
+                    await client.set_flags(seen_uids, [b"\\Seen"])
+                # Searching before every IDLE, not only after a notification, also catches mail
+                # that arrived while we were busy
+                uids = self.state.new_uids(await self.search_senders(client, self.state.live_criteria()))
+                if uids:
+                    print(f"Found {len(uids)} new HDFC emails for {self.user_id}")
+                    await self.fetch_and_submit(client, uids)
+
+                timeout = EMAIL_FLAG_INTERVAL if self.state.in_flight else IDLE_TIMEOUT
+                seconds_left = token_seconds_left(creds)
+                if seconds_left is not None:
+                    if seconds_left <= TOKEN_REFRESH_MARGIN:
+                        return
+                    timeout = min(timeout, seconds_left - TOKEN_REFRESH_MARGIN)
+
+                await client.idle()
+                await client.idle_check(timeout)
+                await client.idle_done()
+
+    async def search_senders(self, client: AsyncIMAPClient, criteria: list) -> set:
+        return set(await client.search(sender_criteria() + criteria))
+
+    async def fetch_and_submit(self, client: AsyncIMAPClient, uids: List[int]):
+        """Fetch the headers and alert text of ``uids`` EMAIL_FETCH_BATCH at a time, as email_monitor.fetch_and_submit."""
+        for start in range(0, len(uids), EMAIL_FETCH_BATCH):
+            chunk = uids[start:start + EMAIL_FETCH_BATCH]
+            try:
+                fetch_data = await client.fetch(chunk, ALERT_FETCH_ITEMS)
+                bodies = {}
+                for section, section_uids in body_sections(fetch_data).items():
+                    for uid, data in (await client.fetch(section_uids, [f"BODY.PEEK[{section}]"])).items():
+                        bodies[uid] = fetched_item(data, f"BODY[{section}]".encode())
+            except Exception as e:
+                # Retried by the catch-up of the next session
+                print(f"Error fetching emails {chunk[0]}..{chunk[-1]} for {self.user_id}: {e}")
+                self.state.unfetched(uids[start:])
+                raise
+            for uid, raw_email in sorted(partial_emails(fetch_data, bodies).items()):
+                # Blocks while the workers' queue is full, without holding up the other mailboxes
+                await asyncio.to_thread(
+                    self.pipeline.submit, raw_email, uid, self.state.done, self.user_id, self.state.uidvalidity
+                )
+                self.state.in_flight.add(uid)
+
+
+async def monitor_users(users: List[str], **kwargs) -> List[MailboxMonitor]:
+    """Run a MailboxMonitor per user on the current loop until cancelled."""
+    monitors = [MailboxMonitor(user, **kwargs) for user in users]
+
+    async def start(monitor):
+        # Spread the first logins so hundreds of users don't hit the server (and token endpoint) at once
+        await asyncio.sleep(random.uniform(0, STARTUP_SPREAD) if len(monitors) > 1 else 0)
+        await monitor.run()
+
+    await asyncio.gather(*(start(monitor) for monitor in monitors))
+    return monitors
+
+
+def shard_users(users: List[str], shards: int) -> List[List[str]]:
+    """Split users across ``shards`` by a stable hash, so each keeps its shard across restarts."""
+    groups = [[] for _ in range(max(shards, 1))]
+    for user in users:
+        groups[zlib.crc32(user.encode("utf-8")) % len(groups)].append(user)
+    return groups
+
+
+def run_shard(users: List[str]):
+    """Entry point of one monitor process."""
+    print(f"Monitoring {len(users)} user(s) in process {os.getpid()}")
+    try:
+        asyncio.run(monitor_users(users))
+    except KeyboardInterrupt:
+        print("Shutting down email monitor...")
+    finally:
+        close_email_pipeline()
+
+
+def main():
+    """Main entry point for the asyncio email monitor."""
+    print("Starting Email Monitor Service (asyncio)...")
+
+    if not os.path.exists(TOKENS_DIR):
+        print("No users logged in yet. Run /login first.")
+        return
+
+    users = [f.replace(".json", "") for f in os.listdir(TOKENS_DIR) if f.endswith(".json")]
+    if not users:
+        print("No users found. Run /login first.")
+        return
+    print(f"Found {len(users)} user(s) to monitor: {users}")
+
+    shards = [group for group in shard_users(users, EMAIL_MONITOR_SHARDS) if group]
+    if len(shards) == 1:
+        run_shard(shards[0])
+        return
+
+    processes = []
+    for group in shards:
+        process = multiprocessing.Process(target=run_shard, args=(group,), daemon=True)
+        process.start()
+        processes.append(process)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        print("Shutting down all monitors...")
+        # Each shard got the interrupt too and finishes its queued emails
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
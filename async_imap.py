@@ -0,0 +1,251 @@
+"""
+Minimal asyncio IMAP4rev1 client for the asyncio email monitor.
+
+Covers the commands the monitor needs (XOAUTH2 login, SELECT, UID SEARCH,
+UID FETCH, UID STORE, IDLE) with the method names and return shapes of
+IMAPClient, so the async and threaded monitors read the same. Every session
+is a pair of asyncio streams instead of a blocking socket and an OS thread,
+which lets one event loop hold hundreds of mailboxes in IDLE.
+"""
+
+import asyncio
+import base64
+import re
+import ssl as ssl_module
+from typing import Dict, Iterable, List, Optional
+
+LITERAL_PATTERN = re.compile(rb"\{(\d+)\}\r\n$")
+UNTAGGED_NUMBER_PATTERN = re.compile(rb"^\* (\d+) (\w+)")
+RESPONSE_CODE_PATTERN = re.compile(rb"\[(\w+) (\d+)\]")
+FETCH_PATTERN = re.compile(rb"^\* \d+ FETCH ")
+# Parenthesised data: lists, quoted strings, literal markers, and atoms such as BODY[HEADER.FIELDS (FROM)]
+DATA_TOKEN_PATTERN = re.compile(rb'\(|\)|"(?:[^"\\]|\\.)*"|\{\d+\}|[^\s()"\[\]]+(?:\[[^\]]*\](?:<\d+>)?)?')
+ATOM_SPECIALS = re.compile(r'[\s(){%*"\\\]]')
+STREAM_LIMIT = 1024 * 1024  # longest response line (e.g. a SEARCH over a large mailbox)
+
+
+class IMAPError(Exception):
+    pass
+
+
+def quote(value) -> str:
+    """An IMAP atom, or a quoted string when ``value`` has special characters."""
+    value = str(value)
+    if value and not ATOM_SPECIALS.search(value):
+        return value
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def uid_set(uids: Iterable[int]) -> str:
+    return ",".join(str(uid) for uid in uids)
+
+
+class AsyncIMAPClient:
+    def __init__(self, host: str, port: int = 993, ssl: bool = True, timeout: float = 60):
+        self.host = host
+        self.port = port
+        self.ssl = ssl
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._tag = 0
+        self._idle_tag: Optional[str] = None
+        self._pending: List[tuple] = []  # unsolicited responses seen outside IDLE
+
+    async def connect(self):
+        context = ssl_module.create_default_context() if self.ssl else None
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=context, limit=STREAM_LIMIT), self.timeout
+        )
+        greeting, _ = await self._read_response()
+        if not greeting.startswith(b"* OK"):
+            raise IMAPError(f"Unexpected greeting: {greeting!r}")
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.logout()
+
+    async def _read_response(self, first: Optional[bytes] = None):
+        """One response line with its literals: (line without CRLF, keeping the {n} markers, [literal])."""
+        parts = []
+        literals = []
+        line = first if first is not None else await self._reader.readuntil(b"\r\n")
+        while True:
+            match = LITERAL_PATTERN.search(line)
+            parts.append(line[:-2])
+            if not match:
+                return b"".join(parts), literals
+            literals.append(await self._reader.readexactly(int(match.group(1))))
+            line = await self._reader.readuntil(b"\r\n")
+
+    def _send(self, line: str):
+        self._writer.write(line.encode("utf-8") + b"\r\n")
+
+    async def _command(self, command: str, continuation: Optional[bytes] = None) -> List[tuple]:
+        """Send a tagged command; the untagged responses, or IMAPError unless it completes OK."""
+        self._tag += 1
+        tag = f"A{self._tag:04d}"
+        self._send(f"{tag} {command}")
+        await self._writer.drain()
+        untagged = []
+        while True:
+            line, literals = await asyncio.wait_for(self._read_response(), self.timeout)
+            if line.startswith(b"+"):
+                # Only XOAUTH2 failures ask to continue; an empty line gets the tagged NO
+                self._writer.write((continuation or b"") + b"\r\n")
+                await self._writer.drain()
+                continue
+            if line.startswith(tag.encode() + b" "):
+                if line.split(b" ", 2)[1] != b"OK":
+                    raise IMAPError(line.decode("utf-8", "replace"))
+                # New mail announced outside IDLE is handed to the next idle_check
+                for response in (parse_untagged(line) for line, _ in untagged):
+                    if response[1:] == (b"EXISTS",):
+                        self._pending.append(response)
+                return untagged
+            untagged.append((line, literals))
+
+    async def oauth2_login(self, user: str, access_token: str):
+        auth = base64.b64encode(f"user={user}\x01auth=Bearer {access_token}\x01\x01".encode()).decode()
+        await self._command(f"AUTHENTICATE XOAUTH2 {auth}")
+
+    async def select_folder(self, folder: str) -> Dict[bytes, int]:
+        """SELECT ``folder``; EXISTS, UIDNEXT and UIDVALIDITY keyed like IMAPClient."""
+        info = {}
+        for line, _ in await self._command(f"SELECT {quote(folder)}"):
+            number = UNTAGGED_NUMBER_PATTERN.match(line)
+            if number and number.group(2) == b"EXISTS":
+                info[b"EXISTS"] = int(number.group(1))
+            for code, value in RESPONSE_CODE_PATTERN.findall(line):
+                info[code] = int(value)
+        # SELECT can report the new mailbox's EXISTS; that isn't new mail
+        self._pending.clear()
+        return info
+
+    async def search(self, criteria: List) -> List[int]:
+        """UID SEARCH ``criteria`` (IMAPClient-style list); matching UIDs."""
+        uids = []
+        for line, _ in await self._command("UID SEARCH " + " ".join(quote(c) for c in criteria)):
+            if line.startswith(b"* SEARCH"):
+                uids.extend(int(uid) for uid in line[len(b"* SEARCH"):].split())
+        return uids
+
+    async def fetch(self, uids: Iterable[int], items: List[str]) -> Dict[int, Dict[bytes, object]]:
+        """UID FETCH ``items`` of ``uids``; {uid: {item: value}} like IMAPClient, e.g. b"BODY[1]" -> bytes."""
+        uids = list(uids)
+        if not uids:
+            return {}
+        result = {}
+        for line, literals in await self._command(f"UID FETCH {uid_set(uids)} ({' '.join(items)})"):
+            match = FETCH_PATTERN.match(line)
+            if not match:
+                continue
+            values = parse_data(line[match.end():], literals)[0]
+            data = {key.upper(): value for key, value in zip(values[::2], values[1::2])}
+            if b"BODYSTRUCTURE" in data:
+                data[b"BODYSTRUCTURE"] = body_structure(data[b"BODYSTRUCTURE"])
+            if b"UID" in data:
+                result[data[b"UID"]] = data
+        return result
+
+    async def set_flags(self, uids: Iterable[int], flags: List[bytes]):
+        """Replace the flags of ``uids``."""
+        uids = list(uids)
+        if uids:
+            names = " ".join(flag.decode() if isinstance(flag, bytes) else flag for flag in flags)
+            await self._command(f"UID STORE {uid_set(uids)} FLAGS.SILENT ({names})")
+
+    async def idle(self):
+        """Enter IDLE; returns once the server accepts it."""
+        self._tag += 1
+        self._idle_tag = f"A{self._tag:04d}"
+        self._send(f"{self._idle_tag} IDLE")
+        await self._writer.drain()
+        while True:
+            line, _ = await asyncio.wait_for(self._read_response(), self.timeout)
+            if line.startswith(b"+"):
+                return
+            if line.startswith(self._idle_tag.encode() + b" "):
+                raise IMAPError(line.decode("utf-8", "replace"))
+            self._pending.append(parse_untagged(line))
+
+    async def idle_check(self, timeout: float) -> List[tuple]:
+        """Wait up to ``timeout`` seconds for IDLE responses, e.g. [(12, b"EXISTS")]."""
+        if self._pending:
+            responses, self._pending = self._pending, []
+            return responses
+        try:
+            # Only the first read is cancelled on timeout, before any of the line is consumed
+            first = await asyncio.wait_for(self._reader.readuntil(b"\r\n"), timeout)
+        except asyncio.TimeoutError:
+            return []
+        line, _ = await self._read_response(first)
+        return [parse_untagged(line)]
+
+    async def idle_done(self) -> List[tuple]:
+        """Leave IDLE; any responses that arrived meanwhile."""
+        self._send("DONE")
+        await self._writer.drain()
+        responses = []
+        while True:
+            line, _ = await asyncio.wait_for(self._read_response(), self.timeout)
+            if line.startswith(self._idle_tag.encode() + b" "):
+                self._idle_tag = None
+                return responses
+            responses.append(parse_untagged(line))
+
+    async def logout(self):
+        if self._writer is None:
+            return
+        try:
+            if self._idle_tag is None:
+                await asyncio.wait_for(self._command("LOGOUT"), 5)
+        except (IMAPError, OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writer.close()
+            self._writer = None
+
+
+def parse_data(data: bytes, literals: List[bytes]) -> list:
+    """Parenthesised IMAP data as nested lists: bytes for strings and atoms, int for numbers, None for NIL."""
+    literals = iter(literals)
+    stack = [[]]
+    for token in DATA_TOKEN_PATTERN.findall(data):
+        if token == b"(":
+            stack.append([])
+        elif token == b")":
+            inner = stack.pop()
+            stack[-1].append(inner)
+        elif token.startswith(b"{"):
+            stack[-1].append(next(literals))
+        elif token.startswith(b'"'):
+            stack[-1].append(re.sub(rb"\\(.)", rb"\1", token[1:-1]))
+        elif token.upper() == b"NIL":
+            stack[-1].append(None)
+        elif token.isdigit():
+            stack[-1].append(int(token))
+        else:
+            stack[-1].append(token)
+    return stack[0]
+
+
+def body_structure(value: list) -> tuple:
+    """A parsed BODYSTRUCTURE laid out like IMAPClient's BodyData: a multipart's parts gathered in a list first."""
+    count = 0
+    while count < len(value) and isinstance(value[count], list):
+        count += 1
+    if not count:
+        return tuple(value)
+    return ([body_structure(part) for part in value[:count]],) + tuple(value[count:])
+
+
+def parse_untagged(line: bytes) -> tuple:
+    """(12, b"EXISTS") for counted responses like IMAPClient, otherwise (line,)."""
+    match = UNTAGGED_NUMBER_PATTERN.match(line)
+    if match:
+        return int(match.group(1)), match.group(2).upper()
+    return (line,)
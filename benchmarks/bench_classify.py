@@ -0,0 +1,167 @@
+"""
+End-to-end classification throughput against the local Gemini stand-in
+(fake_gemini.py): classify_transactions_gemini over synthetic Takeout records
+and email_monitor.process_email over synthetic HDFC debit alerts.
+
+Each run starts in an empty temporary directory, so the classification and
+LLM response caches start cold; --warm repeats the Takeout run against the
+caches the first run left behind.
+
+Usage: python benchmarks/bench_classify.py [--records N] [--receivers N] [--emails N] [--email-batch N]
+                                           [--latency S] [--error-rate R] [--malformed-rate R]
+                                           [--in-flight N] [--warm] [--verbose]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from email.utils import format_datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+IST = timezone(timedelta(hours=5, minutes=30))
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sept", "Oct", "Nov", "Dec"]
+
+
+def make_batches(n, receivers, batch_size=500):
+    rng = random.Random(0)
+    names = [f"Merchant {i}" for i in range(receivers)]
+    records = []
+    for _ in range(n):
+        day, month, year = rng.randint(1, 28), rng.randint(1, 12), rng.randint(2023, 2025)
+        hour, minute, second = rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59)
+        records.append({
+            "RawText": (
+                f"Paid ₹{rng.randint(1, 5000)}.{rng.randint(0, 99):02d} to {rng.choice(names)} "
+                f"using Bank Account XXXXXX1234 {day} {MONTHS[month - 1]} {year}, "
+                f"{hour:02d}:{minute:02d}:{second:02d} GMT+05:30"
+            ),
+            "Date": f"{year}-{month:02d}-{day:02d} {hour:02d}:{minute:02d}:{second:02d}",
+        })
+    return [records[i:i + batch_size] for i in range(0, len(records), batch_size)]
+
+
+def make_emails(n, receivers):
+    rng = random.Random(1)
+    messages = []
+    for i in range(n):
+        msg = EmailMessage()
+        msg["From"] = "HDFC Bank InstaAlerts <alerts@hdfcbank.net>"
+        msg["Date"] = format_datetime(datetime(2025, 1, 1 + i % 28, i % 24, tzinfo=IST))
+        name = f"Merchant {rng.randrange(receivers)}"
+        msg.set_content(
+            f"Dear Customer, Rs.{rng.randint(1, 5000)}.{rng.randint(0, 99):02d} has been debited from "
+            f"account 0230 to VPA merchant{rng.randrange(receivers)}@okaxis {name} on "
+            f"{1 + i % 28:02d}-01-25. Your UPI transaction reference number is {rng.randint(10**11, 10**12)}."
+        )
+        messages.append((msg, f"bench-{i}"))
+    return messages
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def report(name, count, elapsed, latencies):
+    print(
+        f"{name}: {count} records in {elapsed:.2f}s = {count / elapsed:,.1f} records/s; "
+        f"{len(latencies)} calls, p50 {percentile(latencies, 0.5) * 1000:.0f} ms, "
+        f"p99 {percentile(latencies, 0.99) * 1000:.0f} ms"
+    )
+
+
+def bench_takeout(gemini_test, batches, in_flight, name, log):
+    latencies = []
+    classify_pooled = gemini_test.classify_pooled
+
+    def timed_classify(*args):
+        start = time.perf_counter()
+        try:
+            return classify_pooled(*args)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    gemini_test.classify_pooled = timed_classify
+    if os.path.exists("bench_transactions.json"):
+        os.remove("bench_transactions.json")
+    start = time.perf_counter()
+    try:
+        with redirect_stdout(log):
+            classified = gemini_test.classify_transactions_gemini(
+                "bench-key", None, json_file="bench_transactions.json", batches=batches, max_in_flight=in_flight
+            )
+    finally:
+        gemini_test.classify_pooled = classify_pooled
+    elapsed = time.perf_counter() - start
+    if classified is None:
+        print(f"{name}: some batches failed")
+    report(name, sum(len(batch) for batch in batches), elapsed, latencies)
+
+
+def bench_email(email_monitor, messages, batch_size, log):
+    latencies = []
+    saved = 0
+    start = time.perf_counter()
+    for i in range(0, len(messages), batch_size):
+        batch = messages[i:i + batch_size]
+        call_start = time.perf_counter()
+        with redirect_stdout(log):
+            if batch_size == 1:
+                saved += bool(email_monitor.process_email(*batch[0]))
+            else:
+                saved += len(email_monitor.process_email_batch(batch))
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    report("process_email" if batch_size == 1 else f"process_email_batch ({batch_size})", len(messages), elapsed, latencies)
+    print(f"process_email: {saved} of {len(messages)} saved")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--receivers", type=int, default=400)
+    parser.add_argument("--emails", type=int, default=50)
+    parser.add_argument("--email-batch", type=int, default=1, help="emails per process_email_batch call")
+    parser.add_argument("--latency", type=float, default=0.5, help="mean seconds per fake Gemini call")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--in-flight", type=int, default=4)
+    parser.add_argument("--warm", action="store_true", help="rerun the Takeout benchmark on warm caches")
+    parser.add_argument("--verbose", action="store_true", help="keep the pipeline's own logging")
+    args = parser.parse_args()
+    quiet = open(os.devnull, "w") if not args.verbose else sys.stdout
+
+    # The modules read their configuration at import time
+    os.environ["GEMINI_BACKEND"] = "fake"
+    os.environ["FAKE_GEMINI_LATENCY"] = str(args.latency)
+    os.environ["FAKE_GEMINI_ERROR_RATE"] = str(args.error_rate)
+    os.environ["FAKE_GEMINI_MALFORMED_RATE"] = str(args.malformed_rate)
+    os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        import gemini_test
+        import email_monitor
+
+        if args.records:
+            batches = make_batches(args.records, args.receivers)
+            bench_takeout(gemini_test, batches, args.in_flight, "classify_transactions_gemini", quiet)
+            if args.warm:
+                bench_takeout(gemini_test, batches, args.in_flight, "classify_transactions_gemini (warm)", quiet)
+        if args.emails:
+            bench_email(email_monitor, make_emails(args.emails, args.receivers), args.email_batch, quiet)
+        os.chdir(ROOT)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Micro-benchmark: per-record cost of the shared Takeout extractor
+(getTransactions.extract_record) vs the old ad-hoc re.search + strptime code.
+
+Usage: python benchmarks/bench_extract.py [records]
+"""
+
+import os
+import random
+import re
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from getTransactions import extract_record, format_date
+
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sept", "Oct", "Nov", "Dec"]
+RECEIVERS = ["Blinkit", "Zepto", "BMTC BUS", "Swiggy", "Ramesh Kumar", "Amazon", "HP Fuel"]
+
+
+def make_entries(n):
+    rng = random.Random(0)
+    entries = []
+    for _ in range(n):
+        entries.append(
+            f"Paid ₹{rng.randint(1, 5000)}.{rng.randint(0, 99):02d} to {rng.choice(RECEIVERS)} "
+            f"using Bank Account XXXXXX1234 {rng.randint(1, 28)} {rng.choice(MONTHS)} "
+            f"{rng.randint(2019, 2025)}, {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:"
+            f"{rng.randint(0, 59):02d} GMT+05:30"
+        )
+    return entries
+
+
+def legacy(text):
+    amount_match = re.search(r"Paid ₹([\d,]+(?:\.\d+)?)", text)
+    receiver_match = re.search(r"to (.+?) using", text)
+    date_match = re.search(r"\d{1,2} \w{3,4} \d{4}, \d{2}:\d{2}:\d{2} GMT[+-]\d{2}:\d{2}", text)
+    date_str = date_match.group(0)
+    tx_text = text.replace(date_str, "").strip()
+    date_str = date_str.replace("Sept", "Sep")
+    tx_date = datetime.strptime(date_str, "%d %b %Y, %H:%M:%S GMT%z").replace(tzinfo=None)
+    return (
+        amount_match.group(1),
+        receiver_match.group(1),
+        tx_text,
+        tx_date.strftime("%Y-%m-%d %H:%M:%S"),
+    )
+
+
+def unified(text):
+    record = extract_record(text, "Completed")
+    return record.amount, record.receiver, record.raw_text, format_date(record.timestamp)
+
+
+def timed(fn, entries):
+    start = time.perf_counter()
+    results = [fn(text) for text in entries]
+    return time.perf_counter() - start, results
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    entries = make_entries(n)
+
+    legacy_time, legacy_results = timed(legacy, entries)
+    unified_time, unified_results = timed(unified, entries)
+    assert legacy_results == unified_results, "extractors disagree"
+
+    print(f"records:  {n}")
+    print(f"legacy:   {legacy_time / n * 1e6:.2f} us/record")
+    print(f"unified:  {unified_time / n * 1e6:.2f} us/record")
+    print(f"speedup:  {legacy_time / unified_time:.1f}x")
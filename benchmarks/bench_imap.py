@@ -0,0 +1,213 @@
+"""
+Email monitor scaling against the local IMAP stand-in (fake_imap.py): memory
+and thread count with hundreds of simulated accounts in IDLE, and the time
+from delivering a debit alert to each account until every alert is processed,
+with the IMAP commands and bytes the stand-in sent per alert.
+
+--mode async runs async_email_monitor (one event loop); --mode threads runs
+email_monitor.connect_and_idle on a thread per account, as main() does. The
+stand-in runs in a child process so only the monitor is measured, and Gemini
+is the local stand-in from fake_gemini.py.
+
+Usage: python benchmarks/bench_imap.py [--mode async|threads] [--accounts N] [--emails N]
+                                       [--latency S] [--timeout S]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+from contextlib import redirect_stdout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def serve(control, ready):
+    """Child process: run the stand-in and answer ("deliver", user, raw) / ("stats",) on ``control``."""
+    from fake_imap import FakeIMAPServer
+
+    async def run():
+        server = FakeIMAPServer()
+        await server.start()
+        ready.send(server.port)
+        loop = asyncio.get_running_loop()
+        while True:
+            request = await loop.run_in_executor(None, control.recv)
+            if request[0] == "deliver":
+                control.send(server.deliver(request[1], request[2]))
+            elif request[0] == "stats":
+                control.send({
+                    "sessions": server.sessions,
+                    "idling": server.idling(),
+                    "logins": server.logins,
+                    "commands": server.commands,
+                    "bytes_sent": server.bytes_sent,
+                })
+            else:
+                await server.close()
+                return
+
+    asyncio.run(run())
+
+
+def rss_mb() -> float:
+    """Resident memory of this process in MB."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def gmail_like(msg, message_id) -> bytes:
+    """The alert as Gmail delivers it: trace and DKIM headers and an HTML alternative next to the text."""
+    msg["Message-ID"] = f"<{message_id}@bench.test>"
+    msg["Received"] = "from mta.hdfcbank.net (mta.hdfcbank.net. [203.0.113.10]) by mx.google.com with ESMTPS"
+    msg["DKIM-Signature"] = "v=1; a=rsa-sha256; d=hdfcbank.net; s=alerts; b=" + "A" * 344
+    text = msg.get_content()
+    msg.add_alternative(
+        "<html><body><table width=\"600\" style=\"font-family:Arial,sans-serif;font-size:13px\">"
+        f"<tr><td style=\"padding:20px\">{text}</td></tr>"
+        + "<tr><td style=\"padding:4px 20px;color:#666\">This is a system generated alert. Please do not reply.</td></tr>" * 20
+        + "</table></body></html>",
+        subtype="html",
+    )
+    return msg.as_bytes()
+
+
+def fake_credentials(*args, **kwargs):
+    return types.SimpleNamespace(token="bench-token", expired=False, expiry=None)
+
+
+def run_until_cancelled(loop, task):
+    try:
+        loop.run_until_complete(task)
+    except asyncio.CancelledError:
+        pass
+
+
+def wait_for(condition, timeout, interval=0.2) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(interval)
+    return condition()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["async", "threads"], default="async")
+    parser.add_argument("--accounts", type=int, default=300)
+    parser.add_argument("--emails", type=int, default=1, help="alerts delivered to each account")
+    parser.add_argument("--latency", type=float, default=0.2, help="mean seconds per fake Gemini call")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for each phase")
+    args = parser.parse_args()
+
+    control, server_end = multiprocessing.Pipe()
+    ready, ready_end = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve, args=(server_end, ready_end), daemon=True)
+    server.start()
+    port = ready.recv()
+
+    def stats():
+        control.send(("stats",))
+        return control.recv()
+
+    # The modules read their configuration at import time
+    os.environ.update({
+        "GEMINI_BACKEND": "fake",
+        "FAKE_GEMINI_LATENCY": str(args.latency),
+        "IMAP_HOST": "127.0.0.1",
+        "IMAP_PORT": str(port),
+        "IMAP_SSL": "0",
+        "EMAIL_MONITOR_STARTUP_SPREAD": "2",
+    })
+    os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+    log = open(os.devnull, "w")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        import email_monitor
+        import async_email_monitor
+        from bench_classify import make_emails
+
+        email_monitor.get_valid_credentials = fake_credentials
+        async_email_monitor.get_valid_credentials = fake_credentials
+        processed = []
+        finish_alerts = email_monitor.finish_alerts
+
+        def counted_finish(transactions, ambiguous, user_id=None, uids=None):
+            message_ids = list(transactions) + [alert[0] for alert in ambiguous]
+            try:
+                return finish_alerts(transactions, ambiguous, user_id, uids)
+            finally:
+                processed.extend(message_ids)
+
+        email_monitor.finish_alerts = counted_finish
+        users = [f"user{i}@bench.test" for i in range(args.accounts)]
+        email_monitor.get_email_pipeline()  # start the workers before the baseline
+        rss_before, threads_before = rss_mb(), threading.active_count()
+
+        out = sys.stdout
+        # Monitor and worker threads log at any time, so keep their output quiet for the whole run
+        with redirect_stdout(log):
+            start = time.perf_counter()
+            if args.mode == "async":
+                loop = asyncio.new_event_loop()
+                task = loop.create_task(async_email_monitor.monitor_users(users))
+                runner = threading.Thread(target=run_until_cancelled, args=(loop, task), daemon=True)
+                runner.start()
+            else:
+                for user in users:
+                    threading.Thread(target=email_monitor.connect_and_idle, args=(user,), daemon=True).start()
+
+            idling = wait_for(lambda: stats()["idling"] >= args.accounts, args.timeout)
+            connect_time = time.perf_counter() - start
+            time.sleep(1)
+            rss_idle, threads_idle = rss_mb(), threading.active_count()
+            print(f"{args.mode}: {stats()['idling']} of {args.accounts} accounts in IDLE after {connect_time:.1f}s"
+                  + ("" if idling else " (timed out)"), file=out)
+            print(f"  memory: {rss_before:.1f} MB -> {rss_idle:.1f} MB "
+                  f"({(rss_idle - rss_before) * 1024 / max(args.accounts, 1):.0f} KB per account)", file=out)
+            print(f"  threads: {threads_before} -> {threads_idle}", file=out)
+
+            messages = [gmail_like(msg, message_id) for msg, message_id in make_emails(args.accounts * args.emails, 50)]
+            before = stats()
+            start = time.perf_counter()
+            for i, raw in enumerate(messages):
+                control.send(("deliver", users[i % len(users)], raw))
+                control.recv()
+            done = wait_for(lambda: len(processed) >= len(messages), args.timeout, interval=0.05)
+            elapsed = time.perf_counter() - start
+            print(f"  {len(processed)} of {len(messages)} alerts processed {elapsed:.2f}s after delivery"
+                  + ("" if done else " (timed out)"), file=out)
+            # Let the monitors mark the alerts as read before counting the traffic
+            time.sleep(email_monitor.EMAIL_FLAG_INTERVAL + 1)
+            after = stats()
+            print(f"  IMAP per alert: {(after['commands'] - before['commands']) / len(messages):.1f} commands, "
+                  f"{(after['bytes_sent'] - before['bytes_sent']) / len(messages) / 1024:.1f} KB from the server "
+                  f"(alerts are {sum(map(len, messages)) / len(messages) / 1024:.1f} KB)", file=out)
+            print(f"  peak threads: {threading.active_count()}, memory: {rss_mb():.1f} MB", file=out)
+
+            if args.mode == "async":
+                loop.call_soon_threadsafe(task.cancel)
+                runner.join(5)
+            control.send(("stop",))
+            server.join(5)
+        os.chdir(ROOT)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Accuracy and latency of the local receiver model (receiver_model.py) against
+Gemini, on receivers held out from training.
+
+Labels come from --history (a saved new_transactions.json) or from synthetic
+receiver names built to look like UPI payees. The synthetic names avoid the
+keyword rules' words, because only names the rules miss reach the model. A
+--noise fraction of them get a random label, and some are bare business
+names with no hint of their category. Receivers are split, not
+transactions, so a test name is never seen in training.
+
+Gemini runs on the fake backend (fake_gemini.py) unless --backend gemini is
+given with OPENAI_API_KEY set. The fake answers with the keyword rules and
+then a hash, so with it only Gemini's latency is meaningful, not its
+accuracy.
+
+Usage: python benchmarks/bench_receiver_model.py [--history FILE] [--labels N] [--noise R] [--test-fraction F]
+                                                 [--backend fake|gemini] [--gemini-batch N] [--latency S]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+VOCABULARY = {
+    "Eating Out": ["cafe", "restaurant", "biryani", "dhaba", "kitchen", "bakery", "pizza", "darshini", "tiffins",
+                   "sweets", "juice center", "chaat", "bhavan", "hotel", "grill"],
+    "Fuel": ["petroleum", "filling station", "indian oil", "bharat petro", "hpcl", "service station", "petro point",
+             "fuels and lubes"],
+    "Grocery": ["kirana", "provisions", "fresh", "vegetables", "fruits", "traders", "dairy", "milk point",
+                "daily needs", "rice depot"],
+    "Public Transport": ["ksrtc", "irctc", "namma yatri", "rapido", "auto rickshaw", "redbus", "metro card"],
+    "Subscriptions": ["youtube premium", "prime video", "jiocinema", "apple services", "microsoft", "xstream",
+                      "sonyliv", "zee5"],
+    "Ecommerce": ["myntra", "ajio", "meesho", "nykaa", "tata cliq", "snapdeal", "decathlon", "lenskart"],
+    "Quick Commerce": ["instamart", "bbnow", "dunzo", "bigbasket now", "swiggy genie"],
+    "Office Lunch": ["canteen", "cafeteria", "food court", "mess", "corporate dining"],
+}
+FIRST_NAMES = ["rahul", "priya", "arjun", "sneha", "vikram", "ananya", "karthik", "divya", "rohan", "meera",
+               "suresh", "lakshmi", "aditya", "pooja", "manoj", "kavya", "naveen", "shreya", "ganesh", "deepa"]
+LAST_NAMES = ["sharma", "reddy", "iyer", "nair", "gowda", "patel", "rao", "menon", "kumar", "singh", "das",
+              "pillai", "hegde", "shetty", "joshi"]
+SYLLABLES = ["sri", "lak", "shmi", "ka", "ve", "ri", "nan", "di", "ni", "ra", "ma", "sai", "ga", "ne", "sha",
+             "an", "na", "pu", "rna", "vi", "na", "ya", "ka", "ud", "upi", "ba", "la", "ji"]
+SUFFIXES = ["", "", "", " enterprises", " pvt ltd", " llp", " and co", " services"]
+LOCATIONS = ["", "", "koramangala", "indiranagar", "jayanagar", "hsr layout", "whitefield", "btm", "malleshwaram"]
+
+
+def brand(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).title()
+
+
+def synthetic_labels(n, noise, seed=0):
+    """``n`` distinct (receiver, label) pairs; about 8% of names carry no hint of their category."""
+    rng = random.Random(seed)
+    categories = list(VOCABULARY)
+    labels = {}
+    while len(labels) < n:
+        label = rng.choice(categories + ["Personal Transfer"] * 2)
+        if label == "Personal Transfer":
+            name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+            if rng.random() < 0.5:
+                name = f"{name} {rng.choice(LAST_NAMES)[0]}"
+        elif rng.random() < 0.08:
+            name = f"{brand(rng)}{rng.choice(SUFFIXES) or ' enterprises'}"
+        else:
+            name = f"{brand(rng)} {rng.choice(VOCABULARY[label])} {rng.choice(LOCATIONS)}{rng.choice(SUFFIXES)}"
+        if rng.random() < noise:
+            label = rng.choice(categories + ["Personal Transfer"])
+        labels[" ".join(name.upper().split())] = label
+    return list(labels.items())
+
+
+def split(labels, test_fraction, seed=0):
+    """Train and test lists of distinct receivers; the last label of a receiver wins, like in the model."""
+    from classification_cache import normalize_receiver
+
+    latest = {}
+    for receiver, label in labels:
+        if receiver and label:
+            latest[normalize_receiver(receiver)] = (receiver, label)
+    pairs = sorted(latest.values())
+    random.Random(seed).shuffle(pairs)
+    cut = int(len(pairs) * (1 - test_fraction))
+    return pairs[:cut], pairs[cut:]
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def bench_model(receiver_model, train, test, log):
+    model = receiver_model.ReceiverModel(path=None)
+    start = time.perf_counter()
+    with redirect_stdout(log):
+        model.train(train)
+    trained = time.perf_counter() - start
+    print(f"Trained on {len(train)} receivers in {trained:.2f}s (including calibration); {model.calibration}")
+
+    latencies = []
+    right = confident = confident_right = 0
+    for receiver, label in test:
+        start = time.perf_counter()
+        classification, confidence = model.predict(receiver)
+        latencies.append(time.perf_counter() - start)
+        right += classification == label
+        if classification is not None and confidence >= model.threshold:
+            confident += 1
+            confident_right += classification == label
+    print(
+        f"Receiver model: accuracy {right / len(test):.1%} on {len(test)} held-out receivers; "
+        f"threshold {model.threshold:.3f} covers {confident / len(test):.1%} at "
+        f"{confident_right / max(confident, 1):.1%} accuracy (target {model.precision:.0%})"
+    )
+    print(
+        f"Receiver model latency: p50 {percentile(latencies, 0.5) * 1e6:.0f} us, "
+        f"p99 {percentile(latencies, 0.99) * 1e6:.0f} us per receiver"
+    )
+
+    # Incremental updates: one new label, as after each email alert
+    updates = []
+    with redirect_stdout(log):
+        for receiver, label in test[:200]:
+            start = time.perf_counter()
+            model.update([(receiver, label)])
+            # The first prediction after an update recomputes the class totals
+            model.predict(receiver)
+            updates.append(time.perf_counter() - start)
+    print(f"Incremental update and next prediction: p50 {percentile(updates, 0.5) * 1e6:.0f} us per label")
+    return confident / len(test)
+
+
+def bench_gemini(gemini_test, test, batch_size, coverage, log):
+    from classification_rules import get_rule_engine
+    from gemini_client import get_gemini_pool
+
+    guidelines = get_rule_engine().prompt_guidelines([
+        "Respond in pure JSON only and strictly adhere to these guidelines.",
+    ])
+    names = [receiver for receiver, _ in test]
+    predicted = {}
+    latencies = []
+    with redirect_stdout(log):
+        for i in range(0, len(names), batch_size):
+            batch = names[i:i + batch_size]
+            start = time.perf_counter()
+            with get_gemini_pool().client(gemini_test.api_key) as client:
+                pairs = gemini_test.classify_receivers_remote(client, batch, guidelines) or []
+            latencies.append(time.perf_counter() - start)
+            predicted.update((pair["Receiver"], pair["Classification"]) for pair in pairs)
+    right = sum(predicted.get(receiver) == label for receiver, label in test)
+    calls = len(latencies)
+    print(
+        f"Gemini: accuracy {right / len(test):.1%} on {len(test)} receivers in {calls} calls of up to {batch_size}; "
+        f"p50 {percentile(latencies, 0.5) * 1000:.0f} ms per call, "
+        f"{sum(latencies) / len(test) * 1000:.1f} ms per receiver"
+    )
+    print(f"With the model in front, {1 - coverage:.1%} of these receivers would still go to Gemini")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--history", help="new_transactions.json to take labels from instead of synthetic ones")
+    parser.add_argument("--labels", type=int, default=3000, help="synthetic receivers")
+    parser.add_argument("--noise", type=float, default=0.05, help="fraction of synthetic labels that are random")
+    parser.add_argument("--test-fraction", type=float, default=0.2)
+    parser.add_argument("--backend", choices=["fake", "gemini"], default="fake")
+    parser.add_argument("--gemini-batch", type=int, default=100, help="receivers per Gemini call; 0 skips Gemini")
+    parser.add_argument("--latency", type=float, default=0.5, help="mean seconds per fake Gemini call")
+    parser.add_argument("--verbose", action="store_true", help="keep the modules' own logging")
+    args = parser.parse_args()
+    quiet = open(os.devnull, "w") if not args.verbose else sys.stdout
+    history = os.path.abspath(args.history) if args.history else None
+
+    # The modules read their configuration at import time
+    os.environ["GEMINI_BACKEND"] = args.backend
+    os.environ["FAKE_GEMINI_LATENCY"] = str(args.latency)
+    os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        import receiver_model
+
+        labels = receiver_model.history_labels(history) if history else synthetic_labels(args.labels, args.noise)
+        train, test = split(labels, args.test_fraction)
+        if not test:
+            print("Not enough labeled receivers to hold any out")
+            return
+        coverage = bench_model(receiver_model, train, test, quiet)
+        if args.gemini_batch:
+            import gemini_test
+
+            bench_gemini(gemini_test, test, args.gemini_batch, coverage, quiet)
+        os.chdir(ROOT)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Persistent receiver -> classification cache.
+
+Receivers seen before (Swiggy, Blinkit, BMTC, ...) are classified from this
+cache instead of asking Gemini again. Entries come from model results and from
+user corrections via /reclassify. A correction is stored with source "user"
+and model results never overwrite it; only another correction does. The
+cache is a JSON file shared by the API and the email monitor, kept in
+least-recently-used order and trimmed to MAX_ENTRIES. Each write reloads,
+merges and replaces the file under an flock on ``<path>.lock``, so the two
+processes don't drop each other's entries.
+
+Hits and misses are counted per source. "takeout" and "email_regex" hits save
+a model call; "email" lookups happen after Gemini has extracted the receiver.
+"""
+
+import fcntl
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+CACHE_FILE = "classification_cache.json"
+MAX_ENTRIES = 5000
+SOURCE_USER = "user"
+
+
+def normalize_receiver(receiver: str) -> str:
+    return " ".join(receiver.lower().split())
+
+
+class ClassificationCache:
+    def __init__(self, path: str = CACHE_FILE, max_entries: int = MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.counters = {}  # source -> {"hits": n, "misses": n}
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._user = set()  # keys whose classification is a user correction
+        self._mtime = None
+        self._lock = threading.Lock()
+        with self._lock:
+            self._reload_if_changed()
+
+    def _reload_if_changed(self):
+        # Another process (API / email monitor) may have written the file
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Could not load classification cache {self.path}: {e}")
+            return
+        # Model results are stored as the bare classification, corrections with their source
+        self._entries = OrderedDict()
+        self._user = set()
+        for key, value in saved.items():
+            if isinstance(value, dict):
+                self._entries[key] = value.get("classification")
+                if value.get("source") == SOURCE_USER:
+                    self._user.add(key)
+            else:
+                self._entries[key] = value
+        self._mtime = mtime
+
+    def _save(self):
+        data = {
+            key: {"classification": classification, "source": SOURCE_USER} if key in self._user else classification
+            for key, classification in self._entries.items()
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def get(self, receiver: Optional[str]) -> Optional[str]:
+        """Cached classification for ``receiver``. Callers report the outcome with count()."""
+        if not receiver:
+            return None
+        key = normalize_receiver(receiver)
+        with self._lock:
+            self._reload_if_changed()
+            classification = self._entries.get(key)
+            if classification is not None:
+                self._entries.move_to_end(key)
+            return classification
+
+    def count(self, source: str, hit: bool):
+        with self._lock:
+            counter = self.counters.setdefault(source, {"hits": 0, "misses": 0})
+            counter["hits" if hit else "misses"] += 1
+
+    def put(self, receiver: Optional[str], classification: Optional[str], user: bool = False):
+        self.put_many([(receiver, classification)], user=user)
+
+    def put_many(self, items: Iterable[Tuple[Optional[str], Optional[str]]], user: bool = False):
+        """
+        Store several receiver -> classification pairs with a single file
+        write. ``user`` marks them as corrections; otherwise receivers the
+        user has corrected keep their classification.
+        """
+        items = list(items)
+        with self._lock, open(f"{self.path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._reload_if_changed()
+            changed = False
+            for receiver, classification in items:
+                if not receiver or not classification:
+                    continue
+                key = normalize_receiver(receiver)
+                if user and key not in self._user:
+                    self._user.add(key)
+                    changed = True
+                if (user or key not in self._user) and self._entries.get(key) != classification:
+                    self._entries[key] = classification
+                    changed = True
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+            if not changed:
+                return
+            while len(self._entries) > self.max_entries:
+                key, _ = self._entries.popitem(last=False)
+                self._user.discard(key)
+            try:
+                self._save()
+            except OSError as e:
+                print(f"Could not save classification cache {self.path}: {e}")
+
+    def corrections(self) -> List[Tuple[str, str]]:
+        """(receiver, classification) of every user correction still cached."""
+        with self._lock:
+            self._reload_if_changed()
+            return [(key, self._entries[key]) for key in self._user if key in self._entries]
+
+    def stats(self) -> dict:
+        with self._lock:
+            sources = {}
+            for source, counter in self.counters.items():
+                lookups = counter["hits"] + counter["misses"]
+                sources[source] = dict(
+                    counter, hit_rate=round(counter["hits"] / lookups, 4) if lookups else 0.0
+                )
+            return {
+                "entries": len(self._entries),
+                "user_entries": len(self._user),
+                "max_entries": self.max_entries,
+                "sources": sources,
+                "llm_calls_saved": sum(
+                    self.counters.get(source, {}).get("hits", 0) for source in ("takeout", "email_regex")
+                ),
+            }
+
+
+_cache: Optional[ClassificationCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_classification_cache() -> ClassificationCache:
+    """Process-wide cache instance."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ClassificationCache()
+        return _cache
@@ -0,0 +1,125 @@
+"""
+Local keyword rule engine for transaction classification.
+
+The keyword rules (Blinkit/Zepto, Amazon/Flipkart, BMTC, Hungerbox, mart/store,
+Fuel, ...) live in classification_rules.json, which is also used to render the
+guidelines in the Gemini prompts so both stay in sync. All keywords are compiled
+into one Aho-Corasick automaton, so a receiver is matched in a single pass over
+its name. Keywords only match whole words ("mart" matches "Ganesh Mart", not
+"Martin" or "Smartbuy"). Rules without keywords (restaurants, personal names,
+...) are left to the model.
+"""
+
+import json
+import os
+import re
+from collections import deque
+from typing import Dict, List, Optional
+
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "classification_rules.json")
+
+NO_RECEIVER_CLASSIFICATION = "Personal Contact"
+
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+
+
+def tokenize(text: str) -> str:
+    """Lowercase words separated and surrounded by single spaces, so substring matches fall on word boundaries."""
+    return f" {_NON_WORD.sub(' ', text.lower()).strip()} "
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton over lowercase keywords, each tagged with a rule index."""
+
+    def __init__(self, keywords: Dict[str, int]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Optional[int]] = [None]  # best (lowest) rule index ending here
+
+        for keyword, rule in keywords.items():
+            node = 0
+            for ch in keyword:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(None)
+                node = nxt
+            if self._out[node] is None or rule < self._out[node]:
+                self._out[node] = rule
+
+        # Breadth-first pass to fill in failure links and merge outputs
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                inherited = self._out[self._fail[nxt]]
+                if inherited is not None and (self._out[nxt] is None or inherited < self._out[nxt]):
+                    self._out[nxt] = inherited
+
+    def best_match(self, text: str) -> Optional[int]:
+        """Lowest rule index with a keyword occurring in ``text``, or None."""
+        best = None
+        node = 0
+        goto, fail, out = self._goto, self._fail, self._out
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            rule = out[node]
+            if rule is not None and (best is None or rule < best):
+                best = rule
+                if best == 0:
+                    break
+        return best
+
+
+def load_rules(path: str = RULES_FILE) -> List[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["rules"]
+
+
+class RuleEngine:
+    def __init__(self, rules: List[dict]):
+        self.rules = rules
+        keywords: Dict[str, int] = {}
+        for index, rule in enumerate(rules):
+            for keyword in rule.get("keywords", []):
+                keywords.setdefault(tokenize(keyword), index)
+        self._matcher = KeywordMatcher(keywords)
+
+    def classify(self, receiver: Optional[str]) -> Optional[str]:
+        """Classification for ``receiver`` if a keyword rule applies, else None."""
+        if receiver is None or not receiver.strip():
+            return NO_RECEIVER_CLASSIFICATION
+        rule = self._matcher.best_match(tokenize(receiver))
+        if rule is None:
+            return None
+        return self.rules[rule]["classification"]
+
+    def prompt_guidelines(self, extra: List[str] = ()) -> str:
+        """Numbered guideline lines for the Gemini prompts, followed by ``extra`` lines."""
+        lines = [rule["prompt"] for rule in self.rules] + list(extra)
+        return "\n".join(f"{i}. {line}" for i, line in enumerate(lines, 1))
+
+
+_engine: Optional[RuleEngine] = None
+
+
+def get_rule_engine() -> RuleEngine:
+    """Process-wide engine built from RULES_FILE on first use."""
+    global _engine
+    if _engine is None:
+        _engine = RuleEngine(load_rules())
+    return _engine
+
+
+def classify_receiver(receiver: Optional[str]) -> Optional[str]:
+    return get_rule_engine().classify(receiver)
@@ -9,14 +9,26 @@ import re
 import time
 import base64
 import email
+import fcntl
+import queue
+import threading
+from contextlib import contextmanager
 from email.header import decode_header
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Optional, Dict, List
 from dotenv import load_dotenv
 from imapclient import IMAPClient
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
-from google import genai
+from classification_rules import get_rule_engine
+from classification_cache import get_classification_cache
+from json_stream import iter_json_array
+from gemini_client import get_gemini_pool
+from gemini_quota import PRIORITY_REALTIME, get_quota_governor
+from llm_cache import get_llm_cache
+from processed_ids import get_processed_store
+from receiver_model import get_receiver_model
+from retry_queue import EMAIL_RETRY_DRAIN_INTERVAL, RetryQueue, get_retry_queue
 
 # === Config ===
 load_dotenv()
@@ -24,13 +36,45 @@ load_dotenv()
 TOKENS_DIR = "tokens"
 TRANSACTIONS_FILE = "new_transactions.json"
 HDFC_SENDERS = ["alerts@hdfcbank.net", "alerts@hdfcbank.bank.in"]
-PROCESSED_IDS_FILE = "processed_email_ids.json"
+UID_STATE_DIR = "email_state"  # per user: UIDVALIDITY and the last handled UID
 
 # Gmail IMAP settings
-IMAP_HOST = "imap.gmail.com"
-IMAP_PORT = 993
+IMAP_HOST = os.getenv("IMAP_HOST", "imap.gmail.com")
+IMAP_PORT = int(os.getenv("IMAP_PORT", "993"))
+IMAP_SSL = os.getenv("IMAP_SSL", "1") == "1"  # 0 only for a local stand-in such as fake_imap.py
 
 api_key = os.getenv("OPENAI_API_KEY")
+GEMINI_MODEL = "gemini-2.5-flash-lite"
+GEMINI_STREAMING = os.getenv("GEMINI_STREAMING", "1") == "1"  # parse responses as they stream in
+# Regex parses at least this confident skip Gemini when the receiver is known locally
+EMAIL_FAST_PATH_CONFIDENCE = float(os.getenv("EMAIL_FAST_PATH_CONFIDENCE", "0.9"))
+# A burst of alerts is gathered for up to this many seconds / messages and handled together
+EMAIL_BATCH_WINDOW = float(os.getenv("EMAIL_BATCH_WINDOW", "2"))
+EMAIL_BATCH_MAX = int(os.getenv("EMAIL_BATCH_MAX", "10"))
+# Fetched emails wait in a bounded queue for the classification workers
+EMAIL_WORKERS = int(os.getenv("EMAIL_WORKERS", "2"))
+EMAIL_QUEUE_SIZE = int(os.getenv("EMAIL_QUEUE_SIZE", "100"))
+# While emails are being classified, IDLE wakes this often (seconds) to mark finished ones as read
+EMAIL_FLAG_INTERVAL = float(os.getenv("EMAIL_FLAG_INTERVAL", "5"))
+# UIDs per FETCH when catching up on (or receiving) several emails
+EMAIL_FETCH_BATCH = int(os.getenv("EMAIL_FETCH_BATCH", "100"))
+# Only these headers are downloaded; the body is the one text part BODYSTRUCTURE points at
+ALERT_HEADER_FIELDS = "FROM DATE MESSAGE-ID"
+ALERT_FETCH_ITEMS = ["BODYSTRUCTURE", f"BODY.PEEK[HEADER.FIELDS ({ALERT_HEADER_FIELDS})]"]
+# 1 monitors every mailbox on one asyncio event loop (async_email_monitor.py) instead of a thread each
+EMAIL_MONITOR_ASYNC = os.getenv("EMAIL_MONITOR_ASYNC", "0") == "1"
+
+# Workers, monitor threads and sharded monitor processes share the transactions file
+FILES_LOCK_PATH = f"{TRANSACTIONS_FILE}.lock"
+_files_lock = threading.Lock()
+
+
+@contextmanager
+def files_locked():
+    """Hold the transactions file against other threads and processes for a read-modify-write."""
+    with _files_lock, open(FILES_LOCK_PATH, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
 
 
 def load_tokens(user_id: str) -> Optional[dict]:
@@ -103,26 +147,6 @@ def generate_xoauth2_string(email_address: str, access_token: str) -> str:
     return auth_string
 
 
-def load_processed_ids() -> set:
-    """Load set of already processed email Message-IDs."""
-    try:
-        with open(PROCESSED_IDS_FILE, "r") as f:
-            return set(json.load(f))
-    except (FileNotFoundError, json.JSONDecodeError):
-        return set()
-
-
-def save_processed_id(message_id: str):
-    """Save a processed email Message-ID."""
-    processed = load_processed_ids()
-    processed.add(message_id)
-    # Keep only last 1000 IDs to prevent file from growing too large
-    if len(processed) > 1000:
-        processed = set(list(processed)[-1000:])
-    with open(PROCESSED_IDS_FILE, "w") as f:
-        json.dump(list(processed), f)
-
-
 def get_email_body(msg) -> str:
     """Extract text body from email message."""
     body = ""
@@ -158,124 +182,140 @@ def get_email_body(msg) -> str:
     return body
 
 
-def parse_hdfc_debit_email(body: str) -> Optional[Dict]:
+# Precompiled HDFC alert patterns, most specific first, each with the
+# confidence that a match is the right field
+HDFC_AMOUNT_PATTERNS = [
+    (re.compile(r'Rs\.?\s*([\d,]+(?:\.\d{2})?)\s*has been debited', re.IGNORECASE), 1.0),
+    (re.compile(r'(?:Rs\.?|INR)\s*([\d,]+(?:\.\d{2})?)\s*(?:has been|is|was)\s*debited', re.IGNORECASE), 0.9),
+    (re.compile(r'debited.*?(?:Rs\.?|INR)\s*([\d,]+(?:\.\d{2})?)', re.IGNORECASE), 0.6),
+    (re.compile(r'(?:Rs\.?|INR)\s*([\d,]+(?:\.\d{2})?)', re.IGNORECASE), 0.3),
+]
+HDFC_RECEIVER_PATTERNS = [
+    # HDFC VPA format: "to VPA <vpa@address> <Name> on <date>"
+    (re.compile(r'to VPA\s+[\w\-\.@]+\s+([A-Za-z][A-Za-z0-9\s&\-\.]+?)\s+on\s+\d', re.IGNORECASE), 1.0),
+    # Fallback: just get VPA address
+    (re.compile(r'to VPA\s+([\w\-\.@]+)', re.IGNORECASE), 0.5),
+    # Generic patterns
+    (re.compile(r'(?:to|at)\s+([A-Za-z][A-Za-z0-9\s&\-\.]{2,}?)\s+(?:on|via|using)\s+\d', re.IGNORECASE), 0.6),
+    (re.compile(r'(?:transferred to|paid to|payment to)\s+([A-Za-z0-9\s&\-\.]+)', re.IGNORECASE), 0.5),
+]
+HDFC_DATE_PATTERNS = [
+    # DD-MM-YY format (most common in HDFC emails)
+    re.compile(r'on\s+(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})', re.IGNORECASE),
+    re.compile(r'(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})\s*(?:at)?\s*(\d{1,2}:\d{2}(?::\d{2})?(?:\s*[APap][Mm])?)?', re.IGNORECASE),
+    re.compile(r'(\d{1,2}\s+[A-Za-z]{3,9}\s+\d{2,4})\s*(?:at)?\s*(\d{1,2}:\d{2}(?::\d{2})?(?:\s*[APap][Mm])?)?', re.IGNORECASE),
+]
+HDFC_DATE_FORMATS = [
+    "%d-%m-%y", "%d/%m/%y",  # DD-MM-YY first (HDFC format)
+    "%d-%m-%Y", "%d/%m/%Y",
+    "%d %b %Y", "%d %B %Y", "%d-%b-%Y", "%d-%b-%y",
+]
+HDFC_TIME_FORMATS = ["%H:%M:%S", "%H:%M", "%I:%M %p", "%I:%M:%S %p"]
+HTML_TAG_PATTERN = re.compile(r'<[^>]+>')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def parse_hdfc_debit_email(body: str, email_timestamp: Optional[str] = None) -> Optional[Dict]:
     """
     Parse HDFC Bank debit alert email body to extract transaction details.
     
     Example HDFC format:
     "Dear Customer, Rs.166.00 has been debited from account 0230 to VPA 
     paytm-blinkit@ptybl Blinkit on 17-01-26. Your UPI transaction reference..."
+
+    The result carries a "Confidence" between 0 and 1: that of the least
+    certain field, by which pattern matched it. When the body has a date but
+    no time, the time comes from ``email_timestamp``, as in the Gemini prompt.
     """
     result = {}
+    confidence = {}
     
     # Clean HTML tags if present
-    clean_body = re.sub(r'<[^>]+>', ' ', body)
-    clean_body = re.sub(r'\s+', ' ', clean_body).strip()
+    clean_body = HTML_TAG_PATTERN.sub(' ', body)
+    clean_body = WHITESPACE_PATTERN.sub(' ', clean_body).strip()
     
     print(f"Parsing email body: {clean_body[:200]}...")
     
-    # Pattern for amount - HDFC formats: "Rs.166.00 has been debited"
-    amount_patterns = [
-        r'Rs\.?\s*([\d,]+(?:\.\d{2})?)\s*has been debited',
-        r'(?:Rs\.?|INR)\s*([\d,]+(?:\.\d{2})?)\s*(?:has been|is|was)\s*debited',
-        r'debited.*?(?:Rs\.?|INR)\s*([\d,]+(?:\.\d{2})?)',
-        r'(?:Rs\.?|INR)\s*([\d,]+(?:\.\d{2})?)',
-    ]
-    
-    for pattern in amount_patterns:
-        match = re.search(pattern, clean_body, re.IGNORECASE)
+    for pattern, score in HDFC_AMOUNT_PATTERNS:
+        match = pattern.search(clean_body)
         if match:
             amount = match.group(1).replace(",", "")
             result["Amount"] = amount
+            confidence["Amount"] = score
             print(f"Found amount: {amount}")
             break
     
-    # Pattern for receiver/beneficiary - HDFC specific format:
+    # We want the name after the VPA address: "Blinkit" in
     # "to VPA paytm-blinkit@ptybl Blinkit on 17-01-26"
-    # We want to extract "Blinkit" (the name after VPA address)
-    receiver_patterns = [
-        # HDFC VPA format: "to VPA <vpa@address> <Name> on <date>"
-        r'to VPA\s+[\w\-\.@]+\s+([A-Za-z][A-Za-z0-9\s&\-\.]+?)\s+on\s+\d',
-        # Fallback: just get VPA address
-        r'to VPA\s+([\w\-\.@]+)',
-        # Generic patterns
-        r'(?:to|at)\s+([A-Za-z][A-Za-z0-9\s&\-\.]{2,}?)\s+(?:on|via|using)\s+\d',
-        r'(?:transferred to|paid to|payment to)\s+([A-Za-z0-9\s&\-\.]+)',
-    ]
-    
-    for pattern in receiver_patterns:
-        match = re.search(pattern, clean_body, re.IGNORECASE)
+    for pattern, score in HDFC_RECEIVER_PATTERNS:
+        match = pattern.search(clean_body)
         if match:
             receiver = match.group(1).strip()
             # Clean up receiver name
-            receiver = re.sub(r'\s+', ' ', receiver)
+            receiver = WHITESPACE_PATTERN.sub(' ', receiver)
             if len(receiver) >= 2:
                 result["Receiver"] = receiver
+                confidence["Receiver"] = score
                 print(f"Found receiver: {receiver}")
                 break
     
-    # Pattern for date/time - HDFC format: "on 17-01-26" (DD-MM-YY)
-    date_patterns = [
-        # DD-MM-YY format (most common in HDFC emails)
-        r'on\s+(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})',
-        r'(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})\s*(?:at)?\s*(\d{1,2}:\d{2}(?::\d{2})?(?:\s*[APap][Mm])?)?',
-        r'(\d{1,2}\s+[A-Za-z]{3,9}\s+\d{2,4})\s*(?:at)?\s*(\d{1,2}:\d{2}(?::\d{2})?(?:\s*[APap][Mm])?)?',
-    ]
-    
-    for pattern in date_patterns:
-        match = re.search(pattern, clean_body, re.IGNORECASE)
+    for pattern in HDFC_DATE_PATTERNS:
+        match = pattern.search(clean_body)
         if match:
             date_str = match.group(1)
             # Some patterns don't have time group
-            try:
-                time_str = match.group(2) if len(match.groups()) > 1 and match.group(2) else None
-            except IndexError:
-                time_str = None
+            time_str = match.group(2) if pattern.groups > 1 else None
             
             print(f"Found date string: {date_str}")
             
-            # Try to parse various date formats
-            date_formats = [
-                "%d-%m-%y", "%d/%m/%y",  # DD-MM-YY first (HDFC format)
-                "%d-%m-%Y", "%d/%m/%Y",
-                "%d %b %Y", "%d %B %Y", "%d-%b-%Y", "%d-%b-%y",
-            ]
-            
-            for fmt in date_formats:
+            for fmt in HDFC_DATE_FORMATS:
                 try:
                     parsed_date = datetime.strptime(date_str, fmt)
-                    # Add time if available
-                    if time_str:
-                        time_str = time_str.strip()
-                        time_formats = ["%H:%M:%S", "%H:%M", "%I:%M %p", "%I:%M:%S %p"]
-                        for tfmt in time_formats:
-                            try:
-                                parsed_time = datetime.strptime(time_str, tfmt)
-                                parsed_date = parsed_date.replace(
-                                    hour=parsed_time.hour,
-                                    minute=parsed_time.minute,
-                                    second=parsed_time.second
-                                )
-                                break
-                            except ValueError:
-                                continue
-                    
-                    result["Date"] = parsed_date.strftime("%Y-%m-%d %H:%M:%S")
-                    print(f"Parsed date: {result['Date']}")
-                    break
                 except ValueError:
                     continue
+                # Add time if available
+                if time_str:
+                    time_str = time_str.strip()
+                    for tfmt in HDFC_TIME_FORMATS:
+                        try:
+                            parsed_time = datetime.strptime(time_str, tfmt)
+                        except ValueError:
+                            continue
+                        parsed_date = parsed_date.replace(
+                            hour=parsed_time.hour,
+                            minute=parsed_time.minute,
+                            second=parsed_time.second
+                        )
+                        break
+                elif email_timestamp:
+                    try:
+                        sent = datetime.strptime(email_timestamp, "%Y-%m-%d %H:%M:%S")
+                        parsed_date = parsed_date.replace(hour=sent.hour, minute=sent.minute, second=sent.second)
+                    except ValueError:
+                        pass
+
+                result["Date"] = parsed_date.strftime("%Y-%m-%d %H:%M:%S")
+                confidence["Date"] = 1.0
+                print(f"Parsed date: {result['Date']}")
+                break
             
             if "Date" in result:
                 break
     
-    # If no date found, use current time
+    # If no date found, use the email's sent time, or else the current time
     if "Date" not in result:
-        result["Date"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print(f"Using current time: {result['Date']}")
+        if email_timestamp:
+            result["Date"] = email_timestamp
+            confidence["Date"] = 0.9
+            print(f"Using email sent time: {result['Date']}")
+        else:
+            result["Date"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            confidence["Date"] = 0.3
+            print(f"Using current time: {result['Date']}")
     
     # Only return if we found an amount (required field)
     if "Amount" in result:
+        result["Confidence"] = min(confidence.get(field, 0.0) for field in ("Amount", "Receiver", "Date"))
         print(f"Final parsed result: {result}")
         return result
     
@@ -283,6 +323,120 @@ def parse_hdfc_debit_email(body: str) -> Optional[Dict]:
     return None
 
 
+def classify_email_locally(body: str, email_timestamp: Optional[str] = None) -> Optional[Dict]:
+    """
+    Regex fast path: a confidently parsed alert whose receiver is known to the
+    classification cache or the keyword rules, or that the receiver model is
+    confident about, is classified without Gemini. Returns None when the email should go to extract_and_classify_transaction.
+    """
+    parsed = parse_hdfc_debit_email(body, email_timestamp)
+    if not parsed or parsed["Confidence"] < EMAIL_FAST_PATH_CONFIDENCE:
+        return None
+
+    cache = get_classification_cache()
+    cached = cache.get(parsed["Receiver"])
+    cache.count("email_regex", hit=cached is not None)
+    classification = cached or get_rule_engine().classify(parsed["Receiver"])
+    model = get_receiver_model()
+    if not classification and model:
+        classification = model.classify(parsed["Receiver"])
+    if not classification:
+        print(f"No local classification for {parsed['Receiver']}")
+        return None
+    return {
+        "Amount": parsed["Amount"],
+        "Classification": classification,
+        "Receiver": parsed["Receiver"],
+        "Date": parsed["Date"],
+    }
+
+
+EMAIL_EXTRACTION_INSTRUCTIONS = """===Extraction Instructions
+1. Extract the Amount (just the number, no currency symbol, no commas)
+2. Extract the Receiver/Merchant name (who the money was paid to)
+3. Extract the Date and Time of the transaction (use the email sent timestamp for the time if the email body only has the date)
+4. Classify the transaction into a category"""
+
+
+def clean_email_body(body: str) -> str:
+    """Email body with HTML tags removed and whitespace collapsed."""
+    clean_body = HTML_TAG_PATTERN.sub(' ', body)
+    return WHITESPACE_PATTERN.sub(' ', clean_body).strip()
+
+
+def email_guidelines() -> str:
+    return get_rule_engine().prompt_guidelines([
+        "If the receiver doesn't fall into any of these categories, intelligently classify based on the merchant name.",
+    ])
+
+
+def generate_json(prompt: str, many: bool = False):
+    """
+    Gemini's JSON answer to ``prompt``: one object, or with ``many`` the list
+    of objects in its array. Answers come from the LLM response cache when the
+    prompt was sent before; the caller caches a new answer once it has
+    checked it. Returns (answer, from_cache).
+    """
+    cached = get_llm_cache().get(GEMINI_MODEL, prompt)
+    if cached is not None:
+        answer = json.loads(cached)
+        print(f"Gemini response (cached): {answer}")
+        return answer, True
+
+    # Clients are shared with the other monitor threads and keep their connections alive
+    # Alerts go ahead of bulk Takeout batches in the shared Gemini quota
+    with get_gemini_pool().client(api_key, priority=PRIORITY_REALTIME) as client:
+        if GEMINI_STREAMING:
+            chunks = client.models.generate_content_stream(
+                model=GEMINI_MODEL,
+                contents=prompt
+            )
+            try:
+                records = iter_json_array(chunk.text or "" for chunk in chunks)
+                # A single object: stop reading as soon as it is complete
+                answer = list(records) if many else next(records, None)
+            finally:
+                chunks.close()
+            print(f"Gemini response: {answer}")
+            return answer, False
+
+        response = client.models.generate_content(
+            model=GEMINI_MODEL,
+            contents=prompt
+        )
+
+    clean_content = (
+        response.text.strip()
+        .removeprefix("```json")
+        .removesuffix("```")
+        .strip()
+    )
+
+    print(f"Gemini response: {clean_content}")
+
+    answer = json.loads(clean_content)
+    if many and isinstance(answer, dict):
+        answer = [answer]
+    return answer, False
+
+
+def apply_local_classification(result: Dict, source: str = "email") -> Dict:
+    """User corrections (cache) and keyword rules win over the model's pick; the receiver model learns the result."""
+    cache = get_classification_cache()
+    cached = cache.get(result.get("Receiver"))
+    cache.count(source, hit=cached is not None)
+    classification = cached or get_rule_engine().classify(result.get("Receiver"))
+    if classification and classification != result.get("Classification"):
+        print(f"Local classification overrides model: {result.get('Classification')} -> {classification}")
+        result["Classification"] = classification
+    else:
+        cache.put(result.get("Receiver"), result.get("Classification"))
+    model = get_receiver_model()
+    if model:
+        model.update([(result.get("Receiver"), result.get("Classification"))])
+    return result
+
+
 def extract_and_classify_transaction(body: str, email_timestamp: Optional[str] = None) -> Optional[Dict]:
     """
     Let Gemini extract ALL transaction details AND classify in one go.
@@ -296,15 +450,7 @@ def extract_and_classify_transaction(body: str, email_timestamp: Optional[str] =
         print("No API key found")
         return None
     
-    try:
-        client = genai.Client(api_key=api_key)
-    except Exception as e:
-        print(f"Error initializing Gemini client: {e}")
-        return None
-    
-    # Clean HTML tags if present
-    clean_body = re.sub(r'<[^>]+>', ' ', body)
-    clean_body = re.sub(r'\s+', ' ', clean_body).strip()
+    clean_body = clean_email_body(body)
     
     print(f"Sending to Gemini for extraction: {clean_body[:200]}...")
     
@@ -319,24 +465,10 @@ def extract_and_classify_transaction(body: str, email_timestamp: Optional[str] =
 {clean_body}
 {timestamp_info}
 
-===Extraction Instructions
-1. Extract the Amount (just the number, no currency symbol, no commas)
-2. Extract the Receiver/Merchant name (who the money was paid to)
-3. Extract the Date and Time of the transaction (use the email sent timestamp for the time if the email body only has the date)
-4. Classify the transaction into a category
+{EMAIL_EXTRACTION_INSTRUCTIONS}
 
 ===Classification Guidelines
-1. If there is no receiver, classify it as Personal Contact.
-2. If the receiver is Blinkit, zepto, classify it as Quick Commerce.
-3. Only If the receiver is Amazon or Flipkart, classify it as Ecommerce.
-4. If the receiver is Spotify, Netflix, Hotstar, or Google Play, classify it as Subscriptions.
-5. If the receiver has BMTC BUS or Bangalore Metro Rail Corporation Ltd, classify it as Public Transport.
-6. If the receiver is Hungerbox, classify it as Office Lunch.
-7. If the receiver has 'super market', 'supermarket', 'store', or 'mart' in its name, classify it strictly as Grocery.
-8. If the receiver is a restaurant, has a food item in its name, or is a food chain, or has the name Zomato classify it as Eating Out.
-9. If the receiver is just someone's name, classify it as Personal Transfer.
-10. If the receiver has Fuel in its name, classify it as Fuel.
-11. If the receiver doesn't fall into any of these categories, intelligently classify based on the merchant name.
+{email_guidelines()}
 
 === Response Format (Respond ONLY with this JSON, nothing else)
 {{
@@ -348,28 +480,20 @@ def extract_and_classify_transaction(body: str, email_timestamp: Optional[str] =
 """
 
     try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash-lite",
-            contents=prompt
-        )
-        
-        clean_content = (
-            response.text.strip()
-            .removeprefix("```json")
-            .removesuffix("```")
-            .strip()
-        )
-        
-        print(f"Gemini response: {clean_content}")
-        
-        result = json.loads(clean_content)
+        result, cached = generate_json(prompt)
+        if not isinstance(result, dict):
+            print("Gemini response held no JSON object")
+            return None
         
         # Validate required fields
         if not result.get("Amount"):
             print("Gemini did not extract an amount")
             return None
-            
-        return result
+        if not cached:
+            # Cached as the model answered, before local overrides
+            get_llm_cache().put(GEMINI_MODEL, prompt, json.dumps(result, ensure_ascii=False))
+        
+        return apply_local_classification(result)
         
     except json.JSONDecodeError as e:
         print(f"Error parsing Gemini response: {e}")
@@ -379,28 +503,105 @@ def extract_and_classify_transaction(body: str, email_timestamp: Optional[str] =
         return None
 
 
+def extract_and_classify_transactions(emails: List[tuple]) -> List[Optional[Dict]]:
+    """
+    extract_and_classify_transaction for a burst of alerts in one Gemini call.
+    ``emails`` holds (body, email_timestamp) pairs; the result holds the
+    transaction, or None, for each of them in order.
+    """
+    if len(emails) == 1:
+        return [extract_and_classify_transaction(*emails[0])]
+    if not api_key:
+        print("No API key found")
+        return [None] * len(emails)
+
+    blocks = []
+    for index, (body, email_timestamp) in enumerate(emails, 1):
+        sent = f" (sent {email_timestamp})" if email_timestamp else ""
+        blocks.append(f"[{index}]{sent}\n{clean_email_body(body)}")
+    print(f"Sending {len(emails)} emails to Gemini for extraction")
+
+    prompt = f"""You are a financial assistant. Extract transaction details from each of these HDFC Bank debit alert emails and classify them.
+
+===Emails (id, sent timestamp, body)
+{chr(10).join(blocks)}
+
+{EMAIL_EXTRACTION_INSTRUCTIONS}
+
+===Classification Guidelines
+{email_guidelines()}
+
+=== Response Format (Respond ONLY with this JSON array, one object per email, nothing else)
+[
+    {{
+        "id": "the email's id",
+        "Amount": "extracted amount as number string without commas",
+        "Classification": "category from the guidelines above",
+        "Receiver": "merchant or receiver name",
+        "Date": "YYYY-MM-DD HH:MM:SS format"
+    }}
+]
+"""
+
+    results = [None] * len(emails)
+    try:
+        answers, cached = generate_json(prompt, many=True)
+        for answer in answers if isinstance(answers, list) else []:
+            if not isinstance(answer, dict):
+                continue
+            try:
+                index = int(answer.pop("id")) - 1
+            except (KeyError, TypeError, ValueError):
+                continue
+            if 0 <= index < len(emails) and answer.get("Amount"):
+                results[index] = answer
+        if not cached and all(results):
+            # Cached as the model answered, before local overrides
+            answers = [dict(result, id=index) for index, result in enumerate(results, 1)]
+            get_llm_cache().put(GEMINI_MODEL, prompt, json.dumps(answers, ensure_ascii=False))
+    except json.JSONDecodeError as e:
+        print(f"Error parsing Gemini response: {e}")
+    except Exception as e:
+        print(f"Error extracting/classifying transactions: {e}")
+
+    missing = results.count(None)
+    if missing:
+        print(f"Gemini did not extract {missing} of {len(emails)} transactions")
+    return [apply_local_classification(result) if result else None for result in results]
+
+
+def save_transactions(transactions: List[Dict]) -> List[bool]:
+    """Append transactions to the JSON file in one write; whether each was saved (not a duplicate)."""
+    with files_locked():
+        try:
+            with open(TRANSACTIONS_FILE, "r", encoding="utf-8") as f:
+                existing = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            existing = []
+        
+        # Check for duplicates by date and amount
+        seen = {(tx.get("Date"), tx.get("Amount")) for tx in existing}
+        saved = []
+        for transaction in transactions:
+            key = (transaction.get("Date"), transaction.get("Amount"))
+            if key in seen:
+                print(f"Duplicate transaction found, skipping: {transaction}")
+                saved.append(False)
+                continue
+            seen.add(key)
+            existing.append(transaction)
+            saved.append(True)
+            print(f"Saved transaction: {transaction}")
+        
+        if any(saved):
+            with open(TRANSACTIONS_FILE, "w", encoding="utf-8") as f:
+                json.dump(existing, f, indent=2, ensure_ascii=False)
+    return saved
+
+
 def save_transaction(transaction: Dict):
     """Append transaction to JSON file."""
-    try:
-        with open(TRANSACTIONS_FILE, "r", encoding="utf-8") as f:
-            transactions = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        transactions = []
-    
-    # Check for duplicates by date and amount
-    for existing in transactions:
-        if (existing.get("Date") == transaction.get("Date") and 
-            existing.get("Amount") == transaction.get("Amount")):
-            print(f"Duplicate transaction found, skipping: {transaction}")
-            return False
-    
-    transactions.append(transaction)
-    
-    with open(TRANSACTIONS_FILE, "w", encoding="utf-8") as f:
-        json.dump(transactions, f, indent=2, ensure_ascii=False)
-    
-    print(f"Saved transaction: {transaction}")
-    return True
+    return save_transactions([transaction])[0]
 
 
 def get_email_timestamp(msg) -> Optional[str]:
@@ -419,13 +620,13 @@ def get_email_timestamp(msg) -> Optional[str]:
     return None
 
 
-def process_email(msg, message_id: str) -> bool:
-    """Process a single email and extract/classify transaction."""
+def debit_alert_body(msg, message_id: str) -> Optional[str]:
+    """The body of an HDFC debit alert, or None for any other email."""
     # Get sender
     from_header = msg.get("From", "")
     # Check if sender matches any of the tracked HDFC sender addresses
     if not any(sender.lower() in from_header.lower() for sender in HDFC_SENDERS):
-        return False
+        return None
     
     # Get body
     body = get_email_body(msg)
@@ -433,29 +634,527 @@ def process_email(msg, message_id: str) -> bool:
     # Check for "debited" keyword
     if "debited" not in body.lower():
         print(f"Email from HDFC sender but no 'debited' keyword found")
-        return False
+        return None
     
     print(f"Processing HDFC debit alert email (ID: {message_id})")
+    return body
+
+
+def process_email_batch(items: List[tuple], user_id: Optional[str] = None) -> set:
+    """
+    Process a burst of emails together: the regex fast path per alert, one
+    Gemini call for the ambiguous rest, and one write each for the
+    transactions and ``user_id``'s processed IDs.
+    ``items`` holds (msg, message_id) pairs; returns the IDs that were saved.
+    """
+    transactions, ambiguous = classify_alerts_locally(items)
+    return finish_alerts(transactions, ambiguous, user_id)
+
+
+def classify_alerts_locally(items: List[tuple]):
+    """
+    The debit alerts among (msg, message_id) ``items``, split into
+    transactions the regex fast path classified, by message ID, and
+    (message_id, body, email_timestamp) of the ambiguous rest.
+    """
+    alerts = []
+    for msg, message_id in items:
+        body = debit_alert_body(msg, message_id)
+        if body is None:
+            continue
+        # Get the email's sent timestamp from headers
+        email_timestamp = get_email_timestamp(msg)
+        if email_timestamp:
+            print(f"Email sent at: {email_timestamp}")
+        alerts.append((message_id, body, email_timestamp))
     
-    # Get the email's sent timestamp from headers
-    email_timestamp = get_email_timestamp(msg)
-    if email_timestamp:
-        print(f"Email sent at: {email_timestamp}")
+    transactions = {}
+    ambiguous = []
+    for message_id, body, email_timestamp in alerts:
+        # Try the regex parser first; only ambiguous emails go to Gemini
+        transaction = classify_email_locally(body, email_timestamp)
+        if transaction:
+            print("Classified locally from the regex parse")
+            transactions[message_id] = transaction
+        else:
+            ambiguous.append((message_id, body, email_timestamp))
+    return transactions, ambiguous
+
+
+def finish_alerts(transactions: Dict[str, Dict], ambiguous: List[tuple], user_id: Optional[str] = None,
+                  uids: Optional[Dict[str, tuple]] = None) -> set:
+    """
+    Classify the ``ambiguous`` alerts in one Gemini call and save them with
+    ``transactions`` (which gains Gemini's), with one write each for the transactions and
+    ``user_id``'s processed IDs; returns the message IDs that were saved.
+    Alerts Gemini can't extract are queued for retry with their
+    (uid, uidvalidity) from ``uids``, so they can be marked as read later.
+    """
+    retry_queue = get_retry_queue()
+    uids = uids or {}
+    if ambiguous and retry_queue.deferring():
+        # Gemini just failed: queue the alerts for the drain job instead of waiting on it
+        for message_id, body, email_timestamp in ambiguous:
+            uid, uidvalidity = uids.get(message_id, (None, None))
+            retry_queue.add(user_id, message_id, body, email_timestamp, "Deferred during a Gemini outage", attempts=0,
+                            uid=uid, uidvalidity=uidvalidity)
+    elif ambiguous:
+        # Let Gemini extract and classify everything from the email bodies
+        results = extract_and_classify_transactions([(body, ts) for _, body, ts in ambiguous])
+        retry_queue.record_outcome(any(results))
+        for (message_id, body, email_timestamp), transaction in zip(ambiguous, results):
+            if transaction:
+                transactions[message_id] = transaction
+            else:
+                print(f"Could not extract/classify transaction from email {message_id}")
+                uid, uidvalidity = uids.get(message_id, (None, None))
+                retry_queue.add(user_id, message_id, body, email_timestamp, "Gemini extracted no transaction",
+                                uid=uid, uidvalidity=uidvalidity)
+    
+    for transaction in transactions.values():
+        print(f"Extracted transaction: {transaction}")
+    if ambiguous:
+        print(f"Gemini client pool: {get_gemini_pool().stats()}")
+        if get_quota_governor():
+            print(f"Gemini quota: {get_quota_governor().stats()}")
+        print(f"LLM response cache: {get_llm_cache().stats()}")
+    
+    # Save transactions
+    message_ids = list(transactions)
+    saved = save_transactions([transactions[message_id] for message_id in message_ids])
+    saved_ids = [message_id for message_id, ok in zip(message_ids, saved) if ok]
+    get_processed_store(user_id).add_many(saved_ids)
+    return set(saved_ids)
+
+
+def process_email(msg, message_id: str, user_id: Optional[str] = None) -> bool:
+    """Process a single email and extract/classify transaction."""
+    return message_id in process_email_batch([(msg, message_id)], user_id)
+
+
+def drain_retry_queue(retry_queue: Optional[RetryQueue] = None) -> Dict[str, int]:
+    """
+    Classify the due alerts in the retry queue, EMAIL_BATCH_MAX per Gemini
+    call, and save them like live alerts; the saved ones are noted for their
+    monitor to mark as read. Stops at the first call that extracts nothing
+    and leaves the rest for after the outage.
+    """
+    retry_queue = retry_queue or get_retry_queue()
+    counts = {"saved": 0, "duplicates": 0, "failed": 0}
+    with retry_queue.draining() as drainer:
+        if not drainer or retry_queue.deferring():
+            return counts
+        due = []
+        for entry in retry_queue.due():
+            if entry["message_id"] in get_processed_store(entry["user_id"]):
+                # Saved meanwhile, e.g. after the email was fetched again
+                retry_queue.succeeded(entry)
+            else:
+                due.append(entry)
+        
+        for start in range(0, len(due), EMAIL_BATCH_MAX):
+            chunk = due[start:start + EMAIL_BATCH_MAX]
+            results = extract_and_classify_transactions([(entry["body"], entry["email_timestamp"]) for entry in chunk])
+            retry_queue.record_outcome(any(results))
+            if not any(results):
+                # Most likely still an outage rather than unreadable alerts; only a lone alert uses up an attempt
+                for entry in chunk:
+                    retry_queue.failed(entry, "Gemini extracted no transaction", counted=len(chunk) == 1)
+                counts["failed"] += len(chunk)
+                break
+            
+            extracted = [(entry, transaction) for entry, transaction in zip(chunk, results) if transaction]
+            saved = save_transactions([transaction for _, transaction in extracted])
+            for (entry, _), ok in zip(extracted, saved):
+                if ok:
+                    get_processed_store(entry["user_id"]).add(entry["message_id"])
+                    retry_queue.mark_seen(entry)
+                    counts["saved"] += 1
+                else:
+                    counts["duplicates"] += 1
+                retry_queue.succeeded(entry)
+            for entry, transaction in zip(chunk, results):
+                if not transaction:
+                    retry_queue.failed(entry, "Gemini extracted no transaction")
+                    counts["failed"] += 1
+    return counts
+
+
+class EmailPipeline:
+    """
+    Classification workers fed by the IMAP IDLE loops.
+    
+    IDLE loops ``submit`` raw fetched emails and go straight back to idling;
+    workers parse, classify and save them in micro-batches and report each
+    (uid, saved) to the submitter's ``done`` queue, so the IMAP thread (the
+    only one allowed to use its connection) can mark them as read. The queue
+    is bounded: when the workers fall behind, ``submit`` blocks and the IDLE
+    loop stops fetching until they catch up.
+    """
+    
+    def __init__(self, workers: int = EMAIL_WORKERS, max_queued: int = EMAIL_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize=max(max_queued, 1))
+        self.threads = []
+        for i in range(max(workers, 1)):
+            thread = threading.Thread(target=self._work, name=f"email-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        # Alerts whose classification failed are retried from the durable queue in the background
+        self._stopping = threading.Event()
+        self.drainer = threading.Thread(target=self._drain, name="email-retry-drainer", daemon=True)
+        self.drainer.start()
+    
+    def submit(self, raw_email: bytes, uid: int, done: queue.Queue, user_id: str, uidvalidity: Optional[int] = None):
+        """Queue an email fetched from ``user_id``'s INBOX; blocks while the queue is full."""
+        self.queue.put((raw_email, uid, done, user_id, uidvalidity))
+    
+    def close(self):
+        """Let the workers finish everything already queued, then stop them."""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self._stopping.set()
+        self.drainer.join()
+    
+    def _work(self):
+        closing = False
+        while not closing:
+            item = self.queue.get()
+            if item is None:
+                return
+            batch = [item]
+            # Whatever is already queued joins the batch; a lone alert goes ahead at once
+            while len(batch) < EMAIL_BATCH_MAX and not closing:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing = True
+                else:
+                    batch.append(item)
+            waiting = self._classify_fast(batch)
+            if waiting and len(batch) > 1 and not closing:
+                # A burst is arriving: alerts that need Gemini wait up to EMAIL_BATCH_WINDOW
+                # for more of it, so the whole burst shares one call
+                deadline = time.monotonic() + EMAIL_BATCH_WINDOW
+                while len(waiting) < EMAIL_BATCH_MAX:
+                    try:
+                        item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        closing = True
+                        break
+                    waiting += self._classify_fast([item])
+            if waiting:
+                self._classify_rest(waiting)
+    
+    def _drain(self):
+        while not self._stopping.wait(EMAIL_RETRY_DRAIN_INTERVAL):
+            try:
+                counts = drain_retry_queue()
+            except Exception as e:
+                print(f"Error draining the email retry queue: {e}")
+                continue
+            if any(counts.values()):
+                print(f"Email retry queue: {counts}, {get_retry_queue().stats()}")
+    
+    def _classify_fast(self, batch: List[tuple]) -> List[tuple]:
+        """
+        Save the alerts in ``batch`` that the regex fast path classifies, and
+        report every email that is finished; the (user_id, uid, uidvalidity,
+        done, ambiguous alert) entries left for Gemini.
+        """
+        # Processed IDs are kept per user, so a burst is classified per user
+        by_user = {}
+        for raw_email, uid, done, user_id, uidvalidity in batch:
+            msg = email.message_from_bytes(raw_email)
+            message_id = msg.get("Message-ID", str(uid))
+            by_user.setdefault(user_id, []).append((msg, message_id, uid, uidvalidity, done))
+        
+        waiting = []
+        for user_id, items in by_user.items():
+            processed_ids = get_processed_store(user_id)
+            pending = [(msg, message_id) for msg, message_id, _, _, _ in items if message_id not in processed_ids]
+            try:
+                transactions, ambiguous = classify_alerts_locally(pending)
+                saved = finish_alerts(transactions, [], user_id) if transactions else set()
+            except Exception as e:
+                print(f"Error processing emails {[uid for _, _, uid, _, _ in items]} for {user_id}: {e}")
+                transactions, ambiguous, saved = {}, [], set()
+            by_id = {alert[0]: alert for alert in ambiguous}
+            for _, message_id, uid, uidvalidity, done in items:
+                if message_id in by_id:
+                    waiting.append((user_id, uid, uidvalidity, done, by_id[message_id]))
+                else:
+                    done.put((uid, message_id in saved))
+        return waiting
+    
+    def _classify_rest(self, waiting: List[tuple]):
+        """Classify the alerts ``_classify_fast`` left for Gemini, one call per user, and report them."""
+        by_user = {}
+        for user_id, uid, uidvalidity, done, alert in waiting:
+            by_user.setdefault(user_id, []).append((uid, uidvalidity, done, alert))
+        for user_id, items in by_user.items():
+            uids = {alert[0]: (uid, uidvalidity) for uid, uidvalidity, _, alert in items}
+            try:
+                saved = finish_alerts({}, [alert for _, _, _, alert in items], user_id, uids)
+            except Exception as e:
+                print(f"Error processing emails {[uid for uid, _, _, _ in items]} for {user_id}: {e}")
+                saved = set()
+            for uid, _, done, alert in items:
+                done.put((uid, alert[0] in saved))
+
+
+_pipeline: Optional[EmailPipeline] = None
+_pipeline_lock = threading.Lock()
+
+
+def get_email_pipeline() -> EmailPipeline:
+    """Process-wide classification pipeline shared by every monitored inbox."""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = EmailPipeline()
+        return _pipeline
+
+
+def close_email_pipeline():
+    """Finish the queued emails and stop the workers, if the pipeline was started."""
+    global _pipeline
+    with _pipeline_lock:
+        pipeline, _pipeline = _pipeline, None
+    if pipeline:
+        print("Finishing queued emails...")
+        pipeline.close()
+
+
+def load_uid_state(user_id: str) -> dict:
+    """A user's saved INBOX position, or {} if there is none."""
+    try:
+        with open(os.path.join(UID_STATE_DIR, f"{user_id}.json"), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_uid_state(user_id: str, state: dict):
+    """Save a user's INBOX position; only that user's monitor writes the file."""
+    os.makedirs(UID_STATE_DIR, exist_ok=True)
+    path = os.path.join(UID_STATE_DIR, f"{user_id}.json")
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(f"{path}.tmp", path)
+
+
+class MailboxState:
+    """
+    How far one user's INBOX has been handled, persisted across restarts.
     
-    # Let Gemini extract and classify everything from the email body
-    transaction = extract_and_classify_transaction(body, email_timestamp)
-    if not transaction:
-        print(f"Could not extract/classify transaction from email")
-        return False
+    ``last_uid`` is the high-water mark: every alert at or below it has been
+    classified (or failed) by the workers. It only advances past an email
+    once the workers report back, so a crash or disconnect leaves it before
+    anything still queued. UIDs are only meaningful with the UIDVALIDITY
+    they were assigned under, so that is stored next to it.
+    """
+    
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        saved = load_uid_state(user_id)
+        self.uidvalidity = saved.get("uidvalidity")
+        self.last_uid = saved.get("last_uid", 0)
+        self.updated = saved.get("updated")
+        self.searched = self.last_uid  # highest UID any search has returned
+        self.in_flight = set()  # UIDs queued or being classified
+        # Workers report (uid, saved) here; UIDs survive a reconnect, so this outlives the connection
+        self.done = queue.Queue()
+    
+    def begin(self, select_info: dict) -> Optional[list]:
+        """Reconcile with a freshly selected INBOX; search criteria for the catch-up pass, if any."""
+        uidvalidity = select_info.get(b"UIDVALIDITY")
+        uidnext = select_info.get(b"UIDNEXT", 1)
+        if self.uidvalidity is not None and self.uidvalidity == uidvalidity:
+            criteria = ["UID", f"{self.last_uid + 1}:*"]
+            print(f"Catching up on {self.user_id} from UID {self.last_uid + 1} (UIDNEXT {uidnext})")
+        elif self.uidvalidity is not None and self.updated:
+            # The old UIDs are void: rescan by date and let the processed IDs and duplicate check filter
+            since = (datetime.fromisoformat(self.updated) - timedelta(days=1)).strftime("%d-%b-%Y")
+            print(f"UIDVALIDITY of {self.user_id} changed ({self.uidvalidity} -> {uidvalidity}); catching up since {since}")
+            criteria = ["SINCE", since]
+            # Not saved until the mark advances, so a crash before then repeats this catch-up
+            self.last_uid = 0
+            self.searched = 0
+            self.in_flight.clear()
+            # Results still due for the old UIDs must not flag the new ones
+            self.done = queue.Queue()
+        else:
+            print(f"No saved position for {self.user_id}; only processing emails with UID >= {uidnext}")
+            criteria = None
+            self.last_uid = uidnext - 1
+        first_run = self.uidvalidity is None
+        self.uidvalidity = uidvalidity
+        self.searched = max(self.searched, uidnext - 1)
+        if first_run:
+            self.save()
+        return criteria
+    
+    def live_criteria(self) -> list:
+        """Search criteria for emails that arrived since the last search."""
+        return ["UID", f"{self.searched + 1}:*"]
     
-    print(f"Extracted transaction: {transaction}")
+    def new_uids(self, found, catch_up: bool = False) -> List[int]:
+        """The UIDs from a search that still need fetching, in order."""
+        # "UID n:*" also returns the highest UID when it is below n
+        floor = self.last_uid if catch_up else self.searched
+        uids = sorted(uid for uid in found if uid > floor and uid not in self.in_flight)
+        if found:
+            self.searched = max(self.searched, max(found))
+        return uids
     
-    # Save transaction
-    if save_transaction(transaction):
-        save_processed_id(message_id)
-        return True
+    def unfetched(self, uids: List[int]):
+        """``uids`` were searched but could not be fetched: keep the mark below them so the next catch-up retries."""
+        if uids:
+            self.searched = min(self.searched, min(uids) - 1)
+    
+    def finished(self) -> List[int]:
+        """
+        Collect the workers' results and advance the high-water mark; the
+        UIDs to mark as read, including alerts the retry queue saved since.
+        """
+        seen_uids = []
+        while True:
+            try:
+                uid, saved = self.done.get_nowait()
+            except queue.Empty:
+                break
+            self.in_flight.discard(uid)
+            if saved:
+                seen_uids.append(uid)
+        mark = min([self.searched] + [uid - 1 for uid in self.in_flight])
+        if mark > self.last_uid:
+            self.last_uid = mark
+            self.save()
+        seen_uids += get_retry_queue().take_seen(self.user_id, self.uidvalidity)
+        return sorted(set(seen_uids))
+    
+    def save(self):
+        self.updated = datetime.now().isoformat(timespec="seconds")
+        save_uid_state(self.user_id, {"uidvalidity": self.uidvalidity, "last_uid": self.last_uid, "updated": self.updated})
+
+
+def _text(value) -> str:
+    return value.decode("utf-8", "replace") if isinstance(value, bytes) else str(value or "")
+
+
+def body_parts(structure, section: str = ""):
+    """(section, part) for every leaf of a BODYSTRUCTURE, numbered as BODY[section] expects."""
+    # IMAPClient's BodyData gathers a multipart's parts in a list at the front
+    if isinstance(structure[0], list):
+        for number, part in enumerate(structure[0], 1):
+            yield from body_parts(part, f"{section}.{number}" if section else str(number))
+    else:
+        yield section or "1", structure
+
+
+def text_part(structure) -> Optional[tuple]:
+    """(section, part) of the alert text: text/plain, else text/html, skipping attachments like get_email_body."""
+    found = {}
+    for section, part in body_parts(structure):
+        # Text parts carry the line count at 7, so the disposition is at 9
+        disposition = part[9] if len(part) > 9 and isinstance(part[9], (list, tuple)) else None
+        if disposition and _text(disposition[0]).lower() == "attachment":
+            continue
+        found.setdefault(f"{_text(part[0])}/{_text(part[1])}".lower(), (section, part))
+    return found.get("text/plain") or found.get("text/html")
+
+
+def fetched_item(data: dict, name: bytes) -> bytes:
+    """The FETCH value whose item name starts with ``name``; servers may echo BODY[...] sections differently."""
+    for key, value in data.items():
+        if key.upper().startswith(name):
+            return value or b""
+    return b""
+
+
+def body_sections(fetch_data: dict) -> Dict[str, List[int]]:
+    """UIDs grouped by the section holding their alert text, so each section is one FETCH."""
+    sections = {}
+    for uid, data in fetch_data.items():
+        part = text_part(data[b"BODYSTRUCTURE"])
+        if part:
+            sections.setdefault(part[0], []).append(uid)
+    return sections
+
+
+def partial_emails(fetch_data: dict, bodies: Dict[int, bytes]) -> Dict[int, bytes]:
+    """
+    A minimal message per UID from its fetched headers and text part, which the
+    workers parse exactly like a full RFC822 download.
+    """
+    emails = {}
+    for uid, data in fetch_data.items():
+        raw = fetched_item(data, b"BODY[HEADER").rstrip(b"\r\n") + b"\r\n"
+        part = text_part(data[b"BODYSTRUCTURE"])
+        if part and uid in bodies:
+            _, part = part
+            content_type = f"{_text(part[0])}/{_text(part[1])}".lower()
+            params = part[2] or ()
+            for name, value in zip(params[::2], params[1::2]):
+                content_type += f'; {_text(name).lower()}="{_text(value)}"'
+            raw += f"Content-Type: {content_type}\r\nContent-Transfer-Encoding: {_text(part[5]) or '7bit'}\r\n".encode()
+            raw += b"\r\n" + bodies[uid]
+        emails[uid] = raw
+    return emails
+
+
+def fetch_and_submit(client, uids: List[int], state: MailboxState, pipeline: EmailPipeline):
+    """
+    Fetch ``uids`` EMAIL_FETCH_BATCH at a time and queue them for the workers.
     
-    return False
+    Each chunk takes one FETCH for the headers and BODYSTRUCTURE and one per
+    distinct text section (usually one), instead of a full RFC822 download per
+    email. BODY.PEEK leaves \\Seen to mark_processed. A failed chunk and the
+    ones after it stay unfetched and the error is raised, so the session
+    reconnects and its catch-up fetches them again.
+    """
+    for start in range(0, len(uids), EMAIL_FETCH_BATCH):
+        chunk = uids[start:start + EMAIL_FETCH_BATCH]
+        try:
+            fetch_data = client.fetch(chunk, ALERT_FETCH_ITEMS)
+            bodies = {}
+            for section, section_uids in body_sections(fetch_data).items():
+                for uid, data in client.fetch(section_uids, [f"BODY.PEEK[{section}]"]).items():
+                    bodies[uid] = fetched_item(data, f"BODY[{section}]".encode())
+        except Exception as e:
+            print(f"Error fetching emails {chunk[0]}..{chunk[-1]}: {e}")
+            state.unfetched(uids[start:])
+            raise
+        for uid, raw_email in sorted(partial_emails(fetch_data, bodies).items()):
+            # Parsing and classification happen on the workers
+            pipeline.submit(raw_email, uid, state.done, state.user_id, state.uidvalidity)
+            state.in_flight.add(uid)
+
+
+def sender_criteria() -> list:
+    """One search key matching any HDFC sender: OR FROM a OR FROM b FROM c."""
+    criteria = []
+    for sender in HDFC_SENDERS[:-1]:
+        criteria += ["OR", "FROM", sender]
+    return criteria + ["FROM", HDFC_SENDERS[-1]]
+
+
+def search_senders(client, criteria: list) -> set:
+    """UIDs of emails from any HDFC sender matching ``criteria``, in one SEARCH."""
+    return set(client.search(sender_criteria() + criteria))
+
+
+def mark_processed(client, state: MailboxState):
+    """Mark the emails the workers saved as read; only the IMAP thread may use ``client``."""
+    seen_uids = state.finished()
+    if seen_uids:
+        client.set_flags(seen_uids, [b"\\Seen"])
 
 
 def connect_and_idle(user_id: str):
@@ -463,6 +1162,8 @@ def connect_and_idle(user_id: str):
     email_address = user_id  # user_id is the email address
     auth_failure_count = 0
     max_auth_failures = 3
+    pipeline = get_email_pipeline()
+    state = MailboxState(user_id)
     
     while True:
         # Always get fresh credentials before connecting (force refresh)
@@ -476,7 +1177,7 @@ def connect_and_idle(user_id: str):
         try:
             print(f"Connecting to Gmail IMAP for {email_address}...")
             
-            with IMAPClient(IMAP_HOST, port=IMAP_PORT, ssl=True) as client:
+            with IMAPClient(IMAP_HOST, port=IMAP_PORT, ssl=IMAP_SSL) as client:
                 # Authenticate using XOAUTH2
                 auth_string = generate_xoauth2_string(email_address, creds.token)
                 client.oauth2_login(email_address, creds.token)
@@ -488,64 +1189,40 @@ def connect_and_idle(user_id: str):
                 # Select INBOX
                 select_info = client.select_folder("INBOX")
                 
-                # Record the current highest UID - only process emails AFTER this
-                # UIDNEXT is the UID that will be assigned to the next message
-                baseline_uid = select_info.get(b'UIDNEXT', 1)
-                print(f"Baseline UID: {baseline_uid} - only processing emails with UID >= this")
-                print("Skipping existing emails - only monitoring for new ones...")
+                # Pick up where the last run stopped: alerts that arrived while the
+                # monitor was down or reconnecting are fetched before IDLE starts
+                criteria = state.begin(select_info)
+                if criteria:
+                    uids = state.new_uids(search_senders(client, criteria), catch_up=True)
+                    print(f"Catch-up: {len(uids)} HDFC emails to process")
+                    fetch_and_submit(client, uids, state, pipeline)
                 
                 # Start IDLE mode for real-time monitoring
                 print("Starting IDLE mode for real-time email monitoring...")
                 
                 while True:
+                    mark_processed(client, state)
+                    
+                    # HDFC emails that arrived since the last search. Searching before every IDLE,
+                    # not only after a notification, also catches mail that arrived while we were busy
+                    uids = state.new_uids(search_senders(client, state.live_criteria()))
+                    if uids:
+                        print(f"Found {len(uids)} new HDFC emails")
+                        fetch_and_submit(client, uids, state, pipeline)
+                    
                     # Start IDLE
                     client.idle()
                     
                     try:
-                        # Wait for new mail (timeout after 29 minutes to refresh)
-                        responses = client.idle_check(timeout=29*60)
+                        # Wait for new mail (timeout after 29 minutes to refresh); wake sooner
+                        # while workers are busy so their emails get marked as read
+                        responses = client.idle_check(timeout=EMAIL_FLAG_INTERVAL if state.in_flight else 29*60)
                         
-                        # End IDLE to process
+                        # End IDLE to search
                         client.idle_done()
                         
                         if responses:
                             print(f"IDLE responses: {responses}")
-                            
-                            # Check for new HDFC emails with UID >= baseline (arrived after we started)
-                            # Search for each sender separately and combine results
-                            all_messages = set()
-                            for sender in HDFC_SENDERS:
-                                sender_messages = client.search([
-                                    "UNSEEN",
-                                    "FROM", sender,
-                                    f"UID", f"{baseline_uid}:*"
-                                ])
-                                all_messages.update(sender_messages)
-                            
-                            messages = list(all_messages)
-                            
-                            if messages:
-                                print(f"Found {len(messages)} new HDFC emails (UID >= {baseline_uid})")
-                                processed_ids = load_processed_ids()
-                                
-                                for uid in messages:
-                                    # Double-check UID is >= baseline
-                                    if uid < baseline_uid:
-                                        print(f"Skipping UID {uid} (before baseline {baseline_uid})")
-                                        continue
-                                        
-                                    try:
-                                        fetch_data = client.fetch([uid], ["RFC822"])
-                                        for uid_key, data in fetch_data.items():
-                                            raw_email = data[b"RFC822"]
-                                            msg = email.message_from_bytes(raw_email)
-                                            message_id = msg.get("Message-ID", str(uid))
-                                            
-                                            if message_id not in processed_ids:
-                                                if process_email(msg, message_id):
-                                                    client.set_flags([uid], [b"\\Seen"])
-                                    except Exception as e:
-                                        print(f"Error processing email {uid}: {e}")
                         
                         # Refresh credentials if needed
                         if creds.expired:
@@ -557,6 +1234,8 @@ def connect_and_idle(user_id: str):
                     except KeyboardInterrupt:
                         print("Shutting down email monitor...")
                         client.idle_done()
+                        close_email_pipeline()
+                        mark_processed(client, state)
                         return
                         
         except Exception as e:
@@ -586,7 +1265,10 @@ def connect_and_idle(user_id: str):
 
 def main():
     """Main entry point for email monitor."""
-    import threading
+    if EMAIL_MONITOR_ASYNC:
+        from async_email_monitor import main as async_main
+        async_main()
+        return
     
     print("Starting Email Monitor Service...")
     
@@ -621,6 +1303,7 @@ def main():
                 thread.join()
         except KeyboardInterrupt:
             print("Shutting down all monitors...")
+            close_email_pipeline()
 
 
 if __name__ == "__main__":
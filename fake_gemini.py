@@ -0,0 +1,173 @@
+"""
+Local stand-in for the Gemini API, for benchmarks and offline runs.
+
+FakeGeminiClient implements the part of genai.Client this repo uses
+(``client.models.generate_content`` and ``generate_content_stream``) and
+answers the prompts it sends: Takeout records, unique receivers, and HDFC
+alert emails one at a time or in bursts. Latency, error rate and malformed-output rate are configurable,
+so concurrency, caching and batching changes can be compared without calling
+the real API. Select it with GEMINI_BACKEND=fake (see gemini_client.py).
+"""
+
+import ast
+import json
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Optional
+
+from classification_rules import get_rule_engine
+from getTransactions import extract_record
+
+FAKE_GEMINI_LATENCY = float(os.getenv("FAKE_GEMINI_LATENCY", "0.5"))  # mean seconds per call
+FAKE_GEMINI_JITTER = float(os.getenv("FAKE_GEMINI_JITTER", "0.2"))  # +/- fraction of the latency
+FAKE_GEMINI_ERROR_RATE = float(os.getenv("FAKE_GEMINI_ERROR_RATE", "0"))  # calls that raise
+FAKE_GEMINI_MALFORMED_RATE = float(os.getenv("FAKE_GEMINI_MALFORMED_RATE", "0"))  # answers cut off mid-JSON
+FAKE_GEMINI_FIRST_CHUNK = 0.2  # fraction of the latency before a stream's first chunk
+STREAM_CHUNK_CHARS = 64
+
+RECORDS_PATTERN = re.compile(r"===Transactions\n(.*?)\n\s*=== Response Format", re.S)
+RECEIVERS_PATTERN = re.compile(r"===Receivers \(id, tab, name\)\n(.*?)\n\s*=== Response Format", re.S)
+EMAIL_PATTERN = re.compile(r"===Email Body\n(.*?)\n", re.S)
+EMAILS_PATTERN = re.compile(r"===Emails \(id, sent timestamp, body\)\n(.*?)\n\s*===Extraction", re.S)
+EMAIL_BLOCK_PATTERN = re.compile(r"^\[(\d+)\](?: \(sent (.+?)\))?\n(.*)$", re.M)
+EMAIL_TIMESTAMP_PATTERN = re.compile(r"===Email Sent Timestamp\n(.+)")
+EMAIL_AMOUNT_PATTERN = re.compile(r"(?:Rs\.?|INR)\s*([\d,]+(?:\.\d{2})?)", re.I)
+EMAIL_RECEIVER_PATTERN = re.compile(r"to VPA\s+\S+\s+(.+?)\s+on\s+\d", re.I)
+
+
+class FakeGeminiError(Exception):
+    pass
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeModels:
+    def __init__(self, client: "FakeGeminiClient"):
+        self._client = client
+
+    def generate_content(self, model: str, contents: str, config=None) -> FakeResponse:
+        text = self._client.answer(contents)
+        time.sleep(self._client.latency())
+        return FakeResponse(text)
+
+    def generate_content_stream(self, model: str, contents: str, config=None):
+        text = self._client.answer(contents)
+        latency = self._client.latency()
+        chunks = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)] or [""]
+        time.sleep(latency * FAKE_GEMINI_FIRST_CHUNK)
+        for chunk in chunks:
+            yield FakeResponse(chunk)
+            time.sleep(latency * (1 - FAKE_GEMINI_FIRST_CHUNK) / len(chunks))
+
+
+class FakeGeminiClient:
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        latency: float = FAKE_GEMINI_LATENCY,
+        jitter: float = FAKE_GEMINI_JITTER,
+        error_rate: float = FAKE_GEMINI_ERROR_RATE,
+        malformed_rate: float = FAKE_GEMINI_MALFORMED_RATE,
+        seed: Optional[int] = None,
+    ):
+        self.mean_latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.calls = 0
+        self.errors = 0
+        self.malformed = 0
+        self.models = FakeModels(self)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def latency(self) -> float:
+        with self._lock:
+            return max(0.0, self.mean_latency * (1 + self._random.uniform(-self.jitter, self.jitter)))
+
+    def answer(self, prompt: str) -> str:
+        """The response text for ``prompt``; raises FakeGeminiError for a simulated API error."""
+        with self._lock:
+            self.calls += 1
+            fail = self._random.random() < self.error_rate
+            malformed = not fail and self._random.random() < self.malformed_rate
+            cut = self._random.uniform(0.3, 0.9)
+            if fail:
+                self.errors += 1
+            if malformed:
+                self.malformed += 1
+        if fail:
+            time.sleep(self.latency() * FAKE_GEMINI_FIRST_CHUNK)
+            raise FakeGeminiError("503 UNAVAILABLE: the model is overloaded (fake)")
+
+        text = "```json\n" + json.dumps(answer_prompt(prompt), indent=2, ensure_ascii=False) + "\n```"
+        if malformed:
+            text = text[:int(len(text) * cut)]
+        return text
+
+
+def classify_name(name: str) -> str:
+    """Keyword rules first, then a category picked by a stable hash of the name."""
+    rules = get_rule_engine()
+    classification = rules.classify(name)
+    if classification:
+        return classification
+    categories = [rule["classification"] for rule in rules.rules]
+    return categories[zlib.crc32(name.lower().encode("utf-8")) % len(categories)]
+
+
+def answer_prompt(prompt: str):
+    match = RECEIVERS_PATTERN.search(prompt)
+    if match:
+        answers = []
+        for line in match.group(1).splitlines():
+            index, _, name = line.partition("\t")
+            answers.append({"id": int(index), "Classification": classify_name(name)})
+        return answers
+
+    match = RECORDS_PATTERN.search(prompt)
+    if match:
+        answers = []
+        for tx in ast.literal_eval(match.group(1).strip()):
+            record = extract_record(tx["RawText"])
+            receiver = record.receiver or ""
+            answers.append({
+                "Amount": (record.amount or "0").replace(",", ""),
+                "Classification": classify_name(receiver or tx["RawText"]),
+                "Receiver": receiver,
+                "Date": tx["Date"],
+            })
+        return answers
+
+    match = EMAILS_PATTERN.search(prompt)
+    if match:
+        return [
+            dict(answer_email(body, timestamp), id=int(index))
+            for index, timestamp, body in EMAIL_BLOCK_PATTERN.findall(match.group(1))
+        ]
+
+    match = EMAIL_PATTERN.search(prompt)
+    if match:
+        timestamp = EMAIL_TIMESTAMP_PATTERN.search(prompt)
+        return answer_email(match.group(1), timestamp.group(1).strip() if timestamp else None)
+    return {}
+
+
+def answer_email(body: str, timestamp: Optional[str]) -> dict:
+    amount = EMAIL_AMOUNT_PATTERN.search(body)
+    receiver = EMAIL_RECEIVER_PATTERN.search(body)
+    name = receiver.group(1) if receiver else "Unknown"
+    return {
+        "Amount": amount.group(1).replace(",", "") if amount else "",
+        "Classification": classify_name(name),
+        "Receiver": name,
+        "Date": timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
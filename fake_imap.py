@@ -0,0 +1,380 @@
+"""
+Local stand-in for Gmail's IMAP server, for benchmarks and offline runs.
+
+FakeIMAPServer speaks the subset of IMAP4rev1 the email monitors use
+(CAPABILITY, AUTHENTICATE XOAUTH2, SELECT, UID SEARCH/FETCH/STORE, IDLE,
+LOGOUT) over plain TCP, for both IMAPClient and async_imap.AsyncIMAPClient.
+Any XOAUTH2 token is accepted and every user gets an empty INBOX;
+``deliver`` drops a message into a user's INBOX and notifies their idling
+sessions, so hundreds of simulated accounts can run against one process.
+FETCH supports FLAGS, RFC822, BODYSTRUCTURE and BODY[section] (PEEK too);
+``commands`` and ``bytes_sent`` count the traffic the clients cause.
+"""
+
+import asyncio
+import base64
+import email
+import re
+from datetime import datetime
+from email.policy import compat32
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional, Set
+
+CAPABILITIES = "IMAP4rev1 IDLE UIDPLUS SASL-IR AUTH=XOAUTH2"
+# Atoms may carry a section, e.g. BODY.PEEK[HEADER.FIELDS (FROM DATE)]
+TOKEN_PATTERN = re.compile(rb'"(?:[^"\\]|\\.)*"|\(|\)|[^\s()\[]+(?:\[[^\]]*\](?:<[\d.]+>)?)?')
+SECTION_PATTERN = re.compile(rb"^BODY(?:\.PEEK)?\[([^\]]*)\]$")
+XOAUTH2_USER_PATTERN = re.compile(r"user=([^\x01]*)")
+
+
+class FakeMessage:
+    def __init__(self, uid: int, raw: bytes):
+        self.uid = uid
+        self.raw = raw
+        self.flags: Set[str] = set()
+        self.header_block, self.text = split_message(raw)
+        self.headers = email.message_from_bytes(self.header_block, policy=compat32)
+        self._message = None
+        try:
+            self.date = parsedate_to_datetime(self.headers["Date"]).date()
+        except (TypeError, ValueError):
+            self.date = datetime.now().date()
+
+    @property
+    def message(self):
+        if self._message is None:
+            self._message = email.message_from_bytes(self.raw, policy=compat32)
+        return self._message
+
+    def section(self, spec: bytes) -> Optional[bytes]:
+        """The contents of BODY[spec], or None if the message has no such part."""
+        spec = spec.upper()
+        if not spec:
+            return self.raw
+        if spec == b"HEADER":
+            return self.header_block
+        if spec == b"TEXT":
+            return self.text
+        if spec.startswith(b"HEADER.FIELDS"):
+            names = {name.upper() for name in parse_tokens(spec[len(b"HEADER.FIELDS"):])[0]}
+            lines = [f"{name}: {value}\r\n".encode("utf-8", "surrogateescape")
+                     for name, value in self.headers.items() if name.upper().encode() in names]
+            return b"".join(lines) + b"\r\n"
+        part = self.message
+        for number in spec.decode().split("."):
+            if not number.isdigit():
+                return None
+            if part.is_multipart():
+                children = part.get_payload()
+                if not 0 < int(number) <= len(children):
+                    return None
+                part = children[int(number) - 1]
+            elif number != "1":
+                return None
+        return part_body(part)
+
+
+class FakeMailbox:
+    def __init__(self, uidvalidity: int = 1):
+        self.uidvalidity = uidvalidity
+        self.uidnext = 1
+        self.messages: List[FakeMessage] = []
+        self.idlers: Set[asyncio.StreamWriter] = set()
+
+    def add(self, raw: bytes) -> int:
+        message = FakeMessage(self.uidnext, raw)
+        self.uidnext += 1
+        self.messages.append(message)
+        for writer in list(self.idlers):
+            if writer.is_closing():
+                continue
+            writer.write(f"* {len(self.messages)} EXISTS\r\n".encode())
+        return message.uid
+
+
+def split_message(raw: bytes) -> tuple:
+    """(header block including the blank line, body) of a raw message."""
+    for separator in (b"\r\n\r\n", b"\n\n"):
+        head, found, body = raw.partition(separator)
+        if found:
+            return head + found, body
+    return raw, b""
+
+
+def part_body(part) -> bytes:
+    """A leaf part's body as it appears in the message, still transfer-encoded."""
+    payload = part.get_payload()
+    if isinstance(payload, list):
+        return part.as_bytes().partition(b"\n\n")[2]
+    # email hands 8bit text back decoded with the part's charset
+    return (payload or "").encode(part.get_content_charset() or "ascii", "surrogateescape")
+
+
+def imap_string(value) -> bytes:
+    if value is None:
+        return b"NIL"
+    return b'"' + str(value).encode("utf-8").replace(b"\\", b"\\\\").replace(b'"', b'\\"') + b'"'
+
+
+def body_structure(part) -> bytes:
+    """The BODYSTRUCTURE of an email.message part."""
+    if part.is_multipart():
+        children = b"".join(body_structure(child) for child in part.get_payload())
+        return b"(" + children + b" " + imap_string(part.get_content_subtype()) + b")"
+    maintype, subtype = part.get_content_maintype(), part.get_content_subtype()
+    params = (part.get_params() or [(None, None)])[1:] or [("charset", "us-ascii")] * (maintype == "text")
+    body = part_body(part)
+    fields = [
+        imap_string(maintype),
+        imap_string(subtype),
+        b"(" + b" ".join(imap_string(k) + b" " + imap_string(v) for k, v in params) + b")" if params else b"NIL",
+        imap_string(part.get("Content-ID")),
+        imap_string(part.get("Content-Description")),
+        imap_string(part.get("Content-Transfer-Encoding", "7bit")),
+        b"%d" % len(body),
+    ]
+    if maintype == "text":
+        fields.append(b"%d" % body.count(b"\n"))
+    disposition = part.get_content_disposition()
+    fields += [b"NIL", b"(" + imap_string(disposition) + b" NIL)" if disposition else b"NIL", b"NIL", b"NIL"]
+    return b"(" + b" ".join(fields) + b")"
+
+
+def parse_tokens(data: bytes) -> list:
+    """Command arguments as a nested list of byte strings; quoted strings are unquoted."""
+    stack = [[]]
+    for token in TOKEN_PATTERN.findall(data):
+        if token == b"(":
+            stack.append([])
+        elif token == b")":
+            inner = stack.pop()
+            stack[-1].append(inner)
+        elif token.startswith(b'"'):
+            stack[-1].append(re.sub(rb'\\(.)', rb'\1', token[1:-1]))
+        else:
+            stack[-1].append(token)
+    return stack[0]
+
+
+def parse_uid_set(value: bytes, uidnext: int) -> Set[int]:
+    uids = set()
+    for part in value.decode().split(","):
+        low, _, high = part.partition(":")
+        low = uidnext if low == "*" else int(low)
+        high = low if not high else (max(uidnext - 1, low) if high == "*" else int(high))
+        uids.update(range(min(low, high), max(low, high) + 1))
+    return uids
+
+
+def matches(message: FakeMessage, criteria: list, uidnext: int) -> bool:
+    """Whether ``message`` satisfies every key in ``criteria`` (consumed left to right)."""
+    while criteria:
+        if not match_key(message, criteria, uidnext):
+            return False
+    return True
+
+
+def match_key(message: FakeMessage, criteria: list, uidnext: int) -> bool:
+    """Whether ``message`` satisfies the first search key of ``criteria``, which is consumed with its arguments."""
+    key = criteria.pop(0)
+    if isinstance(key, list):
+        return matches(message, list(key), uidnext)
+    key = key.upper()
+    if key == b"ALL":
+        return True
+    if key in (b"SEEN", b"UNSEEN"):
+        return ("\\Seen" in message.flags) == (key == b"SEEN")
+    if key == b"FROM":
+        return criteria.pop(0).decode().lower() in str(message.headers.get("From", "")).lower()
+    if key == b"SINCE":
+        return message.date >= datetime.strptime(criteria.pop(0).decode(), "%d-%b-%Y").date()
+    if key == b"UID":
+        return message.uid in parse_uid_set(criteria.pop(0), uidnext)
+    if key == b"OR":
+        # Both operands are consumed whatever the first one gives
+        left = match_key(message, criteria, uidnext)
+        right = match_key(message, criteria, uidnext)
+        return left or right
+    if key == b"NOT":
+        return not match_key(message, criteria, uidnext)
+    if key[:1].isdigit() or key[:1] == b"*":
+        return message.uid in parse_uid_set(key, uidnext)
+    raise ValueError(f"Unsupported search key {key!r}")
+
+
+class FakeIMAPServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.mailboxes: Dict[str, FakeMailbox] = {}
+        self.sessions = 0
+        self.logins = 0
+        self.commands = 0
+        self.bytes_sent = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def mailbox(self, user: str) -> FakeMailbox:
+        return self.mailboxes.setdefault(user, FakeMailbox())
+
+    def deliver(self, user: str, raw: bytes) -> int:
+        """Add ``raw`` to ``user``'s INBOX; its UID."""
+        return self.mailbox(user).add(raw)
+
+    def idling(self) -> int:
+        return sum(len(mailbox.idlers) for mailbox in self.mailboxes.values())
+
+    def seen(self) -> int:
+        return sum(
+            1 for mailbox in self.mailboxes.values() for message in mailbox.messages if "\\Seen" in message.flags
+        )
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._session, self.host, self.port, limit=1024 * 1024)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _session(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.sessions += 1
+        user = None
+        mailbox = None
+        reported = 0  # messages this session has been told about
+
+        def send(data: bytes):
+            self.bytes_sent += len(data)
+            writer.write(data)
+
+        send(b"* OK [CAPABILITY " + CAPABILITIES.encode() + b"] Fake IMAP ready\r\n")
+        try:
+            while True:
+                line = await reader.readuntil(b"\r\n")
+                # APPEND-style literals aren't supported; anything else fits on a line
+                tag, _, rest = line.rstrip(b"\r\n").partition(b" ")
+                args = parse_tokens(rest)
+                if not args:
+                    send(tag + b" BAD empty command\r\n")
+                    continue
+                command = args.pop(0).upper()
+                self.commands += 1
+                if command == b"UID" and args:
+                    command = b"UID " + args.pop(0).upper()
+
+                if command == b"CAPABILITY":
+                    send(f"* CAPABILITY {CAPABILITIES}\r\n".encode())
+                elif command == b"NOOP":
+                    pass
+                elif command == b"LOGOUT":
+                    send(b"* BYE logging out\r\n" + tag + b" OK LOGOUT completed\r\n")
+                    await writer.drain()
+                    return
+                elif command == b"AUTHENTICATE":
+                    if len(args) > 1:
+                        response = args[1]
+                    else:
+                        send(b"+ \r\n")
+                        await writer.drain()
+                        response = (await reader.readuntil(b"\r\n")).strip()
+                    match = XOAUTH2_USER_PATTERN.search(base64.b64decode(response).decode("utf-8", "replace"))
+                    if not match:
+                        send(tag + b" NO [AUTHENTICATIONFAILED] Invalid credentials\r\n")
+                        continue
+                    user = match.group(1)
+                    self.logins += 1
+                elif user is None:
+                    send(tag + b" NO not authenticated\r\n")
+                    continue
+                elif command in (b"SELECT", b"EXAMINE"):
+                    mailbox = self.mailbox(user)
+                    reported = len(mailbox.messages)
+                    send(
+                        f"* {len(mailbox.messages)} EXISTS\r\n* 0 RECENT\r\n"
+                        f"* OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid\r\n"
+                        f"* OK [UIDNEXT {mailbox.uidnext}] Predicted next UID\r\n"
+                        f"* FLAGS (\\Seen \\Answered \\Flagged \\Deleted \\Draft)\r\n".encode()
+                    )
+                    send(tag + b" OK [READ-WRITE] SELECT completed\r\n")
+                    continue
+                elif mailbox is None:
+                    send(tag + b" NO no mailbox selected\r\n")
+                    continue
+                elif command == b"IDLE":
+                    send(b"+ idling\r\n")
+                    # Like real servers, report mail that arrived since the session last looked
+                    if len(mailbox.messages) > reported:
+                        send(f"* {len(mailbox.messages)} EXISTS\r\n".encode())
+                    mailbox.idlers.add(writer)
+                    try:
+                        await reader.readuntil(b"\r\n")  # DONE
+                    finally:
+                        mailbox.idlers.discard(writer)
+                        reported = len(mailbox.messages)
+                elif command == b"UID SEARCH":
+                    if args and args[0].upper() == b"CHARSET":
+                        args = args[2:]
+                    found = [m.uid for m in mailbox.messages if matches(m, list(args), mailbox.uidnext)]
+                    send(b"* SEARCH" + b"".join(b" %d" % uid for uid in found) + b"\r\n")
+                elif command == b"UID FETCH":
+                    uids = parse_uid_set(args[0], mailbox.uidnext)
+                    items = args[1] if isinstance(args[1], list) else args[1:]
+                    for seq, message in enumerate(mailbox.messages, 1):
+                        if message.uid in uids:
+                            send(self._fetch_response(seq, message, items))
+                elif command == b"UID STORE":
+                    uids = parse_uid_set(args[0], mailbox.uidnext)
+                    mode = args[1].upper()
+                    flags = {flag.decode() for flag in (args[2] if isinstance(args[2], list) else args[2:])}
+                    for seq, message in enumerate(mailbox.messages, 1):
+                        if message.uid not in uids:
+                            continue
+                        if mode.startswith(b"+"):
+                            message.flags |= flags
+                        elif mode.startswith(b"-"):
+                            message.flags -= flags
+                        else:
+                            message.flags = set(flags)
+                        if not mode.endswith(b".SILENT"):
+                            send(
+                                f"* {seq} FETCH (UID {message.uid} FLAGS ({' '.join(sorted(message.flags))}))\r\n".encode()
+                            )
+                else:
+                    send(tag + b" BAD unsupported command\r\n")
+                    continue
+                send(tag + b" OK " + command + b" completed\r\n")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # The server is shutting down with this client still connected
+            pass
+        finally:
+            if mailbox:
+                mailbox.idlers.discard(writer)
+            self.sessions -= 1
+            writer.close()
+
+    def _fetch_response(self, seq: int, message: FakeMessage, items: list) -> bytes:
+        parts = [b"UID %d" % message.uid]
+        literals = []
+        for item in items:
+            name = item.upper()
+            section = SECTION_PATTERN.match(name)
+            if name == b"FLAGS":
+                parts.append(b"FLAGS (" + " ".join(sorted(message.flags)).encode() + b")")
+            elif name == b"BODYSTRUCTURE":
+                parts.append(b"BODYSTRUCTURE " + body_structure(message.message))
+            elif name == b"RFC822":
+                message.flags.add("\\Seen")
+                literals.append((name, message.raw))
+            elif section:
+                data = message.section(section.group(1))
+                if data is None:
+                    continue
+                if b".PEEK" not in name:
+                    message.flags.add("\\Seen")
+                literals.append((item.replace(b".PEEK", b"").replace(b".peek", b""), data))
+        response = b"* %d FETCH (" % seq + b" ".join(parts)
+        for name, data in literals:
+            response += b" " + name + b" {%d}\r\n" % len(data) + data
+        return response + b")\r\n"
@@ -0,0 +1,115 @@
+"""
+Process-wide pool of Gemini clients.
+
+Every genai.Client holds its own HTTP session, so building one per debit email
+or per /classify call pays for connection setup and a TLS handshake each time.
+The pool creates clients lazily, at most ``max_size`` per API key, and lends
+them to the API's worker threads and the email monitor. A returned client keeps
+its connections alive for the next borrower.
+
+Borrowed clients send their calls through the shared quota governor
+(gemini_quota.py) at the borrower's priority.
+
+GEMINI_BACKEND=fake swaps in the local stand-in from fake_gemini.py, which has
+the same interface, for benchmarks and offline runs.
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from google import genai
+
+from gemini_quota import PRIORITY_BULK, GovernedClient, get_quota_governor
+
+GEMINI_CLIENT_POOL_SIZE = int(os.getenv("GEMINI_CLIENT_POOL_SIZE", "4"))  # clients per API key
+GEMINI_BACKEND = os.getenv("GEMINI_BACKEND", "gemini")  # "gemini" or "fake"
+
+
+def make_client(api_key: str, backend: str = GEMINI_BACKEND):
+    """A new client for ``backend``."""
+    if backend == "fake":
+        from fake_gemini import FakeGeminiClient
+        return FakeGeminiClient(api_key=api_key)
+    if backend != "gemini":
+        raise ValueError(f"Unknown GEMINI_BACKEND {backend!r}")
+    return genai.Client(api_key=api_key)
+
+
+class GeminiClientPool:
+    def __init__(self, max_size: int = GEMINI_CLIENT_POOL_SIZE, factory: Optional[Callable] = None):
+        self.max_size = max(max_size, 1)
+        self.factory = factory or make_client
+        self.created = 0
+        self.checkouts = 0
+        self.reused = 0
+        self.waits = 0
+        self._idle: Dict[str, List] = {}
+        self._sizes: Dict[str, int] = {}
+        self._cond = threading.Condition()
+
+    def _acquire(self, api_key: str):
+        with self._cond:
+            self.checkouts += 1
+            idle = self._idle.setdefault(api_key, [])
+            waited = False
+            while not idle and self._sizes.get(api_key, 0) >= self.max_size:
+                waited = True
+                self._cond.wait()
+            self.waits += waited
+            if idle:
+                self.reused += 1
+                return idle.pop()
+            # Reserve the slot before building the client outside the lock
+            self._sizes[api_key] = self._sizes.get(api_key, 0) + 1
+        try:
+            client = self.factory(api_key)
+        except Exception:
+            with self._cond:
+                self._sizes[api_key] -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.created += 1
+        return client
+
+    def _release(self, api_key: str, client):
+        with self._cond:
+            self._idle[api_key].append(client)
+            self._cond.notify()
+
+    @contextmanager
+    def client(self, api_key: str, priority: int = PRIORITY_BULK):
+        """Borrow a client for ``api_key``; it goes back to the pool when the block exits."""
+        client = self._acquire(api_key)
+        governor = get_quota_governor()
+        try:
+            yield GovernedClient(client, governor, priority) if governor else client
+        finally:
+            self._release(api_key, client)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "clients": self.created,
+                "idle": sum(len(idle) for idle in self._idle.values()),
+                "max_size": self.max_size,
+                "checkouts": self.checkouts,
+                "reused": self.reused,
+                "reuse_rate": round(self.reused / self.checkouts, 4) if self.checkouts else 0.0,
+                "waits": self.waits,
+            }
+
+
+_pool: Optional[GeminiClientPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_gemini_pool() -> GeminiClientPool:
+    """Process-wide client pool."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = GeminiClientPool()
+        return _pool
@@ -0,0 +1,248 @@
+"""
+Gemini quota governor shared by every process that calls the API.
+
+The API's /classify, each email monitor and any backfill used to call Gemini
+on their own, so a burst from one pushed all of them into 429s and retry
+storms together. Every call now takes a token from one bucket first. The
+bucket holds at most GEMINI_QUOTA_BURST tokens and refills at
+GEMINI_QUOTA_RPM per minute.
+
+- Realtime calls (email alerts) may use the whole bucket. Bulk calls
+  (Takeout batches) leave GEMINI_QUOTA_RESERVE tokens for them and wait while
+  a realtime call is waiting.
+- A 429 empties the bucket, so every caller backs off together instead of
+  retrying into the limit.
+- After GEMINI_BREAKER_THRESHOLD failures in a row (429, 5xx, network), the
+  circuit opens and calls fail fast with GeminiUnavailable for a cooldown
+  that doubles each time. Then a single probe call is let through, and its
+  success closes the circuit.
+
+The state is a small JSON file read and written under an flock, so it is
+shared by the threads and processes of every docker-compose service (they
+all mount the project directory). gemini_client lends clients whose calls
+go through the governor.
+
+The governor is opt-in: it only runs when GEMINI_QUOTA_RPM is set, since
+the right rate depends on the project's API tier.
+"""
+
+import fcntl
+import json
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+GEMINI_QUOTA_DIR = os.getenv("GEMINI_QUOTA_DIR", "gemini_quota")
+# Requests per minute across all processes. Off (0) by default: set it to the project's Gemini tier limit
+GEMINI_QUOTA_RPM = float(os.getenv("GEMINI_QUOTA_RPM", "0"))
+GEMINI_QUOTA_BURST = float(os.getenv("GEMINI_QUOTA_BURST", "10"))
+GEMINI_QUOTA_RESERVE = float(os.getenv("GEMINI_QUOTA_RESERVE", "2"))  # tokens bulk calls leave for realtime ones
+GEMINI_QUOTA_MAX_WAIT = float(os.getenv("GEMINI_QUOTA_MAX_WAIT", "120"))  # seconds a call may wait for a token
+GEMINI_BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))
+GEMINI_BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "30"))
+BREAKER_MAX_COOLDOWN = 600.0
+PROBE_TIMEOUT = 120.0  # a probe that never reports back frees the half-open circuit after this long
+REALTIME_WAIT_WINDOW = 1.0  # seconds a waiting realtime call holds bulk calls back for
+
+PRIORITY_REALTIME = 0
+PRIORITY_BULK = 1
+
+STATUS_PATTERN = re.compile(r"^\s*(\d{3})\b")
+
+
+class GeminiUnavailable(Exception):
+    """The call was not sent: the circuit is open or no token came up in time."""
+
+
+def error_status(error: Exception) -> Optional[int]:
+    """The HTTP status of a Gemini error, if it has one."""
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    match = STATUS_PATTERN.match(str(error))
+    return int(match.group(1)) if match else None
+
+
+class QuotaGovernor:
+    def __init__(
+        self,
+        directory: str = GEMINI_QUOTA_DIR,
+        rpm: float = GEMINI_QUOTA_RPM,
+        burst: float = GEMINI_QUOTA_BURST,
+        reserve: float = GEMINI_QUOTA_RESERVE,
+        max_wait: float = GEMINI_QUOTA_MAX_WAIT,
+        threshold: int = GEMINI_BREAKER_THRESHOLD,
+        cooldown: float = GEMINI_BREAKER_COOLDOWN,
+    ):
+        self.directory = directory
+        self.rate = rpm / 60
+        self.burst = max(burst, 1)
+        self.reserve = min(reserve, self.burst - 1)
+        self.max_wait = max_wait
+        self.threshold = max(threshold, 1)
+        self.cooldown = cooldown
+        self.admitted = 0
+        self.waited = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _state(self):
+        """The shared state, held against every other thread and process until the block exits."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, "state.json"), "a+", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                state = json.loads(f.read() or "{}")
+            except ValueError:
+                state = {}
+            now = time.time()
+            tokens = state.get("tokens", self.burst)
+            state["tokens"] = min(self.burst, tokens + (now - state.get("updated", now)) * self.rate)
+            state["updated"] = now
+            yield state, now
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+
+    def acquire(self, priority: int = PRIORITY_BULK, timeout: Optional[float] = None):
+        """Wait for a token; raises GeminiUnavailable if the circuit is open or none comes up in time."""
+        deadline = time.monotonic() + (self.max_wait if timeout is None else timeout)
+        waited = False
+        while True:
+            with self._state() as (state, now):
+                open_until = state.get("open_until", 0)
+                if now < open_until:
+                    self._count("rejected")
+                    raise GeminiUnavailable(f"Gemini circuit open for another {open_until - now:.0f}s")
+                probing = open_until > 0
+                if probing and state.get("probe_until", 0) > now:
+                    self._count("rejected")
+                    raise GeminiUnavailable("Gemini circuit half-open; waiting for the probe call")
+
+                needed = 1 if priority == PRIORITY_REALTIME else 1 + self.reserve
+                held_back = priority != PRIORITY_REALTIME and state.get("realtime_waiting_until", 0) > now
+                if state["tokens"] >= needed and not held_back:
+                    state["tokens"] -= 1
+                    if probing:
+                        state["probe_until"] = now + PROBE_TIMEOUT
+                    self._count("admitted", waited)
+                    return
+                if priority == PRIORITY_REALTIME:
+                    state["realtime_waiting_until"] = now + REALTIME_WAIT_WINDOW
+                wait = max((needed - state["tokens"]) / self.rate, 0.05) if self.rate > 0 else REALTIME_WAIT_WINDOW
+                if held_back:
+                    wait = max(wait, REALTIME_WAIT_WINDOW / 4)
+            if time.monotonic() + wait > deadline:
+                self._count("rejected")
+                raise GeminiUnavailable("Timed out waiting for Gemini quota")
+            waited = True
+            # Jitter keeps waiting processes from polling in lockstep
+            time.sleep(wait * random.uniform(1, 1.2))
+
+    def record(self, error: Optional[Exception] = None):
+        """Report how an admitted call went: None for success, else the error it raised."""
+        status = error_status(error) if error is not None else None
+        # Bad requests and the like say nothing about the service's health
+        tripping = error is not None and (status is None or status == 429 or status >= 500)
+        with self._state() as (state, now):
+            if not tripping:
+                if state.get("open_until"):
+                    print("Gemini circuit closed")
+                state.update(failures=0, open_until=0, probe_until=0, cooldown=self.cooldown)
+                return
+            if status == 429:
+                # Everyone waits for the bucket to refill rather than retrying into the limit
+                state["tokens"] = 0
+            state["failures"] = state.get("failures", 0) + 1
+            probe_failed = state.get("open_until", 0) > 0
+            if probe_failed or state["failures"] >= self.threshold:
+                cooldown = state.get("cooldown", self.cooldown)
+                state["open_until"] = now + cooldown
+                state["probe_until"] = 0
+                state["cooldown"] = min(cooldown * 2, BREAKER_MAX_COOLDOWN)
+                print(f"Gemini circuit open for {cooldown:.0f}s after {state['failures']} failures: {error}")
+
+    def _count(self, name: str, waited: bool = False):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+            self.waited += waited
+
+    def stats(self) -> dict:
+        with self._state() as (state, now):
+            open_until = state.get("open_until", 0)
+            circuit = "open" if now < open_until else "half-open" if open_until else "closed"
+            shared = {"tokens": round(state["tokens"], 2), "circuit": circuit, "failures": state.get("failures", 0)}
+        with self._lock:
+            return {
+                **shared,
+                "rpm": self.rate * 60,
+                "burst": self.burst,
+                "admitted": self.admitted,
+                "waited": self.waited,
+                "rejected": self.rejected,
+            }
+
+
+class GovernedModels:
+    """``client.models`` with every call admitted by the governor and its outcome reported back."""
+
+    def __init__(self, models, governor: QuotaGovernor, priority: int):
+        self._models = models
+        self._governor = governor
+        self._priority = priority
+
+    def generate_content(self, *args, **kwargs):
+        self._governor.acquire(self._priority)
+        try:
+            response = self._models.generate_content(*args, **kwargs)
+        except Exception as e:
+            self._governor.record(e)
+            raise
+        self._governor.record()
+        return response
+
+    def generate_content_stream(self, *args, **kwargs):
+        self._governor.acquire(self._priority)
+        try:
+            chunks = iter(self._models.generate_content_stream(*args, **kwargs))
+            # The first chunk shows whether the call went through; errors later only cut the answer short
+            first = next(chunks, None)
+        except Exception as e:
+            self._governor.record(e)
+            raise
+        self._governor.record()
+        try:
+            if first is not None:
+                yield first
+            yield from chunks
+        finally:
+            close = getattr(chunks, "close", None)
+            if close:
+                close()
+
+
+class GovernedClient:
+    def __init__(self, client, governor: QuotaGovernor, priority: int):
+        self.client = client
+        self.models = GovernedModels(client.models, governor, priority)
+
+
+_governor: Optional[QuotaGovernor] = None
+_governor_lock = threading.Lock()
+
+
+def get_quota_governor() -> Optional[QuotaGovernor]:
+    """Process-wide governor, or None when GEMINI_QUOTA_RPM is 0."""
+    global _governor
+    if GEMINI_QUOTA_RPM <= 0:
+        return None
+    with _governor_lock:
+        if _governor is None:
+            _governor = QuotaGovernor()
+        return _governor
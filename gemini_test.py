@@ -219,7 +219,9 @@
 
 #     return {"message": "Login successful! Tokens saved."}
 
-import os, json
+import os, io, json, random, time, fcntl, zipfile
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from fastapi import FastAPI, HTTPException, Request
 from starlette.responses import RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
@@ -230,8 +232,16 @@ from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from dotenv import load_dotenv
 from typing import List, Dict
-from getTransactions import extract_completed_transactions
-from google import genai
+from getTransactions import extract_completed_transactions, extract_record
+from classification_rules import get_rule_engine
+from classification_cache import get_classification_cache, normalize_receiver
+from run_manifest import RunManifest
+from token_batcher import AdaptiveTokenBudget, take_batch
+from json_stream import iter_json_array
+from gemini_client import get_gemini_pool
+from gemini_quota import get_quota_governor
+from llm_cache import get_llm_cache
+from receiver_model import get_receiver_model
 from typing import Optional
 
 # === Config ===
@@ -246,6 +256,14 @@ CLIENT_SECRETS_FILE = "credentials.json"
 TOKENS_DIR = "tokens"
 filename = "new_transactions.json"
 activity_filename = "My Activity.html"
+GEMINI_MODEL = "gemini-2.5-flash-lite"
+GEMINI_MAX_IN_FLIGHT = int(os.getenv("GEMINI_MAX_IN_FLIGHT", "4"))  # concurrent batch requests
+GEMINI_RETRIES = 3
+GEMINI_BACKOFF_SECONDS = 1.0
+RUN_MANIFEST_FILE = "classify_run_manifest.jsonl"
+GEMINI_TOKEN_BUDGET = int(os.getenv("GEMINI_TOKEN_BUDGET", "8000"))  # starting tokens per request
+GEMINI_UNIQUE_RECEIVERS = os.getenv("GEMINI_UNIQUE_RECEIVERS", "1") == "1"  # send each receiver once per run
+GEMINI_STREAMING = os.getenv("GEMINI_STREAMING", "1") == "1"  # parse responses as they stream in
 
 # === Load env ===
 load_dotenv()
@@ -287,6 +305,10 @@ class Normalization(BaseModel):
     paidToMe: Optional[str] = None
     payers: Optional[List[Payer]] = None
 
+class RawTransaction(BaseModel):
+    RawText: str
+    Date: str  # "YYYY-MM-DD HH:MM:SS", as produced by extract_completed_transactions
+
 class AddTransaction(BaseModel):
     Amount: str
     Classification: str
@@ -437,41 +459,51 @@ def get_all_token_status():
 
 # === Transaction classification ===
 
-def classify_transactions_gemini(api_key, activity_filename, json_file="new_transactions.json"):
-    try:
-        client = genai.Client(api_key=api_key)
-    except Exception as e:
-        print(f"Error initializing genai client: {e}")
-        return None
+def wait_before_retry(error, attempt, retries, backoff):
+    """Sleep with exponential backoff and full jitter after failed ``attempt``."""
+    delay = random.uniform(0, backoff * 2 ** attempt)
+    print(f"Gemini call failed ({error}), retrying in {delay:.1f}s ({attempt + 1}/{retries})")
+    time.sleep(delay)
 
-    # Step 1: Load existing transactions if file exists
-    try:
-        with open(json_file, "r", encoding="utf-8") as f:
-            existing = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        existing = []
+def generate_with_retry(client, prompt, retries=GEMINI_RETRIES, backoff=GEMINI_BACKOFF_SECONDS):
+    """generate_content with exponential backoff and full jitter between attempts."""
+    for attempt in range(retries + 1):
+        try:
+            return client.models.generate_content(model=GEMINI_MODEL, contents=prompt)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            wait_before_retry(e, attempt, retries, backoff)
 
-    all_classified = []
+def stream_with_retry(client, prompt, retries=GEMINI_RETRIES, backoff=GEMINI_BACKOFF_SECONDS):
+    """
+    Text chunks of generate_content_stream. The call is retried like
+    generate_with_retry until the first chunk arrives; after that an error
+    ends the stream early and is raised to the caller.
+    """
+    for attempt in range(retries + 1):
+        try:
+            chunks = iter(client.models.generate_content_stream(model=GEMINI_MODEL, contents=prompt))
+            first = next(chunks, None)
+            break
+        except Exception as e:
+            if attempt == retries:
+                raise
+            wait_before_retry(e, attempt, retries, backoff)
+    if first is None:
+        return
+    yield first.text or ""
+    for chunk in chunks:
+        yield chunk.text or ""
 
-    # Step 2: Process new batches
-    for batch in extract_completed_transactions(activity_filename):
-        print("Sending batch:")
+def clean_model_json(text):
+    return text.strip().removeprefix("```json").removesuffix("```").strip()
 
-        prompt = f"""You are a financial assistant that classifies transactions into various categories.
+def build_classification_prompt(batch, guidelines):
+    return f"""You are a financial assistant that classifies transactions into various categories.
 
         ===Response Guidelines
-        1. If there is no receiver, classify it as Personal Contact.
-        2. If the receiver is Blinkit, zepto, classify it as Quick Commerce.
-        3. Only If the receiver is Amazon or Flipkart, classify it as Ecommerce.
-        4. If the receiver is Spotify, Netflix, Hotstar, or Google Play, classify it as Subscriptions.
-        5. If the receiver has BMTC BUS or Bangalore Metro Rail Corporation Ltd, classify it as Public Transport.
-        6. If the receiver is Hungerbox, classify it as Office Lunch.
-        7. If the receiver has 'super market', 'supermarket', 'store', or 'mart' in its name, classify it strictly as Grocery.
-        8. If the receiver is a restaurant, has a food item in its name, or is a food chain, or has the name Zomato classify it as Eating Out.
-        9. If the receiver is just someone's name, classify it as Personal Transfer.
-        10. If the receiver has Fuel in its name, classify it as Fuel.
-        11. If the receiver doesn't fall into any of these categories, intelligently classify it by searching up the name online or classify based on the name intelligently.
-        12. Respond in pure JSON only and strictly adhere to these guidelines.
+{guidelines}
 
         ===Transactions
         {batch}
@@ -485,48 +517,447 @@ def classify_transactions_gemini(api_key, activity_filename, json_file="new_tran
         }}
         """
 
-        try:
-            response = client.models.generate_content(
-                model="gemini-2.5-flash-lite",
-                contents=prompt
-            )
-        except Exception as e:
-            print(f"Error generating content: {e}")
-            return None
+def build_receiver_prompt(names, guidelines):
+    rows = "\n".join(f"{index}\t{name}" for index, name in enumerate(names, 1))
+    return f"""You are a financial assistant that classifies the receivers of transactions into various categories.
+
+        ===Response Guidelines
+{guidelines}
 
+        ===Receivers (id, tab, name)
+{rows}
+
+        === Response Format
+        A JSON array with one object per receiver, in the same order:
+        [{{"id": 1, "Classification": "Whatever you classified it as"}}]
+        """
+
+def classify_batch_remote(client, batch, guidelines, build_prompt=build_classification_prompt, stream=GEMINI_STREAMING):
+    """
+    Classify one batch with Gemini. Raises if the call keeps failing; returns None on invalid JSON.
+    Complete answers are kept in the LLM response cache, so the same prompt
+    is answered locally the next time it is sent.
+    """
+    prompt = build_prompt(batch, guidelines)
+    llm_cache = get_llm_cache()
+    cached = llm_cache.get(GEMINI_MODEL, prompt)
+    if cached is not None:
+        return json.loads(cached)
+
+    records = request_records(client, prompt, stream)
+    # A malformed or cut-off answer isn't cached, so the prompt is asked again
+    if records is not None and len(records) >= len(batch):
+        llm_cache.put(GEMINI_MODEL, prompt, json.dumps(records, ensure_ascii=False))
+    return records
+
+def request_records(client, prompt, stream):
+    """
+    Send ``prompt`` to Gemini and parse the JSON records it answers with.
+    A streamed response is parsed record by record as it arrives, so one
+    that is cut off still returns the records before the cut.
+    """
+    if stream:
+        records = []
         try:
-            clean_content = (
-                response.text.strip()
-                .removeprefix("```json")
-                .removesuffix("```")
-                .strip()
-            )
+            for tx in iter_json_array(stream_with_retry(client, prompt)):
+                if isinstance(tx, dict):
+                    records.append(tx)
         except Exception as e:
-            print(f"Error cleaning response: {e}")
+            if not records:
+                raise
+            print(f"Gemini stream broke off after {len(records)} records: {e}")
+        if not records:
+            print("Error: The streamed content held no JSON records.")
             return None
+        return records
+
+    response = generate_with_retry(client, prompt)
+    clean_content = clean_model_json(response.text)
+
+    try:
+        json_data = json.loads(clean_content)
+    except json.JSONDecodeError as e:
+        print(f"Error: The content is not valid JSON. {e}")
+        print("Content attempted to write:")
+        print(clean_content)
+        return None
+
+    if isinstance(json_data, dict):
+        json_data = [json_data]
+    if not isinstance(json_data, list):
+        print(f"Unexpected response type from Gemini: {type(json_data).__name__}")
+        return None
+    return [tx for tx in json_data if isinstance(tx, dict)]
 
+def classify_rows_remote(client, batch, guidelines):
+    """
+    Classify {RawText, Date} records with Gemini. A short response keeps only
+    the leading transactions whose dates line up with the records sent, so
+    the rest can be asked for again.
+    """
+    classified = classify_batch_remote(client, batch, guidelines)
+    if classified is None or len(classified) >= len(batch):
+        return classified
+    aligned = 0
+    while aligned < len(classified) and classified[aligned].get("Date") == batch[aligned]["Date"]:
+        aligned += 1
+    return classified[:aligned]
+
+def classify_receivers_remote(client, names, guidelines):
+    """
+    Classify unique receiver names with Gemini, returning {Receiver,
+    Classification} pairs. Only answers for a leading run of ids are kept,
+    so a short list is always a prefix of ``names``.
+    """
+    classified = classify_batch_remote(client, names, guidelines, build_prompt=build_receiver_prompt)
+    if classified is None:
+        return None
+    pairs = {}
+    for tx in classified:
         try:
-            json_data = json.loads(clean_content)
-            if isinstance(json_data, dict):
-                all_classified.append(json_data)
-            elif isinstance(json_data, list):
-                all_classified.extend(json_data)
-        except json.JSONDecodeError as e:
-            print(f"Error: The content is not valid JSON. {e}")
-            print("Content attempted to write:")
-            print(clean_content)
-        except Exception as e:
-            print(f"An unexpected error occurred: {e}")
-            return clean_content
+            index = int(tx.get("id")) - 1
+        except (TypeError, ValueError):
+            continue
+        if 0 <= index < len(names) and tx.get("Classification"):
+            pairs[index] = {"Receiver": names[index], "Classification": tx["Classification"]}
+    answered = 0
+    while answered in pairs:
+        answered += 1
+    return [pairs[index] for index in range(answered)]
+
+def transaction_key(tx):
+    return (tx.get("Date"), tx.get("Amount"), tx.get("Receiver"))
+
+def commit_transactions(json_file, transactions):
+    """
+    Append ``transactions`` to ``json_file`` under the flock the email monitor
+    takes for it, re-reading it first so concurrent writers aren't clobbered.
+    Transactions already in the file are skipped: a run that crashed after
+    committing a batch but before the manifest logged it sends that batch
+    again when it resumes. Returns how many were appended.
+    """
+    with open(f"{json_file}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            with open(json_file, "r", encoding="utf-8") as f:
+                existing = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            existing = []
+
+        seen = {transaction_key(tx) for tx in existing}
+        new = [tx for tx in transactions if transaction_key(tx) not in seen]
+        if len(new) < len(transactions):
+            print(f"Skipped {len(transactions) - len(new)} transactions already in '{json_file}'")
+        tmp_file = f"{json_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(existing + new, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_file, json_file)
+    return len(new)
+
+# Shared across runs so the learned batch size carries over between imports
+token_budget = AdaptiveTokenBudget(GEMINI_TOKEN_BUDGET)
+
+def classify_adaptive(client, batch, guidelines, budget, split=False, classify=classify_rows_remote):
+    """
+    ``classify`` (classify_rows_remote by default), feeding latency and
+    failures back into ``budget``.
+    A truncated response (fewer records than were sent) keeps the records
+    before the cut and asks again for the rest. A malformed one is split in
+    half and retried, down to single records, which are retried up to
+    GEMINI_RETRIES times with backoff before the batch fails.
+    """
+    start = time.monotonic()
+    classified = classify(client, batch, guidelines)
+    if classified is not None and len(classified) < len(batch):
+        print(f"Got {len(classified)} of {len(batch)} transactions back; treating the response as truncated")
+        if classified:
+            if not split:
+                budget.record_failure()
+            rest = classify_adaptive(client, batch[len(classified):], guidelines, budget, split=True, classify=classify)
+            return None if rest is None else classified + rest
+        classified = None
+    # Only first attempts adjust the budget; the halves of a failed batch
+    # would otherwise shrink it once per split or grow it on every success
+    if classified is not None:
+        if not split:
+            budget.record_success(time.monotonic() - start)
+        return classified
+
+    if not split:
+        budget.record_failure()
+    if len(batch) == 1:
+        # Malformed output is usually a one-off; a lone record gets a few more tries
+        for attempt in range(GEMINI_RETRIES):
+            wait_before_retry("invalid response", attempt, GEMINI_RETRIES, GEMINI_BACKOFF_SECONDS)
+            classified = classify(client, batch, guidelines)
+            if classified:
+                return classified
+        return None
+    mid = len(batch) // 2
+    print(f"Splitting batch of {len(batch)} after an invalid or truncated response")
+    left = classify_adaptive(client, batch[:mid], guidelines, budget, split=True, classify=classify)
+    right = classify_adaptive(client, batch[mid:], guidelines, budget, split=True, classify=classify)
+    if left is None or right is None:
+        return None
+    return left + right
+
+def classify_pooled(api_key, batch, guidelines, budget, classify):
+    """classify_adaptive on a client borrowed from the process-wide pool."""
+    with get_gemini_pool().client(api_key) as client:
+        return classify_adaptive(client, batch, guidelines, budget, classify=classify)
+
+class _PendingBatch:
+    """A parsed batch whose Gemini requests are still being sent or awaited."""
+
+    def __init__(self, batch, local, remote, rows=None):
+        self.batch = batch
+        self.local = local
+        self.remote = remote  # what is sent: records, or receiver names
+        self.rows = rows  # records joined back onto receiver names, if names are sent
+        self.sent = 0
+        self.futures = []
+
+def classify_transactions_gemini(
+    api_key, activity_filename, json_file="new_transactions.json", batches=None,
+    max_in_flight=GEMINI_MAX_IN_FLIGHT, manifest_file=RUN_MANIFEST_FILE, budget=token_budget,
+    unique_receivers=GEMINI_UNIQUE_RECEIVERS,
+):
+    """
+    Classify new Takeout transactions and append them to ``json_file``.
+    Batches are parsed from ``activity_filename`` (a path, or an open text
+    file such as a zip member) unless already-parsed ``batches`` of
+    {RawText, Date} records are passed in.
+
+    The records of each batch that need Gemini are packed into requests by
+    the adaptive token ``budget`` as workers free up. Up to ``max_in_flight``
+    requests are sent at once and at most ``max_in_flight`` batches are
+    pending, so each batch is committed to ``json_file``, in order, while
+    later ones are still being parsed.
+    With ``unique_receivers``, only receiver names not seen earlier in the
+    run are sent, as a compact id/name table; the categories are joined back
+    onto every record locally, with the amount and date parsed from RawText.
+    When parsing ``activity_filename``, progress is logged in a RunManifest so
+    a run that fails part way resumes where it stopped on the next call.
+    If a request raises, no new batches are sent, but batches already in
+    flight are still committed; only the failed ones are left for the next
+    run. Returns None if any batch failed.
+    """
+    manifest = None
+    if batches is None:
+        source = getattr(activity_filename, "name", activity_filename)
+        manifest = RunManifest.open(manifest_file, source, json_file)
+        batches = extract_completed_transactions(
+            activity_filename, json_file=None, latest_date=manifest.latest_date, streaming=True
+        )
 
-    # Step 3: Append new transactions to existing and save
-    updated = existing + all_classified
-    with open(json_file, "w", encoding="utf-8") as f:
-        json.dump(updated, f, indent=2, ensure_ascii=False)
+    try:
+        # Warms the shared pool; workers borrow clients from it per request
+        with get_gemini_pool().client(api_key):
+            pass
+    except Exception as e:
+        print(f"Error initializing genai client: {e}")
+        return None
+
+    all_classified = []
+    failed_batches = 0
+    errors = []
+    requested = set()  # normalized receiver names already sent this run
+    resolved = {}  # normalized receiver name -> classification
+    rules = get_rule_engine()
+    cache = get_classification_cache()
+    model = get_receiver_model()
+    guidelines = rules.prompt_guidelines([
+        "If the receiver doesn't fall into any of these categories, intelligently classify it by searching up the name online or classify based on the name intelligently.",
+        "Respond in pure JSON only and strictly adhere to these guidelines.",
+    ])
+
+    def release_receivers(entry):
+        """
+        Forget that the unanswered receivers of a failed batch were sent, so
+        they are sent again: by the first later batch already parsed that
+        needs them, or else by the next one that has them.
+        """
+        failed = {normalize_receiver(name): name for name in entry.remote if normalize_receiver(name) not in resolved}
+        requested.difference_update(failed)
+        for later in pending:
+            if not failed:
+                break
+            keys = {normalize_receiver(receiver_name(tx)) for tx in later.rows or []}
+            for key in keys & failed.keys():
+                later.remote.append(failed.pop(key))
+                requested.add(key)
+
+    def commit_batch(entry):
+        """Append one finished batch to ``json_file``; False if it was not committed."""
+        results = [None if not future.done() or future.exception() else future.result() for future in entry.futures]
+        if entry.rows is not None:
+            # Answers that did come back still let later batches sharing these receivers join
+            for result in results:
+                for tx in result or []:
+                    resolved[normalize_receiver(tx["Receiver"])] = tx["Classification"]
+        if entry.sent < len(entry.remote) or any(result is None for result in results):
+            # Not committed (records were left unsent, or a request failed), so the next run retries this batch
+            if entry.rows is not None:
+                release_receivers(entry)
+            return False
+        classified = [tx for result in results for tx in result]
+        if entry.rows is not None:
+            classified = join_receivers(entry.rows, resolved)
+            if classified is None:
+                # A receiver this batch shares with a failed one is still unknown
+                return False
+        cache.put_many((tx.get("Receiver"), tx.get("Classification")) for tx in classified)
+        if model:
+            # Only Gemini's labels: learning its own predictions would just reinforce them
+            model.update((tx.get("Receiver"), tx.get("Classification")) for tx in classified)
+        commit_transactions(json_file, entry.local + classified)
+        if manifest:
+            manifest.mark_done(entry.batch)
+        all_classified.extend(entry.local + classified)
+        return True
+
+    # Requests are packed lazily: whenever a worker is free, the next request is
+    # cut from the oldest batch with unsent records using the budget as it is
+    # now, so budget changes apply to the rest of this run. At most
+    # max_in_flight batches are pending, and each is committed, in order, as
+    # soon as its requests finish, while later ones are still being parsed.
+    batches = iter(batches)
+    parsing = True
+    pending = deque()
+    in_flight = set()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        while True:
+            while len(in_flight) < max_in_flight and not errors:
+                entry = next((entry for entry in pending if entry.sent < len(entry.remote)), None)
+                if entry is None:
+                    if not parsing or len(pending) >= max_in_flight:
+                        break
+                    batch = next(batches, None)
+                    if batch is None:
+                        parsing = False
+                        break
+                    if manifest:
+                        batch = manifest.pending(batch)
+                        if not batch:
+                            continue
+                    # Known receivers and keyword rules are classified locally; only the rest goes to Gemini
+                    local, remote = classify_locally(batch, rules, cache, model)
+                    print(f"Classified {len(local)} transactions locally")
+                    if unique_receivers:
+                        names = new_receivers(remote, requested)
+                        print(f"{len(remote)} transactions left share {len(names)} new receivers")
+                        pending.append(_PendingBatch(batch, local, names, rows=remote))
+                    else:
+                        pending.append(_PendingBatch(batch, local, remote))
+                    continue
+                size = take_batch(entry.remote, budget.current, entry.sent)
+                request = entry.remote[entry.sent:entry.sent + size]
+                entry.sent += size
+                print(f"Sending batch of {len(request)} transactions (token budget {budget.current})")
+                classify = classify_receivers_remote if entry.rows is not None else classify_rows_remote
+                future = pool.submit(classify_pooled, api_key, request, guidelines, budget, classify)
+                entry.futures.append(future)
+                in_flight.add(future)
+
+            # Commit finished batches from the head, in order
+            while pending and (errors or pending[0].sent == len(pending[0].remote)) and all(
+                future.done() for future in pending[0].futures
+            ):
+                if not commit_batch(pending.popleft()):
+                    failed_batches += 1
+
+            if not in_flight:
+                if pending or (parsing and not errors):
+                    continue
+                break
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception():
+                    # Stop sending new work, but keep what is already in flight
+                    print(f"Error generating content: {future.exception()}")
+                    errors.append(future.exception())
 
     print(f"Appended {len(all_classified)} new transactions to '{json_file}'")
+    print(f"Classification cache: {cache.stats()}")
+    print(f"Token budget: {budget.stats()}")
+    print(f"Gemini client pool: {get_gemini_pool().stats()}")
+    if get_quota_governor():
+        print(f"Gemini quota: {get_quota_governor().stats()}")
+    print(f"LLM response cache: {get_llm_cache().stats()}")
+    if model:
+        print(f"Receiver model: {model.stats()}")
+    if errors:
+        print(f"Stopped early after {len(errors)} failed requests; uncommitted batches will be retried on the next run")
+        return None
+    if failed_batches:
+        print(f"{failed_batches} batches got invalid responses; they will be retried on the next run")
+        return None
+    if manifest:
+        manifest.finish()
     return all_classified
 
+def classify_locally(batch, rules, cache, model=None):
+    """
+    Split a batch of {RawText, Date} records into ones classified locally
+    (returned as finished transactions) and ones left for Gemini. The
+    classification cache is checked first so user corrections beat the
+    keyword rules, and the receiver model only decides names neither knows,
+    when it is confident.
+    """
+    classified, remaining = [], []
+    for tx in batch:
+        record = extract_record(tx["RawText"])
+        classification = None
+        if record.amount:
+            cached = cache.get(record.receiver)
+            classification = cached or rules.classify(record.receiver)
+            # Only lookups that decide whether the model is called are counted
+            if cached or classification is None:
+                cache.count("takeout", hit=cached is not None)
+            if classification is None and model:
+                classification = model.classify(record.receiver)
+        if classification is None:
+            remaining.append(tx)
+            continue
+        classified.append({
+            "Amount": record.amount.replace(",", ""),
+            "Classification": classification,
+            "Receiver": record.receiver or "",
+            "Date": tx["Date"],
+        })
+    return classified, remaining
+
+def receiver_name(tx):
+    """The name a record is classified by: its receiver, or the RawText if none can be parsed."""
+    return extract_record(tx["RawText"]).receiver or tx["RawText"]
+
+def new_receivers(batch, requested):
+    """Receiver names in ``batch`` not in ``requested`` yet, in order; adds them to it."""
+    names = []
+    for tx in batch:
+        name = receiver_name(tx)
+        key = normalize_receiver(name)
+        if key not in requested:
+            requested.add(key)
+            names.append(name)
+    return names
+
+def join_receivers(batch, resolved):
+    """Turn {RawText, Date} records into transactions using ``resolved`` categories; None if one is missing."""
+    classified = []
+    for tx in batch:
+        record = extract_record(tx["RawText"])
+        classification = resolved.get(normalize_receiver(record.receiver or tx["RawText"]))
+        if classification is None:
+            return None
+        classified.append({
+            "Amount": (record.amount or "").replace(",", ""),
+            "Classification": classification,
+            "Receiver": record.receiver or "",
+            "Date": tx["Date"],
+        })
+    return classified
+
 def load_transactions_between(start_date: date, end_date: date):
     with open(filename, "r") as f:
         data = json.load(f)
@@ -539,9 +970,70 @@ def load_transactions_between(start_date: date, end_date: date):
 
     return filtered
 
+def latest_takeout_zip():
+    """The takeout zip GoogleDrivePoll keeps when an import did not finish, if any."""
+    zips = [f for f in os.listdir(".") if f.startswith("takeout-") and f.endswith(".zip")]
+    return max(zips, key=os.path.getmtime) if zips else None
+
 @app.post("/classify")
 def classify_transactions():
-    classify_transactions_gemini(api_key, activity_filename)
+    """
+    Classify the Takeout export on disk: an extracted "My Activity.html", or
+    else the one in the takeout zip left by GoogleDrivePoll, streamed from the
+    zip the same way the poller reads it.
+    """
+    if os.path.exists(activity_filename):
+        classified = classify_transactions_gemini(api_key, activity_filename)
+    else:
+        zip_path = latest_takeout_zip()
+        if not zip_path:
+            raise HTTPException(status_code=404, detail="No Takeout export to classify")
+        with zipfile.ZipFile(zip_path, "r") as zip_ref:
+            member = next((m for m in zip_ref.namelist() if m.endswith(activity_filename)), None)
+            if member is None:
+                raise HTTPException(status_code=404, detail=f"{activity_filename} not found in {zip_path}")
+            print(f"Classifying {member} from {zip_path}")
+            with zip_ref.open(member) as source:
+                classified = classify_transactions_gemini(api_key, io.TextIOWrapper(source, encoding="utf-8"))
+    if classified is None:
+        raise HTTPException(status_code=502, detail="Classification failed")
+    return {"classified": len(classified)}
+
+@app.post("/classify-records")
+def classify_records(records: List[RawTransaction]):
+    """Classify records already parsed from a Takeout export (see GoogleDrivePoll)."""
+    batch = [record.model_dump() for record in records]
+    classified = classify_transactions_gemini(api_key, activity_filename, batches=[batch])
+    if classified is None:
+        raise HTTPException(status_code=502, detail="Classification failed")
+    return {"classified": len(classified)}
+
+@app.get("/classification-cache/stats")
+def classification_cache_stats():
+    """Hit/miss counters for the receiver classification cache in this process."""
+    return get_classification_cache().stats()
+
+@app.get("/gemini-client/stats")
+def gemini_client_stats():
+    """Client reuse counters for the shared Gemini client pool in this process."""
+    return get_gemini_pool().stats()
+
+@app.get("/gemini-quota/stats")
+def gemini_quota_stats():
+    """Shared token bucket and circuit state, with this process's admission counters."""
+    governor = get_quota_governor()
+    return governor.stats() if governor else {"enabled": False}
+
+@app.get("/receiver-model/stats")
+def receiver_model_stats():
+    """Size, calibrated threshold and skipped-call counters of the local receiver model."""
+    model = get_receiver_model()
+    return model.stats() if model else {"enabled": False}
+
+@app.get("/llm-cache/stats")
+def llm_cache_stats():
+    """Hit/miss and eviction counters for the on-disk Gemini response cache."""
+    return get_llm_cache().stats(scan=True)
 
 @app.post("/daterange")
 def recieve_date_range(date_range: DateRange):
@@ -565,6 +1057,10 @@ def reclassify(Reclassification: ReClassification):
     for tx in transactions:
         if tx["Date"] == Reclassification.original.Date:
             tx["Classification"] = Reclassification.newClassification
+            # Remember the correction for future imports and email alerts
+            get_classification_cache().put(tx.get("Receiver"), Reclassification.newClassification, user=True)
+            if get_receiver_model():
+                get_receiver_model().update([(tx.get("Receiver"), Reclassification.newClassification)])
             match_found = True
             break
 
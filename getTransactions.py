@@ -1,7 +1,75 @@
 from bs4 import BeautifulSoup
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from html.parser import HTMLParser
+import codecs
+import io
+import os
 import re
 import json
+from typing import NamedTuple, Optional
+
+# === Shared per-entry extraction ===
+
+AMOUNT_PATTERN = re.compile(r"(?:Paid|Sent) ₹([\d,]+(?:\.\d+)?)")
+RECEIVER_PATTERN = re.compile(r"to (.+?) using")
+# Allows 3 or 4 letter months (Sep / Sept); the GMT offset is optional
+TIMESTAMP_PATTERN = re.compile(
+    r"(\d{1,2}) (\w{3,4}) (\d{4}), (\d{2}):(\d{2}):(\d{2})( GMT[+-]\d{2}:\d{2})?"
+)
+STATUS_PATTERN = re.compile(r"Completed|Pending|Failed|Cancelled|Declined")
+
+MONTHS = {
+    "Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6, "June": 6,
+    "Jul": 7, "July": 7, "Aug": 8, "Sep": 9, "Sept": 9, "Oct": 10, "Nov": 11, "Dec": 12,
+}
+
+
+class TakeoutRecord(NamedTuple):
+    amount: Optional[str]
+    receiver: Optional[str]
+    timestamp: Optional[datetime]  # wall-clock time as shown in Takeout, offset dropped
+    offset: Optional[str]  # e.g. "GMT+05:30", None if the entry has none
+    status: Optional[str]
+    raw_text: str  # entry text with the timestamp removed
+
+
+def parse_takeout_timestamp(match):
+    """datetime from a TIMESTAMP_PATTERN match, using a month lookup instead of strptime."""
+    day, month, year, hour, minute, second = match.group(1, 2, 3, 4, 5, 6)
+    month_number = MONTHS.get(month)
+    if month_number is None:
+        raise ValueError(f"unknown month {month!r}")
+    return datetime(int(year), month_number, int(day), int(hour), int(minute), int(second))
+
+
+def extract_record(text, status_text=None):
+    """
+    Extract amount, receiver, timestamp and status from one Takeout entry in a
+    single pass. ``status_text`` is the caption text when it is kept separately
+    from the entry body. Fields that are not present are None; raises
+    ValueError if the timestamp is not a valid date.
+    """
+    ts_match = TIMESTAMP_PATTERN.search(text)
+    amount_match = AMOUNT_PATTERN.search(text)
+    receiver_match = RECEIVER_PATTERN.search(text)
+    status_match = STATUS_PATTERN.search(text if status_text is None else status_text)
+    offset = ts_match.group(7) if ts_match else None
+
+    return TakeoutRecord(
+        amount=amount_match.group(1) if amount_match else None,
+        receiver=receiver_match.group(1) if receiver_match else None,
+        timestamp=parse_takeout_timestamp(ts_match) if ts_match else None,
+        offset=offset.strip() if offset else None,
+        status=status_match.group(0) if status_match else None,
+        raw_text=text.replace(ts_match.group(0), "").strip() if ts_match else text.strip(),
+    )
+
+
+def format_date(timestamp):
+    """Date string in the "YYYY-MM-DD HH:MM:SS" format stored in new_transactions.json."""
+    return timestamp.isoformat(sep=" ", timespec="seconds")
+
 
 def getTransactions():
     # --- 1. Read HTML from file ---
@@ -18,21 +86,12 @@ def getTransactions():
         
 
         if "Paid ₹" in text and "using Bank Account" in text and "Completed" in text:
-            amount_match = re.search(r"Paid ₹([\d,]+(?:\.\d+)?)", text)
-            receiver_match = re.search(r"to (.+?) using", text)
-            date_match = re.search(r"\d{1,2} \w{3,4} \d{4}, \d{2}:\d{2}:\d{2}", text)
-            if amount_match and receiver_match and date_match:
-                amount = amount_match.group(1)
-                receiver = receiver_match.group(1)
-                date_str = date_match.group(0)
-                date_str = date_str.replace("Sept", "Sep")
-                date_obj = datetime.strptime(date_str, "%d %b %Y, %H:%M:%S")
-
-
+            record = extract_record(text)
+            if record.timestamp and record.amount and record.receiver:
                 transactions.append({
-                    "amount": amount,
-                    "receiver": receiver,
-                    "date": date_obj.strftime("%Y-%m-%d %H:%M:%S")
+                    "amount": record.amount,
+                    "receiver": record.receiver,
+                    "date": format_date(record.timestamp)
                 })
 
     # --- 5. Output filtered transactions ---
@@ -58,23 +117,13 @@ def getTransactionsInBatches(batch_size=500):
         text = div.get_text(separator=" ", strip=True)
 
         if "Paid ₹" in text and "using Bank Account" in text and "Completed" in text:
-            amount_match = re.search(r"Paid ₹([\d,]+(?:\.\d+)?)", text)
-            receiver_match = re.search(r"to (.+?) using", text)
-            date_match = re.search(r"\d{1,2} \w{3,4} \d{4}, \d{2}:\d{2}:\d{2}", text)
-            print(receiver_match)
-            # if not receiver_match:
-            #     receiver_match = "Personal Contact" 
-            if amount_match and date_match:
-                amount = amount_match.group(1)
-                receiver = receiver_match.group(1)
-                date_str = date_match.group(0)
-                date_str = date_str.replace("Sept", "Sep")
-                date_obj = datetime.strptime(date_str, "%d %b %Y, %H:%M:%S")
-
+            record = extract_record(text)
+            # receiver is None when there is no "to ... using" (Personal Contact)
+            if record.timestamp and record.amount:
                 all_transactions.append({
-                    "amount": amount,
-                    "receiver": receiver,
-                    "date": date_obj.strftime("%Y-%m-%d %H:%M:%S")
+                    "amount": record.amount,
+                    "receiver": record.receiver,
+                    "date": format_date(record.timestamp)
                 })
 
     # --- 4. Yield in batches ---
@@ -115,10 +164,199 @@ def getTransactionsInBatches(batch_size=500):
 #     for i in range(0, len(results), batch_size):
 #         yield results[i:i + batch_size]
 
-def extract_completed_transactions(
-    filename, batch_size=500, json_file="new_transactions.json"
-):
-    # Load latest transaction date from JSON
+OUTER_CELL_CLASS = "outer-cell mdl-cell mdl-cell--12-col mdl-shadow--2dp"
+BODY_CELL_CLASS = "content-cell mdl-cell mdl-cell--6-col mdl-typography--body-1"
+CAPTION_CELL_CLASS = "content-cell mdl-cell mdl-cell--12-col mdl-typography--caption"
+
+# Takeout lists activity newest first, but entries can be slightly out of
+# order. Incremental parsing stops once it sees a transaction this far
+# older than the latest one already stored.
+WATERMARK_TOLERANCE = timedelta(days=1)
+
+
+class ActivityCellParser(HTMLParser):
+    """
+    SAX-style parser for Takeout "My Activity.html".
+
+    Feed it HTML chunk by chunk; every time an outer-cell block closes, its
+    body and caption text are appended to ``cells`` as a
+    ``(main_text, caption_text)`` tuple. Only the cell currently being read
+    is kept in memory, so the file size doesn't matter.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.cells = []
+        self._depth = 0  # div depth inside the current outer cell, 0 = outside
+        self._capture = None  # "main" / "caption" while inside one of those divs
+        self._capture_depth = 0
+        self._texts = {}
+        self._parts = []
+        self._pending = []
+
+    def _flush(self):
+        # Text between two tags can arrive in several chunks, join before stripping
+        if self._pending:
+            text = "".join(self._pending).strip()
+            if text:
+                self._parts.append(text)
+            self._pending = []
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        if tag != "div":
+            return
+        cls = dict(attrs).get("class")
+        if self._depth == 0:
+            if cls == OUTER_CELL_CLASS:
+                self._depth = 1
+                self._texts = {}
+            return
+        self._depth += 1
+        if self._capture is None:
+            if cls == BODY_CELL_CLASS and "main" not in self._texts:
+                self._capture = "main"
+            elif cls == CAPTION_CELL_CLASS and "caption" not in self._texts:
+                self._capture = "caption"
+            self._capture_depth = self._depth
+
+    def handle_endtag(self, tag):
+        self._flush()
+        if tag != "div" or self._depth == 0:
+            return
+        if self._capture is not None and self._depth == self._capture_depth:
+            self._texts[self._capture] = " ".join(self._parts)
+            self._capture = None
+            self._parts = []
+        self._depth -= 1
+        if self._depth == 0:
+            self.cells.append((self._texts.get("main"), self._texts.get("caption")))
+
+    def handle_data(self, data):
+        if self._capture is not None:
+            self._pending.append(data)
+
+
+def iter_activity_cells(file, chunk_size=64 * 1024):
+    """Yield (main_text, caption_text) for each outer cell, reading ``file`` incrementally."""
+    parser = ActivityCellParser()
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        parser.feed(chunk)
+        cells, parser.cells = parser.cells, []
+        yield from cells
+    parser.close()
+    yield from parser.cells
+
+
+CELL_MARKER = b'<div class="' + OUTER_CELL_CLASS.encode()
+CHUNK_SIZE = 64 * 1024
+
+
+def _is_candidate(cell):
+    main_text, caption_text = cell
+    return (
+        main_text is not None
+        and caption_text is not None
+        and "Completed" in caption_text
+        and ("Paid" in main_text or "Sent" in main_text)
+    )
+
+
+def split_activity_ranges(filename, parts):
+    """
+    Split ``filename`` into at most ``parts`` byte ranges that each start on
+    an outer-cell boundary (the first one also holds the page header).
+    """
+    size = os.path.getsize(filename)
+    offsets = [0]
+    with open(filename, "rb") as f:
+        for i in range(1, parts):
+            pos = max(size * i // parts, offsets[-1])
+            f.seek(pos)
+            base, buf = pos, b""
+            found = size
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                buf += chunk
+                idx = buf.find(CELL_MARKER)
+                if idx >= 0:
+                    found = base + idx
+                    break
+                keep = len(CELL_MARKER) - 1
+                base += len(buf) - keep
+                buf = buf[-keep:]
+            offsets.append(found)
+    offsets.append(size)
+    return [(start, end) for start, end in zip(offsets, offsets[1:]) if end > start]
+
+
+def _parse_range(args):
+    """Process-pool worker: candidate cells in one byte range, in file order."""
+    filename, start, end = args
+    parser = ActivityCellParser()
+    # Same newline handling as reading the file in text mode
+    decoder = io.IncrementalNewlineDecoder(
+        codecs.getincrementaldecoder("utf-8")(), translate=True
+    )
+    cells = []
+    with open(filename, "rb") as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            parser.feed(decoder.decode(chunk))
+            cells.extend(cell for cell in parser.cells if _is_candidate(cell))
+            parser.cells = []
+    parser.feed(decoder.decode(b"", final=True))
+    parser.close()
+    cells.extend(cell for cell in parser.cells if _is_candidate(cell))
+    return cells
+
+
+def _parallel_cells(filename, workers):
+    # A few ranges per worker so one dense range doesn't hold up the pool
+    ranges = split_activity_ranges(filename, workers * 4)
+    print(f"Parsing {filename} in {len(ranges)} ranges with {workers} workers")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # map() returns results in submission order, so the merge is deterministic
+        for cells in pool.map(_parse_range, [(filename, a, b) for a, b in ranges]):
+            yield from cells
+
+
+def _soup_cells(filename):
+    with open(filename, "r", encoding="utf-8") as file:
+        html = file.read()
+    soup = BeautifulSoup(html, "html.parser")
+
+    for outer in soup.find_all("div", class_=OUTER_CELL_CLASS):
+        main_div = outer.find("div", class_=BODY_CELL_CLASS)
+        caption_div = outer.find("div", class_=CAPTION_CELL_CLASS)
+        yield (
+            main_div.get_text(separator=" ", strip=True) if main_div else None,
+            caption_div.get_text() if caption_div else None,
+        )
+
+
+def _stream_cells(filename):
+    if hasattr(filename, "read"):
+        yield from iter_activity_cells(filename)
+        return
+    with open(filename, "r", encoding="utf-8") as file:
+        yield from iter_activity_cells(file)
+
+
+def load_latest_date(json_file):
+    """Latest transaction date already stored in ``json_file``, or None."""
+    if json_file is None:
+        return None
     try:
         with open(json_file, "r", encoding="utf-8") as f:
             existing = json.load(f)
@@ -128,70 +366,110 @@ def extract_completed_transactions(
                 for tx in existing
             )
             print(f"Latest transaction date in JSON: {latest_date}")
-        else:
-            latest_date = None
+            return latest_date
     except (FileNotFoundError, json.JSONDecodeError, KeyError):
-        latest_date = None
+        pass
+    return None
 
-    # Parse HTML
-    with open(filename, "r", encoding="utf-8") as file:
-        html = file.read()
-    soup = BeautifulSoup(html, "html.parser")
 
-    results = []
+def _new_transactions(cells, latest_date, stop_before=None):
     seen = set()  # to avoid duplicates
 
-    # ✅ Allow 3 or 4 letter months (Sep / Sept)
-    date_pattern = re.compile(
-        r"\d{1,2} \w{3,4} \d{4}, \d{2}:\d{2}:\d{2} GMT[+-]\d{2}:\d{2}"
-    )
+    for cell in cells:
+        if not _is_candidate(cell):
+            continue
 
-    for outer in soup.find_all(
-        "div", class_="outer-cell mdl-cell mdl-cell--12-col mdl-shadow--2dp"
-    ):
-        main_div = outer.find(
-            "div",
-            class_="content-cell mdl-cell mdl-cell--6-col mdl-typography--body-1",
-        )
-        caption_div = outer.find(
-            "div",
-            class_="content-cell mdl-cell mdl-cell--12-col mdl-typography--caption",
-        )
+        main_text, caption_text = cell
+        try:
+            record = extract_record(main_text, caption_text)
+        except ValueError as e:
+            print(f"Could not parse date from: {main_text} ({e})")
+            continue
+        if record.offset is None:
+            continue
+
+        tx_date = record.timestamp
+        if stop_before is not None and tx_date < stop_before:
+            print(f"Reached watermark at {tx_date}, stopping")
+            return
 
-        if main_div and caption_div and "Completed" in caption_div.get_text():
-            main_text = main_div.get_text(separator=" ", strip=True)
-
-            if "Paid" in main_text or "Sent" in main_text:
-                match = date_pattern.search(main_text)
-                if not match:
-                    continue
-
-                date_str = match.group(0)
-                tx_text = main_text.replace(date_str, "").strip()
-
-                try:
-                    # ✅ Normalize "Sept" → "Sep"
-                    date_str = date_str.replace("Sept", "Sep")
-
-                    tx_date = datetime.strptime(
-                        date_str, "%d %b %Y, %H:%M:%S GMT%z"
-                    ).replace(tzinfo=None)
-
-                    if latest_date is None or tx_date > latest_date:
-                        key = (tx_text, tx_date.strftime("%Y-%m-%d %H:%M:%S"))
-                        if key not in seen:  # ✅ prevent duplicates
-                            seen.add(key)
-                            results.append(
-                                {
-                                    "RawText": tx_text,
-                                    "Date": tx_date.strftime("%Y-%m-%d %H:%M:%S"),
-                                }
-                            )
-                except Exception as e:
-                    print(f"Could not parse date from: {date_str} ({e})")
-                    continue
-
-    print(f"Found {len(results)} new transactions")
-
-    for i in range(0, len(results), batch_size):
-        yield results[i : i + batch_size]
\ No newline at end of file
+        if latest_date is None or tx_date > latest_date:
+            key = (record.raw_text, format_date(tx_date))
+            if key not in seen:  # ✅ prevent duplicates
+                seen.add(key)
+                yield {"RawText": key[0], "Date": key[1]}
+
+
+def extract_completed_transactions(
+    filename,
+    batch_size=500,
+    json_file="new_transactions.json",
+    streaming=False,
+    incremental=False,
+    tolerance=WATERMARK_TOLERANCE,
+    workers=None,
+    latest_date=None,
+):
+    """
+    Yield new completed Paid/Sent transactions from a Takeout activity file
+    as lists of up to ``batch_size`` {RawText, Date} records.
+
+    Only transactions newer than the latest date in ``json_file`` are
+    returned; pass ``latest_date`` to use a pinned watermark instead (see
+    run_manifest), or ``json_file=None`` for no watermark.
+
+    ``filename`` may also be an open text file (e.g. a zip member wrapped in
+    io.TextIOWrapper), which is always read in streaming mode.
+
+    With ``streaming=True`` the file is read incrementally with
+    ActivityCellParser instead of being loaded into a BeautifulSoup tree,
+    and batches are yielded as soon as they fill up.
+
+    With ``incremental=True`` (implies streaming) parsing stops at the first
+    transaction older than the stored latest date minus ``tolerance``, so a
+    re-import only reads the new part of the export.
+
+    With ``workers`` > 1 (full re-imports / backfills) the file is split on
+    outer-cell boundaries and parsed in a process pool; results are merged in
+    file order and deduped exactly as in the serial path. Ignored when
+    ``incremental`` is set, since that mode only reads the head of the file.
+    """
+    if latest_date is None:
+        latest_date = load_latest_date(json_file)
+    stop_before = None
+    if incremental:
+        streaming = True
+        workers = None
+        if latest_date is not None:
+            stop_before = latest_date - tolerance
+    elif workers and workers > 1:
+        streaming = True
+    if hasattr(filename, "read"):
+        streaming = True
+        workers = None
+
+    if not streaming:
+        results = list(_new_transactions(_soup_cells(filename), latest_date))
+        print(f"Found {len(results)} new transactions")
+
+        for i in range(0, len(results), batch_size):
+            yield results[i : i + batch_size]
+        return
+
+    batch = []
+    found = 0
+    if workers and workers > 1:
+        cells = _parallel_cells(filename, workers)
+    else:
+        cells = _stream_cells(filename)
+    for record in _new_transactions(cells, latest_date, stop_before):
+        batch.append(record)
+        if len(batch) == batch_size:
+            found += len(batch)
+            yield batch
+            batch = []
+    found += len(batch)
+    if batch:
+        yield batch
+
+    print(f"Found {found} new transactions")
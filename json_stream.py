@@ -0,0 +1,74 @@
+"""
+Incremental parsing of a JSON array that arrives in chunks, such as a streamed
+Gemini response.
+
+Each element is yielded as soon as it is complete, so callers can use the first
+records before the response has finished, and a response cut off part way
+still yields every element before the cut. Code fences or prose before the
+array are skipped, and a lone top-level object is yielded as a single element.
+"""
+
+import json
+from typing import Any, Iterable, Iterator
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+
+
+def _decode(buffer: str, pos: int):
+    """Decode the value starting at ``pos``; (value, end), or None if it isn't complete yet."""
+    try:
+        value, end = _decoder.raw_decode(buffer, pos)
+    except json.JSONDecodeError:
+        return None
+    # A number is only complete once a delimiter follows it; "1" may become "1.5"
+    if not isinstance(value, (dict, list, str)):
+        if end == len(buffer) or buffer[end] not in _WHITESPACE + ",]}":
+            return None
+    return value, end
+
+
+def iter_json_array(chunks: Iterable[str]) -> Iterator[Any]:
+    """Yield the elements of the JSON array spread over ``chunks``, each as soon as it is complete."""
+    buffer = ""
+    pos = 0
+    in_array = None  # None until the opening bracket or brace is found
+    chunks = iter(chunks)
+    final = False
+    while not final:
+        chunk = next(chunks, None)
+        if chunk is None:
+            final = True
+        else:
+            buffer += chunk
+
+        if in_array is None:
+            starts = [i for i in (buffer.find("[", pos), buffer.find("{", pos)) if i >= 0]
+            if not starts:
+                continue
+            pos = min(starts)
+            in_array = buffer[pos] == "["
+            if in_array:
+                pos += 1
+
+        if not in_array:
+            decoded = _decode(buffer, pos)
+            if decoded is not None:
+                yield decoded[0]
+                return
+            continue
+
+        while True:
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE + ",":
+                pos += 1
+            if pos == len(buffer):
+                break
+            if buffer[pos] == "]":
+                return
+            decoded = _decode(buffer, pos)
+            if decoded is None:
+                break
+            value, pos = decoded
+            yield value
+        # Drop what has been consumed so the buffer only holds the current element
+        buffer, pos = buffer[pos:], 0
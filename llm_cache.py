@@ -0,0 +1,203 @@
+"""
+Content-addressed on-disk cache of Gemini responses.
+
+Entries are keyed by a SHA-256 of the model name and the full prompt, so a
+prompt sent again (a /classify rerun over the same Takeout file, an alert email
+reprocessed after a restart) is answered by a local file read instead of a
+network round trip. Any change to the records, rules or guidelines in a prompt
+gives a new key.
+
+Each entry is one JSON file written atomically, so the API and the email
+monitor can share the directory. Entries expire after ``ttl`` seconds, and the
+least recently used ones are evicted once the directory grows past
+``max_bytes``.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "llm_response_cache")
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+EVICT_TO = 0.9  # evict down to this fraction of max_bytes so eviction doesn't run on every write
+
+
+def prompt_key(model: str, prompt: str) -> str:
+    return hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    def __init__(
+        self,
+        directory: str = LLM_CACHE_DIR,
+        ttl: float = LLM_CACHE_TTL_SECONDS,
+        max_bytes: int = LLM_CACHE_MAX_BYTES,
+    ):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.writes = 0
+        self.evictions = 0
+        # Entries and size of the directory, measured on the first write or a scanning stats() and
+        # kept up to date by this process's writes and removals; other processes' writes show up at the next scan
+        self._entries = None
+        self._bytes = None
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _scan(self):
+        """(mtime, size, path) of every entry file."""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _measure(self):
+        entries = self._scan()
+        self._entries = len(entries)
+        self._bytes = sum(size for _, size, _ in entries)
+
+    def _removed(self, size: int):
+        if self._entries is not None:
+            self._entries -= 1
+            self._bytes -= size
+
+    def get(self, model: str, prompt: str) -> Optional[str]:
+        """The cached response text for ``prompt``, or None."""
+        path = self._path(prompt_key(model, prompt))
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            text = entry["text"]
+            expired = time.time() - entry["created"] > self.ttl
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except (OSError, ValueError, KeyError, TypeError):
+            # Torn or foreign file: treat as a miss and let the next write replace it
+            expired, text = True, None
+
+        if expired:
+            try:
+                size = os.stat(path).st_size
+                os.remove(path)
+            except OSError:
+                size = None
+            with self._lock:
+                if size is not None:
+                    self._removed(size)
+                self.expired += 1
+                self.misses += 1
+            return None
+
+        try:
+            # Eviction is least recently used, by modification time
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return text
+
+    def put(self, model: str, prompt: str, text: str):
+        path = self._path(prompt_key(model, prompt))
+        data = json.dumps({"model": model, "created": time.time(), "text": text}, ensure_ascii=False)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = None
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not save LLM response cache entry {path}: {e}")
+            return
+
+        with self._lock:
+            self.writes += 1
+            if self._bytes is None:
+                self._measure()
+            else:
+                if replaced is not None:
+                    self._removed(replaced)
+                self._entries += 1
+                self._bytes += len(data.encode("utf-8"))
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Drop expired entries, then the least recently used, down to EVICT_TO of max_bytes."""
+        now = time.time()
+        entries = sorted(self._scan())
+        total = sum(size for _, size, _ in entries)
+        count = len(entries)
+        target = self.max_bytes * EVICT_TO
+        for mtime, size, path in entries:
+            if total <= target and now - mtime <= self.ttl:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            count -= 1
+            self.evictions += 1
+        self._entries = count
+        self._bytes = total
+
+    def stats(self, scan: bool = False) -> dict:
+        """
+        Counters of this cache. Entries and bytes are this process's running
+        totals; ``scan`` walks the directory to measure them exactly, which is
+        too slow for the classification path.
+        """
+        with self._lock:
+            if scan:
+                self._measure()
+            lookups = self.hits + self.misses
+            return {
+                "entries": self._entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "expired": self.expired,
+                "writes": self.writes,
+                "evictions": self.evictions,
+            }
+
+
+_cache: Optional[LLMResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMResponseCache:
+    """Process-wide cache instance."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMResponseCache()
+        return _cache
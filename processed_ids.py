@@ -0,0 +1,152 @@
+"""
+Per-user record of the email Message-IDs the monitor has already saved.
+
+Each user has an append-only log (one JSON line per ID) and an in-memory
+ordered dict of the same IDs, oldest first. Membership checks are a dict
+lookup, and recording a batch appends its lines with one write instead of
+rewriting the whole file. IDs are evicted oldest first once there are more
+than ``max_entries`` or they are older than ``ttl`` seconds. The log is
+rewritten with only the live IDs once it holds twice as many lines.
+
+A user's log is only written by the monitor watching that user, like their
+email_state file; the lock covers that monitor's classification workers.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+PROCESSED_IDS_DIR = os.getenv("PROCESSED_IDS_DIR", "processed_ids")
+PROCESSED_IDS_MAX = int(os.getenv("PROCESSED_IDS_MAX", "10000"))  # IDs kept per user
+PROCESSED_IDS_TTL_SECONDS = float(os.getenv("PROCESSED_IDS_TTL_SECONDS", str(90 * 24 * 3600)))
+LEGACY_PROCESSED_IDS_FILE = "processed_email_ids.json"  # the old shared, unordered list
+COMPACT_RATIO = 2  # rewrite the log once it has this many lines per live ID
+
+
+class ProcessedIdStore:
+    def __init__(
+        self,
+        user_id: str,
+        directory: str = PROCESSED_IDS_DIR,
+        max_entries: int = PROCESSED_IDS_MAX,
+        ttl: float = PROCESSED_IDS_TTL_SECONDS,
+    ):
+        self.user_id = user_id
+        self.path = os.path.join(directory, f"{user_id}.jsonl")
+        self.max_entries = max(max_entries, 1)
+        self.ttl = ttl
+        self.evictions = 0
+        self._ids: "OrderedDict[str, float]" = OrderedDict()  # Message-ID -> when it was saved, oldest first
+        self._lines = 0  # lines in the log, live or not
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    self._lines += 1
+                    try:
+                        entry = json.loads(line)
+                        message_id, saved_at = entry["id"], float(entry["at"])
+                    except (ValueError, KeyError, TypeError):
+                        # A line torn by a crash mid-append; the next compaction drops it
+                        continue
+                    self._ids[message_id] = saved_at
+                    self._ids.move_to_end(message_id)
+        except FileNotFoundError:
+            self._import_legacy()
+        except OSError as e:
+            print(f"Could not load processed email IDs {self.path}: {e}")
+        self._evict(time.time())
+
+    def _import_legacy(self):
+        """Seed a new log from the old shared file, so upgrading doesn't reprocess recent alerts."""
+        try:
+            with open(LEGACY_PROCESSED_IDS_FILE, "r") as f:
+                legacy = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        if legacy:
+            # The old file kept no order; all of it counts as saved now
+            self.add_many(legacy)
+
+    def __contains__(self, message_id: str) -> bool:
+        with self._lock:
+            saved_at = self._ids.get(message_id)
+            return saved_at is not None and time.time() - saved_at <= self.ttl
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._ids)
+
+    def add(self, message_id: str):
+        self.add_many([message_id])
+
+    def add_many(self, message_ids: Iterable[str]):
+        """Record several Message-IDs with one append to the log."""
+        now = time.time()
+        with self._lock:
+            new_ids = [message_id for message_id in dict.fromkeys(message_ids) if message_id]
+            if not new_ids:
+                return
+            data = "".join(json.dumps({"id": message_id, "at": now}) + "\n" for message_id in new_ids)
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(data)
+                self._lines += len(new_ids)
+            except OSError as e:
+                print(f"Could not save processed email IDs {self.path}: {e}")
+            for message_id in new_ids:
+                self._ids[message_id] = now
+                self._ids.move_to_end(message_id)
+            self._evict(now)
+            if self._lines > COMPACT_RATIO * max(len(self._ids), self.max_entries // 2):
+                self._compact()
+
+    def _evict(self, now: float):
+        """Drop the oldest IDs past max_entries or the TTL."""
+        while self._ids:
+            message_id, saved_at = next(iter(self._ids.items()))
+            if len(self._ids) <= self.max_entries and now - saved_at <= self.ttl:
+                break
+            del self._ids[message_id]
+            self.evictions += 1
+
+    def _compact(self):
+        """Rewrite the log with only the live IDs, in order."""
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(json.dumps({"id": message_id, "at": saved_at}) + "\n" for message_id, saved_at in self._ids.items())
+            os.replace(tmp_path, self.path)
+            self._lines = len(self._ids)
+        except OSError as e:
+            print(f"Could not compact processed email IDs {self.path}: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._ids),
+                "max_entries": self.max_entries,
+                "log_lines": self._lines,
+                "evictions": self.evictions,
+            }
+
+
+_stores: Dict[str, ProcessedIdStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_processed_store(user_id: Optional[str]) -> ProcessedIdStore:
+    """Process-wide store for ``user_id``; None is the store of alerts processed outside a monitor."""
+    user_id = user_id or "default"
+    with _stores_lock:
+        store = _stores.get(user_id)
+        if store is None:
+            store = _stores[user_id] = ProcessedIdStore(user_id)
+        return store
@@ -0,0 +1,331 @@
+"""
+Local receiver-name classifier trained on the labeled transaction history.
+
+new_transactions.json holds thousands of receiver -> Classification labels,
+from Gemini and from user corrections via /reclassify. This model learns
+them with multinomial naive Bayes over TF-IDF weighted character n-grams of
+the receiver name: 2 to 4 characters within each word, so "SWIGGY LTD",
+"Swiggy Instamart" and truncated names share features. Training only
+counts n-grams. New labels and corrections are learned one at a time, and
+IDF is applied at prediction time from the current document frequencies.
+
+Naive Bayes posteriors are overconfident, so the confidence needed to skip
+Gemini is calibrated on cross-validated predictions. The threshold is the
+lowest confidence above which predictions were right at least
+RECEIVER_MODEL_PRECISION of the time, by the lower end of a one-sided 95%
+confidence interval rather than the observed rate: the threshold is picked
+on those very predictions, so their own precision overstates what new
+receivers get. It is recalibrated after every RECEIVER_MODEL_RECALIBRATE
+new labels.
+
+Only the labels are saved (to RECEIVER_MODEL_FILE, with the threshold); the
+counts are rebuilt from them on load. Like the classification cache, the
+file is shared by the API and the email monitor and reloaded when another
+process has written it.
+"""
+
+import json
+import math
+import os
+import random
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from classification_cache import get_classification_cache, normalize_receiver
+
+RECEIVER_MODEL_FILE = os.getenv("RECEIVER_MODEL_FILE", "receiver_model.json")
+RECEIVER_MODEL_ENABLED = os.getenv("RECEIVER_MODEL_ENABLED", "1") == "1"
+RECEIVER_MODEL_PRECISION = float(os.getenv("RECEIVER_MODEL_PRECISION", "0.95"))  # target accuracy of skipped calls
+RECEIVER_MODEL_MIN_LABELS = int(os.getenv("RECEIVER_MODEL_MIN_LABELS", "50"))
+RECEIVER_MODEL_RECALIBRATE = int(os.getenv("RECEIVER_MODEL_RECALIBRATE", "200"))  # new labels between calibrations
+HISTORY_FILE = "new_transactions.json"
+NGRAM_SIZES = (2, 3, 4)
+SMOOTHING = 0.1
+CALIBRATION_FOLDS = 5
+CALIBRATION_MIN_SUPPORT = 20  # confident cross-validated predictions needed to trust a threshold
+CALIBRATION_Z = 1.645  # one-sided 95% bound on the calibrated precision
+NEVER = 1.01  # threshold no confidence reaches
+
+
+def precision_lower_bound(right: int, count: int, z: float = CALIBRATION_Z) -> float:
+    """Wilson score lower bound of the precision ``right / count``."""
+    p = right / count
+    centre = p + z * z / (2 * count)
+    margin = z * math.sqrt(p * (1 - p) / count + z * z / (4 * count * count))
+    return (centre - margin) / (1 + z * z / count)
+
+
+def char_ngrams(receiver: str) -> Counter:
+    """Counts of the 2-4 character n-grams of each word, padded with spaces at the word edges."""
+    counts = Counter()
+    for word in normalize_receiver(receiver).split():
+        padded = f" {word} "
+        for n in NGRAM_SIZES:
+            for i in range(len(padded) - n + 1):
+                counts[padded[i:i + n]] += 1
+    return counts
+
+
+class ReceiverModel:
+    def __init__(self, path: Optional[str] = RECEIVER_MODEL_FILE, precision: float = RECEIVER_MODEL_PRECISION):
+        self.path = path
+        self.precision = precision
+        self.threshold = NEVER
+        self.calibration: Dict[str, float] = {}
+        self.predictions = 0
+        self.confident = 0
+        self._labels: Dict[str, str] = {}  # normalized receiver -> classification
+        self._since_calibration = 0
+        self._mtime = None
+        self._lock = threading.Lock()
+        self._reset_counts()
+
+    def _reset_counts(self):
+        self._docs: Counter = Counter()  # classification -> receivers
+        self._counts: Dict[str, Counter] = {}  # classification -> n-gram counts
+        self._df: Counter = Counter()  # n-gram -> receivers containing it
+        # A class's IDF-weighted n-gram mass is (log(1 + N) + 1) * raw - log_df: both sums
+        # change only with the n-grams of a learned receiver, so no update rescans the vocabulary
+        self._raw: Counter = Counter()  # classification -> sum of its n-gram counts
+        self._log_df: Counter = Counter()  # classification -> sum of count * log(1 + df)
+
+    def _add(self, key: str, classification: str, sign: int, incremental: bool = True):
+        self._docs[classification] += sign
+        counts = self._counts.setdefault(classification, Counter())
+        for ngram, count in char_ngrams(key).items():
+            if incremental:
+                df = self._df[ngram]
+                shift = math.log(2 + df) - math.log(1 + df) if sign > 0 else math.log(df) - math.log(1 + df)
+                for other, other_counts in self._counts.items():
+                    if ngram in other_counts:
+                        self._log_df[other] += other_counts[ngram] * shift
+                self._log_df[classification] += sign * count * math.log(1 + df + sign)
+            self._df[ngram] += sign
+            counts[ngram] += sign * count
+            self._raw[classification] += sign * count
+            if counts[ngram] <= 0:
+                del counts[ngram]
+            if self._df[ngram] <= 0:
+                del self._df[ngram]
+        if self._docs[classification] <= 0:
+            for totals in (self._docs, self._counts, self._raw, self._log_df):
+                del totals[classification]
+
+    def _idf(self, ngram: str) -> float:
+        return math.log((1 + len(self._labels)) / (1 + self._df[ngram])) + 1
+
+    def _probabilities(self, receiver: str) -> Dict[str, float]:
+        ngrams = {ngram: count for ngram, count in char_ngrams(receiver).items() if ngram in self._df}
+        if not ngrams or not self._docs:
+            return {}
+        idf = {ngram: self._idf(ngram) for ngram in ngrams}
+        weights = {ngram: count * idf[ngram] for ngram, count in ngrams.items()}
+        length = sum(weights.values())
+        vocabulary = len(self._df)
+        scale = math.log(1 + len(self._labels)) + 1
+        scores = {}
+        for classification, docs in self._docs.items():
+            counts = self._counts[classification]
+            mass = scale * self._raw[classification] - self._log_df[classification]
+            likelihood = sum(
+                weight * math.log(idf[ngram] * counts.get(ngram, 0) + SMOOTHING) for ngram, weight in weights.items()
+            ) - length * math.log(mass + SMOOTHING * vocabulary)
+            # Averaged per unit of n-gram weight, so long names don't get near-certain posteriors
+            scores[classification] = (math.log(docs / len(self._labels)) + likelihood) / length
+        best = max(scores.values())
+        exp = {classification: math.exp(score - best) for classification, score in scores.items()}
+        total = sum(exp.values())
+        return {classification: value / total for classification, value in exp.items()}
+
+    def _reload_if_changed(self):
+        # The API and the email monitor both learn; pick up the other's labels
+        if not self.path:
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not load receiver model {self.path}: {e}")
+            return
+        self._labels = {}
+        self._reset_counts()
+        self._learn(saved.get("labels", {}).items(), incremental=False)
+        self.threshold = saved.get("threshold", NEVER)
+        self.calibration = saved.get("calibration", {})
+        self._since_calibration = saved.get("since_calibration", 0)
+        self._mtime = mtime
+
+    def _save(self):
+        if not self.path:
+            return
+        data = {
+            "labels": self._labels,
+            "threshold": self.threshold,
+            "calibration": self.calibration,
+            "since_calibration": self._since_calibration,
+        }
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self._mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            print(f"Could not save receiver model {self.path}: {e}")
+
+    def _learn(self, labels: Iterable[Tuple[Optional[str], Optional[str]]], incremental: bool = True) -> int:
+        """Learn labels; a bulk load (not ``incremental``) sums the log document frequencies once at the end."""
+        changed = 0
+        for receiver, classification in labels:
+            if not receiver or not classification:
+                continue
+            key = normalize_receiver(receiver)
+            previous = self._labels.get(key)
+            if previous == classification:
+                continue
+            if previous:
+                # A correction replaces the old label
+                self._add(key, previous, -1, incremental)
+            self._add(key, classification, 1, incremental)
+            self._labels[key] = classification
+            changed += 1
+        if not incremental:
+            log_df = {ngram: math.log(1 + df) for ngram, df in self._df.items()}
+            for classification, counts in self._counts.items():
+                self._log_df[classification] = sum(count * log_df[ngram] for ngram, count in counts.items())
+        return changed
+
+    def update(self, labels: Iterable[Tuple[Optional[str], Optional[str]]]):
+        """Learn (receiver, classification) pairs from Gemini or the user; later labels replace earlier ones."""
+        with self._lock:
+            self._reload_if_changed()
+            changed = self._learn(labels)
+            if not changed:
+                return
+            self._since_calibration += changed
+            if self._since_calibration >= RECEIVER_MODEL_RECALIBRATE and len(self._labels) >= RECEIVER_MODEL_MIN_LABELS:
+                self._calibrate()
+            self._save()
+
+    def train(self, labels: Iterable[Tuple[Optional[str], Optional[str]]]):
+        """Retrain from scratch on ``labels`` and calibrate."""
+        with self._lock:
+            self._labels = {}
+            self._reset_counts()
+            self._learn(labels, incremental=False)
+            self._calibrate()
+            self._save()
+
+    def predict(self, receiver: Optional[str]) -> Tuple[Optional[str], float]:
+        """The most likely classification of ``receiver`` and its confidence, or (None, 0.0)."""
+        if not receiver:
+            return None, 0.0
+        with self._lock:
+            self._reload_if_changed()
+            if len(self._labels) < RECEIVER_MODEL_MIN_LABELS:
+                return None, 0.0
+            probabilities = self._probabilities(receiver)
+        if not probabilities:
+            return None, 0.0
+        classification = max(probabilities, key=probabilities.get)
+        return classification, probabilities[classification]
+
+    def classify(self, receiver: Optional[str]) -> Optional[str]:
+        """The predicted classification if it clears the calibrated threshold, else None (ask Gemini)."""
+        classification, confidence = self.predict(receiver)
+        confident = classification is not None and confidence >= self.threshold
+        with self._lock:
+            self.predictions += 1
+            self.confident += confident
+        return classification if confident else None
+
+    def _calibrate(self):
+        """Pick the threshold from CALIBRATION_FOLDS-fold cross-validated predictions on the current labels."""
+        keys = sorted(self._labels)
+        random.Random(0).shuffle(keys)
+        scored: List[Tuple[float, bool]] = []
+        for fold in range(CALIBRATION_FOLDS):
+            held_out = keys[fold::CALIBRATION_FOLDS]
+            held_out_set = set(held_out)
+            model = ReceiverModel(path=None)
+            training = ((key, label) for key, label in self._labels.items() if key not in held_out_set)
+            model._learn(training, incremental=False)
+            for key in held_out:
+                probabilities = model._probabilities(key)
+                if probabilities:
+                    classification = max(probabilities, key=probabilities.get)
+                    scored.append((probabilities[classification], classification == self._labels[key]))
+        scored.sort(reverse=True)
+
+        # The largest set of most-confident predictions that is still surely precise enough
+        threshold, covered, right = NEVER, 0, 0
+        correct = 0
+        for count, (confidence, ok) in enumerate(scored, 1):
+            correct += ok
+            if count >= CALIBRATION_MIN_SUPPORT and precision_lower_bound(correct, count) >= self.precision:
+                threshold, covered, right = confidence, count, correct
+        self.threshold = threshold
+        self.calibration = {
+            "labels": len(self._labels),
+            "precision": round(right / covered, 4) if covered else 0.0,
+            "coverage": round(covered / len(keys), 4) if keys else 0.0,
+            "accuracy": round(sum(ok for _, ok in scored) / len(scored), 4) if scored else 0.0,
+        }
+        self._since_calibration = 0
+        print(f"Receiver model calibrated: threshold {threshold:.3f}, {self.calibration}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "labels": len(self._labels),
+                "classes": len(self._docs),
+                "threshold": round(self.threshold, 4),
+                "calibration": self.calibration,
+                "predictions": self.predictions,
+                "confident": self.confident,
+            }
+
+
+def history_labels(path: str = HISTORY_FILE) -> List[Tuple[str, str]]:
+    """
+    (Receiver, Classification) of every saved transaction, then the user's
+    corrections from the classification cache. /reclassify edits a single
+    transaction in place, so other transactions of that receiver keep the
+    old label; listing the corrections last makes them win.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            transactions = json.load(f)
+    except (FileNotFoundError, ValueError):
+        transactions = []
+    labels = [(tx.get("Receiver"), tx.get("Classification")) for tx in transactions if isinstance(tx, dict)]
+    return labels + get_classification_cache().corrections()
+
+
+_model: Optional[ReceiverModel] = None
+_model_lock = threading.Lock()
+
+
+def get_receiver_model() -> Optional[ReceiverModel]:
+    """Process-wide model, trained from the history on first use; None when RECEIVER_MODEL_ENABLED is 0."""
+    global _model
+    if not RECEIVER_MODEL_ENABLED:
+        return None
+    with _model_lock:
+        if _model is None:
+            _model = ReceiverModel()
+            with _model._lock:
+                _model._reload_if_changed()
+            if _model._mtime is None:
+                labels = history_labels()
+                if labels:
+                    print(f"Training receiver model on {len(labels)} saved transactions")
+                    _model.train(labels)
+        return _model
@@ -0,0 +1,265 @@
+"""
+Durable queue of debit alerts whose classification failed.
+
+An alert that Gemini couldn't extract (an API error, quota, malformed JSON)
+used to be lost: the email stays unread, but the monitor's UID mark moves
+past it and it is never fetched again. Such alerts are kept here as one JSON
+file each under ``pending/``, with the body and sent timestamp needed to
+classify them again. Each file has its own retry time, backed off
+exponentially. After EMAIL_RETRY_MAX_ATTEMPTS attempts, or once it is older
+than EMAIL_RETRY_MAX_AGE_SECONDS, an entry moves to ``dead/`` for a person
+to look at. Entries remember the alert's INBOX UID; once a retry saves it, a
+note under ``seen/`` tells that user's monitor to mark the email as read.
+
+email_monitor drains the queue in bulk (drain_retry_queue) on a background
+thread. After a Gemini call that extracts nothing, new ambiguous alerts go
+straight to the queue for a backed-off while instead of waiting on a failing
+model, so the monitor keeps up with incoming mail during an outage. Files are
+written atomically, and an flock on ``drain.lock`` keeps monitor processes
+from draining at the same time.
+
+Usage: python retry_queue.py [stats|drain|requeue-dead]
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+EMAIL_RETRY_DIR = os.getenv("EMAIL_RETRY_DIR", "email_retry")
+EMAIL_RETRY_BASE_DELAY = float(os.getenv("EMAIL_RETRY_BASE_DELAY", "60"))  # seconds before the first retry
+EMAIL_RETRY_MAX_DELAY = float(os.getenv("EMAIL_RETRY_MAX_DELAY", "3600"))
+EMAIL_RETRY_MAX_ATTEMPTS = int(os.getenv("EMAIL_RETRY_MAX_ATTEMPTS", "8"))
+EMAIL_RETRY_MAX_AGE_SECONDS = float(os.getenv("EMAIL_RETRY_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+EMAIL_RETRY_DRAIN_INTERVAL = float(os.getenv("EMAIL_RETRY_DRAIN_INTERVAL", "30"))  # seconds between drains
+
+
+def entry_key(user_id: Optional[str], message_id: str) -> str:
+    return hashlib.sha256(f"{user_id or ''}\0{message_id}".encode("utf-8")).hexdigest()[:32]
+
+
+class RetryQueue:
+    def __init__(self, directory: str = EMAIL_RETRY_DIR):
+        self.directory = directory
+        self.pending_dir = os.path.join(directory, "pending")
+        self.dead_dir = os.path.join(directory, "dead")
+        self.seen_dir = os.path.join(directory, "seen")
+        self.deferring_until = 0.0  # new alerts skip Gemini until then
+        self._outages = 0  # Gemini calls in a row that extracted nothing
+        self._lock = threading.Lock()
+
+    def _write(self, path: str, entry: dict):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _entries(self, directory: str) -> List[dict]:
+        entries = []
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+                    entries.append(json.load(f))
+            except (OSError, ValueError):
+                # Removed by a drain meanwhile, or a foreign file
+                continue
+        return entries
+
+    def add(self, user_id: Optional[str], message_id: str, body: str, email_timestamp: Optional[str],
+            error: str, attempts: int = 1, uid: Optional[int] = None, uidvalidity: Optional[int] = None):
+        """
+        Queue an alert for another try; ``attempts`` is 0 for alerts deferred
+        without calling Gemini. ``uid`` and ``uidvalidity`` locate the email
+        in the user's INBOX, to mark it as read once it is saved.
+        """
+        key = entry_key(user_id, message_id)
+        path = os.path.join(self.pending_dir, f"{key}.json")
+        now = time.time()
+        with self._lock:
+            if os.path.exists(path):
+                # Already queued (the email was fetched again); keep its schedule and attempts
+                return
+            entry = {
+                "key": key,
+                "user_id": user_id,
+                "message_id": message_id,
+                "body": body,
+                "email_timestamp": email_timestamp,
+                "uid": uid,
+                "uidvalidity": uidvalidity,
+                "attempts": attempts,
+                "first_failed": now,
+                "next_attempt": now + (self.delay(attempts) if attempts else 0),
+                "last_error": error,
+            }
+            try:
+                self._write(path, entry)
+            except OSError as e:
+                print(f"Could not queue email {message_id} for retry: {e}")
+                return
+        print(f"Queued email {message_id} for retry: {error}")
+
+    def delay(self, attempts: int) -> float:
+        return min(EMAIL_RETRY_MAX_DELAY, EMAIL_RETRY_BASE_DELAY * 2 ** max(attempts - 1, 0))
+
+    def record_outcome(self, extracted: bool):
+        """Note whether a Gemini call extracted anything; failures in a row defer new alerts for longer."""
+        with self._lock:
+            if extracted:
+                self._outages = 0
+                self.deferring_until = 0.0
+            else:
+                self._outages += 1
+                self.deferring_until = time.time() + self.delay(self._outages)
+
+    def deferring(self) -> bool:
+        """Whether new alerts should be queued without calling Gemini."""
+        return time.time() < self.deferring_until
+
+    def due(self, limit: Optional[int] = None, now: Optional[float] = None) -> List[dict]:
+        """Entries whose retry time has come, oldest failure first."""
+        now = time.time() if now is None else now
+        entries = sorted(
+            (entry for entry in self._entries(self.pending_dir) if entry.get("next_attempt", 0) <= now),
+            key=lambda entry: entry.get("first_failed", 0),
+        )
+        return entries[:limit] if limit else entries
+
+    def succeeded(self, entry: dict):
+        try:
+            os.remove(os.path.join(self.pending_dir, f"{entry['key']}.json"))
+        except FileNotFoundError:
+            pass
+
+    def mark_seen(self, entry: dict):
+        """A retry saved ``entry``: leave a note for its user's monitor to mark the email as read."""
+        if entry.get("uid") is None:
+            return
+        note = {key: entry.get(key) for key in ("key", "user_id", "message_id", "uid", "uidvalidity")}
+        try:
+            self._write(os.path.join(self.seen_dir, f"{entry['key']}.json"), note)
+        except OSError as e:
+            print(f"Could not note email {entry['message_id']} as read: {e}")
+
+    def take_seen(self, user_id: Optional[str], uidvalidity: Optional[int]) -> List[int]:
+        """
+        UIDs of ``user_id``'s emails saved by retries since the last call, for
+        the monitor to mark as read. Notes from an older UIDVALIDITY are
+        dropped: their UIDs may now belong to other emails.
+        """
+        uids = []
+        for note in self._entries(self.seen_dir):
+            if note.get("user_id") != user_id:
+                continue
+            if note.get("uidvalidity") == uidvalidity:
+                uids.append(note["uid"])
+            try:
+                os.remove(os.path.join(self.seen_dir, f"{note['key']}.json"))
+            except FileNotFoundError:
+                pass
+        return uids
+
+    def failed(self, entry: dict, error: str, counted: bool = True):
+        """
+        Schedule another try, or dead-letter the entry once it is out of
+        attempts or too old. ``counted`` is False when the model was
+        unavailable rather than unable to read this alert.
+        """
+        now = time.time()
+        if counted:
+            entry["attempts"] = entry.get("attempts", 0) + 1
+        entry["last_error"] = error
+        entry["next_attempt"] = now + self.delay(entry["attempts"])
+        path = os.path.join(self.pending_dir, f"{entry['key']}.json")
+        try:
+            if entry["attempts"] >= EMAIL_RETRY_MAX_ATTEMPTS or now - entry["first_failed"] > EMAIL_RETRY_MAX_AGE_SECONDS:
+                entry["dead_at"] = now
+                self._write(os.path.join(self.dead_dir, f"{entry['key']}.json"), entry)
+                os.remove(path)
+                print(f"Email {entry['message_id']} moved to {self.dead_dir} after {entry['attempts']} attempts: {error}")
+            else:
+                self._write(path, entry)
+        except OSError as e:
+            print(f"Could not reschedule email {entry['message_id']}: {e}")
+
+    def requeue_dead(self) -> int:
+        """Move every dead-lettered entry back to pending with fresh attempts; how many were moved."""
+        moved = 0
+        for entry in self._entries(self.dead_dir):
+            entry.pop("dead_at", None)
+            entry.update(attempts=0, first_failed=time.time(), next_attempt=0)
+            try:
+                self._write(os.path.join(self.pending_dir, f"{entry['key']}.json"), entry)
+                os.remove(os.path.join(self.dead_dir, f"{entry['key']}.json"))
+            except OSError as e:
+                print(f"Could not requeue email {entry.get('message_id')}: {e}")
+                continue
+            moved += 1
+        return moved
+
+    @contextmanager
+    def draining(self):
+        """Hold the drain lock, yielding False if another process is already draining."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, "drain.lock"), "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            yield True
+
+    def stats(self) -> Dict[str, int]:
+        pending = self._entries(self.pending_dir)
+        now = time.time()
+        return {
+            "pending": len(pending),
+            "due": sum(1 for entry in pending if entry.get("next_attempt", 0) <= now),
+            "dead": len(self._entries(self.dead_dir)),
+            "seen": len(self._entries(self.seen_dir)),
+        }
+
+
+_queue: Optional[RetryQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_retry_queue() -> RetryQueue:
+    """Process-wide retry queue instance."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = RetryQueue()
+        return _queue
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    retry_queue = get_retry_queue()
+    if command == "stats":
+        print(retry_queue.stats())
+    elif command == "drain":
+        # Imported here: email_monitor imports this module
+        from email_monitor import drain_retry_queue
+        print(drain_retry_queue(retry_queue))
+    elif command == "requeue-dead":
+        print(f"Requeued {retry_queue.requeue_dead()} dead-lettered email(s)")
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
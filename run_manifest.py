@@ -0,0 +1,105 @@
+"""
+Resumable run manifest for Takeout classification.
+
+A run commits its classified transactions batch by batch. The manifest is an
+append-only JSON-lines file: the first line pins the watermark (latest stored
+transaction date) the run started from, and every later line lists the
+{RawText, Date} records of one committed batch. If a run dies part way, the
+next run resumes from the pinned watermark and skips the committed records,
+instead of starting over or, worse, using the new watermark and skipping the
+older batches that were never classified.
+"""
+
+import json
+import os
+from datetime import datetime
+from typing import List, Optional
+
+from getTransactions import load_latest_date
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _record_key(tx: dict):
+    return (tx["RawText"], tx["Date"])
+
+
+class RunManifest:
+    def __init__(self, path: str, source: str, latest_date: Optional[datetime], done=None, batches: int = 0):
+        self.path = path
+        self.source = source
+        self.latest_date = latest_date
+        self.done = done if done is not None else set()
+        self.batches = batches
+
+    @classmethod
+    def open(cls, path: str, source: str, json_file: str) -> "RunManifest":
+        """Resume the unfinished run logged in ``path``, or start a new one from ``json_file``'s watermark."""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                lines = [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            lines = []
+        except json.JSONDecodeError as e:
+            # Only the last line can be torn by a crash; keep what parses
+            print(f"Run manifest {path} is damaged ({e}), recovering what is readable")
+            lines = cls._read_valid_lines(path)
+
+        if lines:
+            header = lines[0]
+            latest = header.get("watermark")
+            manifest = cls(
+                path,
+                header.get("source", source),
+                datetime.strptime(latest, DATE_FORMAT) if latest else None,
+            )
+            for entry in lines[1:]:
+                manifest.done.update(tuple(key) for key in entry.get("records", []))
+                manifest.batches += 1
+            print(
+                f"Resuming classification run for {manifest.source}: "
+                f"{manifest.batches} batches / {len(manifest.done)} transactions already committed"
+            )
+            return manifest
+
+        manifest = cls(path, source, load_latest_date(json_file))
+        manifest._append({
+            "source": source,
+            "watermark": manifest.latest_date.strftime(DATE_FORMAT) if manifest.latest_date else None,
+            "started": datetime.now().isoformat(),
+        })
+        return manifest
+
+    @staticmethod
+    def _read_valid_lines(path: str) -> List[dict]:
+        lines = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    lines.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+        return lines
+
+    def _append(self, entry: dict):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def pending(self, batch: List[dict]) -> List[dict]:
+        """The records of ``batch`` not committed by an earlier attempt."""
+        return [tx for tx in batch if _record_key(tx) not in self.done]
+
+    def mark_done(self, batch: List[dict]):
+        keys = [_record_key(tx) for tx in batch]
+        self._append({"batch": self.batches, "records": keys})
+        self.done.update(keys)
+        self.batches += 1
+
+    def finish(self):
+        """The run completed; the next one starts from a fresh watermark."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,83 @@
+"""
+Token-budget-aware batching for LLM classification.
+
+Records are packed into batches by their estimated token cost rather than by a
+fixed count, so a batch of long RawText strings doesn't overflow the response
+while short ones don't waste round trips. AdaptiveTokenBudget tunes the budget
+AIMD-style: it grows while responses come back valid and fast, shrinks when
+they get slow, and halves when a response is malformed or truncated.
+"""
+
+import threading
+from typing import List
+
+CHARS_PER_TOKEN = 4  # rough average for English text / JSON
+OUTPUT_TOKENS_PER_RECORD = 40  # the classified JSON object echoed back per record
+PROMPT_OVERHEAD_TOKENS = 600  # instructions and guidelines sent with every batch
+
+
+def estimate_tokens(record) -> int:
+    """Estimated input + output tokens one record adds to a classification call."""
+    return len(str(record)) // CHARS_PER_TOKEN + 1 + OUTPUT_TOKENS_PER_RECORD
+
+
+def take_batch(records: List, budget: int, start: int = 0) -> int:
+    """Number of ``records`` from ``start`` on that fit in one batch of ``budget`` estimated tokens."""
+    available = max(budget - PROMPT_OVERHEAD_TOKENS, 1)
+    used = 0
+    for index in range(start, len(records)):
+        used += estimate_tokens(records[index])
+        # A record larger than the budget still goes out, on its own
+        if index > start and used > available:
+            return index - start
+    return len(records) - start
+
+
+def pack_batches(records: List, budget: int) -> List[List]:
+    """Greedily pack ``records`` in order into batches of at most ``budget`` estimated tokens."""
+    batches, start = [], 0
+    while start < len(records):
+        size = take_batch(records, budget, start)
+        batches.append(records[start:start + size])
+        start += size
+    return batches
+
+
+class AdaptiveTokenBudget:
+    def __init__(
+        self,
+        budget: int = 8000,
+        min_budget: int = 1000,
+        max_budget: int = 60000,
+        target_latency: float = 20.0,
+    ):
+        self.budget = budget
+        self.min_budget = min_budget
+        self.max_budget = max_budget
+        self.target_latency = target_latency
+        self.successes = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    @property
+    def current(self) -> int:
+        with self._lock:
+            return self.budget
+
+    def record_success(self, latency: float):
+        with self._lock:
+            self.successes += 1
+            if latency > self.target_latency:
+                self.budget = max(self.min_budget, int(self.budget * 0.75))
+            else:
+                self.budget = min(self.max_budget, self.budget + max(self.budget // 10, 100))
+
+    def record_failure(self):
+        """A malformed or truncated response: the batch was probably too big."""
+        with self._lock:
+            self.failures += 1
+            self.budget = max(self.min_budget, self.budget // 2)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"budget": self.budget, "successes": self.successes, "failures": self.failures}